@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Puts a coarse set of latitudes through NASA's Planetary Spectrum Generator and adds latitudes only where
+  neighbouring spectra differ, interpolating the spectra of the latitudes skipped
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import json
+import numpy as np
+from pathlib import Path
+from limb_extraction import extract_limbs
+from psg_output import flush_indexes, rad_columns, read_named_section, section_from_text
+from spectrum_aggregator import SpectrumAggregator, spectrum_fingerprint
+
+
+def interpolation_weights(sampled, latitudes):
+
+    """ Weight of each sampled latitude in the mean over all latitudes when the spectra of the latitudes
+        in between are interpolated linearly from their two sampled neighbours
+        The mean of the interpolated spectra equals the weighted mean of the sampled ones, so skipped latitudes
+        never have to be built explicitly
+        sampled must include the first and last latitude; returns a list of weights adding up to latitudes """
+
+    sampled = sorted(sampled)
+    if sampled[0] != 0 or sampled[-1] != latitudes-1:
+        raise ValueError('Sampled latitudes must include 0 and %s' %(latitudes-1))
+
+    weights = {latitude: 1.0 for latitude in sampled}
+    for south, north in zip(sampled, sampled[1:]):
+        for latitude in range(south+1, north):
+            fraction = (latitude - south)/(north - south)
+            weights[south] += 1 - fraction
+            weights[north] += fraction
+
+    return [weights[latitude] for latitude in sampled]
+
+
+def refine(sampled, transits, threshold):
+
+    """ Latitudes to add: the midpoint of each pair of neighbouring sampled latitudes whose transit spectra
+        differ by more than threshold (ppm) at any wavelength """
+
+    sampled = sorted(sampled)
+    added = []
+    for south, north in zip(sampled, sampled[1:]):
+        if north - south > 1 and np.max(np.abs(transits[south] - transits[north]))*1e6 > threshold:
+            added.append((south + north)//2)
+
+    return added
+
+
+def sample_day(daypath, cubes, day, client, write_configs, trn_columns, step=8, threshold=10.0, limbs=(36,108)):
+
+    """ Adaptive latitude sampling of one day, for each limb separately:
+        Starts with every step-th latitude (and the last one), puts their configs through the PSG with client,
+        then keeps adding the midpoint between neighbouring latitudes whose transit spectra (rad column 5) differ by
+        more than threshold ppm, until no pair does or all latitudes in between have been run
+        write_configs(daypath, coords, profiles) is the config writer of the run (ColumnWriter.write_configs)
+        The day's mean spectra saved in output/ count the skipped latitudes as interpolated spectra,
+        and output/sampling.json lists the latitudes run and their weights
+        Returns the coords that were run and their weights """
+
+    Path(str(daypath)+'configfiles/').mkdir(exist_ok=True)
+    Path(str(daypath)+'spectra/').mkdir(exist_ok=True)
+    Path(str(daypath)+'output/').mkdir(exist_ok=True)
+
+    coords, profiles = extract_limbs(cubes, day, limbs)
+    columns = {coord: number for number, coord in enumerate(coords)}
+    latitudes = len(coords)//len(limbs)
+    # Extraction is cheap next to PSG, so all columns are extracted and only the ones needed are rendered
+
+    sampled = {limb: set(list(range(0, latitudes, step)) + [latitudes-1]) for limb in limbs}
+    transits = {limb: {} for limb in limbs}
+    pending = [(latitude, limb) for limb in limbs for latitude in sorted(sampled[limb])]
+    while pending:
+        configs = write_configs(daypath, pending, profiles[[columns[coord] for coord in pending]])
+        outnames = [str(daypath) + 'spectra/trn_%s_%s.txt' %(latitude, limb) for latitude, limb in pending]
+
+        def collect(index, spectrum, batch=pending):
+            latitude, limb = batch[index]
+            transits[limb][latitude] = section_from_text(spectrum, 'rad', fix_sign=True)[:,5]
+        # Only the transit column is kept in memory for the comparisons
+
+        client.submit_batch(configs, outnames, callback=collect)
+        pending = []
+        for limb in limbs:
+            added = refine(sampled[limb], transits[limb], threshold)
+            sampled[limb].update(added)
+            pending += [(latitude, limb) for latitude in added]
+        # Next pass: only the latitudes between neighbours that still disagree
+
+    run, weights = [], []
+    for limb in limbs:
+        run += [(latitude, limb) for latitude in sorted(sampled[limb])]
+        weights += interpolation_weights(sampled[limb], latitudes)
+    # Both limbs count equally in the mean, as in a full run
+
+    sources = ['trn_%s_%s.txt' %(coord) for coord in run]
+    rad_mean = SpectrumAggregator(rad_columns, sources)
+    trn_mean = SpectrumAggregator(trn_columns, sources)
+    for number, (latitude, limb) in enumerate(run):
+        filename = str(daypath) + 'spectra/trn_%s_%s.txt' %(latitude, limb)
+        source = sources[number]
+        record = spectrum_fingerprint(filename)
+        rad_mean.add(read_named_section(filename, 'rad', fix_sign=True), source=source, weight=weights[number],
+                     fingerprint=record)
+        trn_mean.add(read_named_section(filename, 'trn'), source=source, weight=weights[number], fingerprint=record)
+    flush_indexes()
+    rad_mean.save(str(daypath) + 'output/rad_mean.npz')
+    trn_mean.save(str(daypath) + 'output/trn_mean.npz')
+    # Weights are only known once sampling has finished, so the saved spectra are read back for the means
+
+    with open(str(daypath) + 'output/sampling.json', 'w') as file:
+        json.dump({'step': step, 'threshold': threshold, 'latitudes': latitudes,
+                   'coords': [list(coord) for coord in run], 'weights': weights}, file, indent=1)
+
+    return run, weights
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Benchmarks the pipeline stages on synthetic UM cubes against a local stand-in for NASA's Planetary Spectrum
+  Generator, reporting throughput and peak memory per stage for one day and for a batch of days
+- Optionally checks that the float32 mode gives the same configs and mean spectra as float64 (see precision_check)
+
+Run as a script, e.g. python benchmark.py --days 3 --latency 0.05
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+import config_writer
+import precision_check
+import rapid_config
+from limb_extraction import extract_limbs
+from psg_client import PSGClient
+from psg_output import rad_columns, cloud_trn_columns
+from psg_template import template_layouts
+from spectrum_aggregator import aggregate_files
+
+
+def synthetic_cubes(days=2, levels=62, latitudes=90, longitudes=144, clouds=True, seed=0):
+
+    """ Cubes shaped like the UM output, (time, model level, latitude, longitude), with the same standard names,
+        units and level_height coordinate, and smooth profiles with some noise:
+        pressure falling and potential temperature rising with height, moisture and cloud near the surface """
+
+    import iris.coords
+    import iris.cube
+
+    rng = np.random.default_rng(seed)
+    shape = (days, levels, latitudes, longitudes)
+    height = np.linspace(20.0, 60000.0, levels)
+    latitude = np.linspace(-89.0, 89.0, latitudes)
+    longitude = np.linspace(0.0, 357.5, longitudes)
+    warm = np.cos(np.radians(latitude))[np.newaxis,np.newaxis,:,np.newaxis]*np.ones(shape)
+    # Warmer, wetter columns towards the equator
+
+    def noise(scale):
+        return 1 + scale*rng.standard_normal(shape)
+
+    fields = {'air_pressure': ('Pa', 1e5*np.exp(-height/7000.0)[np.newaxis,:,np.newaxis,np.newaxis]*noise(0.002)),
+              'air_potential_temperature': ('K', (220 + 40*warm)*np.exp(height/40000.0)[np.newaxis,:,np.newaxis,np.newaxis]
+                                            *noise(0.01)),
+              'specific_humidity': ('kg kg-1', 5e-3*warm*np.exp(-height/3000.0)[np.newaxis,:,np.newaxis,np.newaxis]
+                                    *noise(0.1))}
+    if clouds:
+        cloud_levels = np.exp(-((height - 3000.0)/2000.0)**2)[np.newaxis,:,np.newaxis,np.newaxis]
+        fields['mass_fraction_of_cloud_liquid_water_in_air'] = ('kg kg-1', 1e-5*warm*cloud_levels*rng.random(shape))
+        fields['mass_fraction_of_cloud_ice_in_air'] = ('kg kg-1', 1e-6*cloud_levels*rng.random(shape))
+
+    cubes = iris.cube.CubeList()
+    for name, (units, data) in fields.items():
+        cube = iris.cube.Cube(data.astype(np.float32), standard_name=name, units=units)
+        cube.add_dim_coord(iris.coords.DimCoord(np.arange(days, dtype=np.float64)*24, standard_name='time',
+                                                units='hours since 1970-01-01 00:00:00'), 0)
+        cube.add_dim_coord(iris.coords.DimCoord(np.arange(1, levels+1), standard_name='model_level_number'), 1)
+        cube.add_dim_coord(iris.coords.DimCoord(latitude, standard_name='latitude', units='degrees'), 2)
+        cube.add_dim_coord(iris.coords.DimCoord(longitude, standard_name='longitude', units='degrees'), 3)
+        cube.add_aux_coord(iris.coords.AuxCoord(height, long_name='level_height', units='m'), 1)
+        cubes.append(cube)
+
+    return cubes
+
+
+def synthetic_templates(path):
+
+    """ Write template config files with the layouts in psg_template.template_layouts to path:
+        header lines, empty atmosphere layers where the real templates have them, and a few lines after """
+
+    Path(str(path)).mkdir(parents=True, exist_ok=True)
+    for name, (start, layers, fields) in template_layouts.items():
+        lines = ['<OBJECT-%s>Benchmark value %s\n' %(number, number) for number in range(start)]
+        lines += ['<ATMOSPHERE-LAYER-%s>\n' %(layer+1) for layer in range(layers)]
+        lines += ['<GENERATOR-%s>Benchmark value\n' %(number) for number in range(20)]
+        with open(str(path) + '/' + name, 'w') as file:
+            file.writelines(lines)
+
+
+def psg_rows(values):
+
+    """ Lines of PSG output for an array of shape (rows, columns): %.5e numbers separated by two spaces,
+        or one before a minus sign, as PSG writes them """
+
+    row = '%.5e' + ' % .5e'*(values.shape[1]-1) + '\n'
+    # The space flag puts a blank where a positive number has no sign
+
+    return (row*values.shape[0]) %tuple(values.ravel().tolist())
+
+
+fake_types = ('rad', 'noi', 'trn', 'lyr')
+# Output types the stand-in returns for type=all
+
+
+def fake_spectrum(config, points=2000, types=fake_types):
+
+    """ PSG-style output for a config: comment header, then the radiance and transmittance sections with
+        PSG's column labels, depending on the water in the config's atmosphere layers, and for the other types
+        (noi, lyr) filler sections of the same length """
+
+    water = 0.0
+    for line in config.splitlines():
+        if line.startswith('<ATMOSPHERE-LAYER-'):
+            water += float(line.split('>')[1].split(',')[4])
+    wavelengths = np.linspace(0.6, 5.0, points)
+    depth = np.clip(1e-4*(1 + 10*water*(1 + np.sin(6*wavelengths))), 0, 0.5)
+    ones = np.ones(points)
+
+    text = '# Planetary Spectrum Generator (stand-in for benchmarking)\n# Spectral resolution %s points\n' %(points)
+    if 'rad' in types:
+        text += '# Wave/freq [um] Total Noise Stellar Planet Transit Blocked\n'
+        text += psg_rows(np.stack([wavelengths, 1 - depth, 1e-5*ones, ones, 0*ones, -depth, depth], axis=1))
+    if 'noi' in types:
+        text += '# Noise\n# Wave/freq [um] Total Source Detector Telescope Background\n'
+        text += psg_rows(np.stack([wavelengths] + [1e-5*ones]*5, axis=1))
+    if 'trn' in types:
+        text += '# Transmittance\n# Wave/freq [um] Total N2 H2O CO2 Ice Water Rayleigh CIA\n'
+        text += psg_rows(np.stack([wavelengths, 1 - depth, ones, 1 - 0.8*depth, 1 - 0.1*depth, ones, 1 - 0.1*depth,
+                                   1 - 0.05*depth, ones], axis=1))
+    if 'lyr' in types:
+        text += '# Layer contributions\n# Wave/freq [um] Layer1 Layer2 Layer3 Layer4 Layer5 Layer6 Layer7 Layer8\n'
+        text += psg_rows(np.stack([wavelengths] + [depth/8]*8, axis=1))
+
+    return text
+
+
+class FakePSG:
+
+    """ Local HTTP server standing in for PSG's api.php
+        Each request waits latency seconds (to mimic PSG's run time) before returning fake_spectrum of its config
+        Runs in a separate process where processes can be forked, so making the spectra does not compete with
+        the pipeline for the interpreter, and in a thread otherwise
+        Counts requests; use as a context manager or call start and stop """
+
+    def __init__(self, latency=0.0, points=2000, port=0):
+        self.latency = latency
+        self.points = points
+        self.counter = multiprocessing.Value('i', 0)
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                form = urllib.parse.parse_qs(body, keep_blank_values=True)
+                with fake.counter.get_lock():
+                    fake.counter.value += 1
+                time.sleep(fake.latency)
+                types = fake_types if form.get('type', ['all'])[0] == 'all' else tuple(form['type'][0].split(','))
+                out = fake_spectrum(form['file'][0], fake.points, types).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%s/api.php' %(self.server.server_address[1])
+        self.runner = None
+
+    @property
+    def requests(self):
+        return self.counter.value
+
+    def start(self):
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self.runner = multiprocessing.get_context('fork').Process(target=self.server.serve_forever, daemon=True)
+        else:
+            self.runner = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.runner.start()
+        return self
+
+    def stop(self):
+        if isinstance(self.runner, threading.Thread):
+            self.server.shutdown()
+        else:
+            self.runner.terminate()
+            self.runner.join()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class Stages:
+
+    """ Wall time and items per stage, added up over repeated runs of the stage, or with measure='memory'
+        the largest amount of memory a run of the stage allocated on top of what was allocated before it """
+
+    def __init__(self, results, measure='time'):
+        self.results = results
+        self.measure = measure
+
+    @contextlib.contextmanager
+    def stage(self, name, items, unit):
+        result = self.results.setdefault(name, {'items': 0, 'seconds': 0.0, 'rate': 0.0, 'unit': unit, 'peak_mb': 0.0})
+        if self.measure == 'memory':
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            yield
+            peak = tracemalloc.get_traced_memory()[1] - before
+            result['peak_mb'] = max(result['peak_mb'], peak/2**20)
+            return
+
+        start = time.perf_counter()
+        yield
+        result['items'] += items
+        result['seconds'] += time.perf_counter() - start
+        result['rate'] = result['items']/result['seconds'] if result['seconds'] else float('inf')
+
+
+def run_stages(stages, path, cubes, client, workers):
+
+    """ One pass over the benchmarked stages: every day stage by stage, then batch_job over all days """
+
+    days = cubes[0].shape[0]
+    for day in range(days):
+        daypath = path + 'bench_day%s/' %(day)
+        for folder in ('', 'configfiles/', 'spectra/', 'output/'):
+            Path(daypath + folder).mkdir(parents=True, exist_ok=True)
+
+        with stages.stage('extract', 2*cubes[0].shape[2], 'columns'):
+            coords, profiles = extract_limbs(cubes, day)
+        with stages.stage('render', len(coords), 'configs'):
+            configs = config_writer.write_configs(daypath, coords, profiles)
+        outnames = [daypath + 'spectra/trn_%s_%s.txt' %(coord) for coord in coords]
+        with stages.stage('submit', len(configs), 'spectra'):
+            client.submit_batch(configs, outnames)
+        with stages.stage('aggregate', len(outnames), 'spectra'):
+            aggregate_files(outnames, 'rad', rad_columns, fix_sign=True)
+            aggregate_files(outnames, 'trn', cloud_trn_columns)
+        with stages.stage('rapid_config', 1, 'days'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                rapid_config.rapid_config(daypath, cubes, day)
+
+    batchpath = path + 'batch/'
+    Path(batchpath).mkdir(exist_ok=True)
+    with stages.stage('batch_job', days, 'days'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            config_writer.batch_job(batchpath, cubes, 0, days-1, client=client, workers=workers)
+
+
+def run_benchmark(days=2, latency=0.05, points=2000, psg_workers=8, workers=1, path=None, trace_memory=True,
+                  psg_servers=1, types=None, precision=False):
+
+    """ Time the pipeline on synthetic cubes for days model days:
+        per day - extract (columns/s), render (configs/s), submit to the stand-in PSG (spectra/s),
+        aggregate the saved spectra (spectra/s), rapid_config (days/s)
+        then config_writer.batch_job end to end over all days (days/s), with workers processes
+        Requests are spread over psg_servers stand-in PSG servers, asking for only the output types in types
+        (see psg_client.output_params) or for all of them if None
+        With trace_memory the stages are run a second time under tracemalloc, which slows them too much
+        to time, for the peak memory each stage allocates in this process (MB)
+        With precision, the configs of day 0, the limb-mean configs of all days and the mean spectra of day 0
+        are also made in float32 and compared with float64 (see precision_check), under 'precision'
+        Returns a dictionary of results per stage """
+
+    workdir = tempfile.TemporaryDirectory() if path is None else None
+    path = workdir.name + '/' if path is None else str(path)
+    synthetic_templates(path + 'templates')
+    config_writer.templatepath = path + 'templates'
+    rapid_config.templatepath = path + 'templates'
+    # Point the config writers at the synthetic templates
+
+    results = {}
+    try:
+        cubes = synthetic_cubes(days)
+        with contextlib.ExitStack() as stack:
+            servers = [stack.enter_context(FakePSG(latency, points)) for server in range(psg_servers)]
+            client = stack.enter_context(PSGClient([psg.url for psg in servers], workers=psg_workers, types=types))
+            run_stages(Stages(results), path, cubes, client, workers)
+            if trace_memory:
+                tracemalloc.start()
+                try:
+                    run_stages(Stages(results, 'memory'), path, cubes, client, workers)
+                finally:
+                    tracemalloc.stop()
+            results['psg_requests'] = sum(psg.requests for psg in servers)
+            spectra = list(Path(path + 'bench_day0/spectra/').glob('*.txt'))
+            results['spectrum_kb'] = sum(spectrum.stat().st_size for spectrum in spectra)/len(spectra)/1024
+            results['psg_servers'] = client.throughput()
+            if precision:
+                results['precision'] = precision_check.check_configs(cubes, 0, templatepath=path + 'templates')
+                results['precision']['limb_means'] = precision_check.check_limb_means(cubes, 0, days-1,
+                                                                                      templatepath=path + 'templates')
+                for section, columns, fix_sign in (('rad', rad_columns, True), ('trn', cloud_trn_columns, False)):
+                    results['precision'][section + '_mean'] = precision_check.check_means(sorted(map(str, spectra)),
+                                                                                          section, columns, fix_sign)
+    finally:
+        if workdir is not None:
+            workdir.cleanup()
+
+    return results
+
+
+def report(results):
+
+    """ Print benchmark results as a table """
+
+    print('%-14s %10s %10s %14s %12s' %('stage', 'items', 'seconds', 'rate', 'peak MB'))
+    for name, result in results.items():
+        if not isinstance(result, dict) or 'items' not in result:
+            continue
+        # Skip the totals and the per-server throughput
+        print('%-14s %10s %10.3f %8.1f %-5s %12.1f' %(name, result['items'], result['seconds'], result['rate'],
+                                                    result['unit'] + '/s', result['peak_mb']))
+    print('PSG requests: %s, %.1f kB per spectrum' %(results.get('psg_requests'), results.get('spectrum_kb', 0)))
+    for url, server in results.get('psg_servers', {}).items():
+        print('  %s: %s requests, %s failed, %.1f requests/s' %(url, server['requests'], server['failures'],
+                                                               server['rate'] or 0))
+    for name, check in results.get('precision', {}).items():
+        if 'max_digits' in check:
+            print('float32 %s: %s of %s values differ, at most %s in the last digit'
+                  %(name, check['differing'], check['values'], check['max_digits']))
+        else:
+            print('float32 %s: largest relative difference %.2e, %s printed precision'
+                  %(name, check['max_relative'], 'within' if check['within'] else 'outside'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the PSG pipeline on synthetic UM data')
+    parser.add_argument('--days', type=int, default=2, help='model days to run')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the stand-in PSG takes per request')
+    parser.add_argument('--points', type=int, default=2000, help='wavelengths per spectrum')
+    parser.add_argument('--psg-workers', type=int, default=8, help='concurrent PSG requests')
+    parser.add_argument('--psg-servers', type=int, default=1, help='stand-in PSG servers to spread requests over')
+    parser.add_argument('--types', default=None, help='PSG output types to ask for, such as rad,trn (all if not given)')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for batch_job')
+    parser.add_argument('--path', default=None, help='directory for the output (a temporary one if not given)')
+    parser.add_argument('--no-memory', action='store_true', help='timings only, without the second pass for memory')
+    parser.add_argument('--precision', action='store_true', help='also compare the float32 mode with float64')
+    arguments = parser.parse_args()
+
+    report(run_benchmark(arguments.days, arguments.latency, arguments.points, arguments.psg_workers,
+                         arguments.workers, arguments.path, not arguments.no_memory, arguments.psg_servers,
+                         arguments.types.split(',') if arguments.types else None, arguments.precision))
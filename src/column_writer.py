@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Writes a config product for every column on the limb of model days and puts the configs through the PSG,
+  for any column product: config_writer and vapour_only_config are this for the cloud and vapour-only templates
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import numpy as np
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from limb_extraction import extract_limbs
+from spectrum_aggregator import limb_aggregators, spectrum_fingerprint
+from day_archive import day_archive, config_member, spectrum_member
+from parallel_batch import run_days
+from profile_clusters import reduce_profiles, save_report
+from adaptive_sampling import sample_day
+from pipeline import run_pipeline, pipeline_stages
+from work_queue import run_worker
+from psg_client import PSGClient
+from instrumentation import log, stats
+
+
+class ColumnWriter:
+
+    """ One column config product run over model days:
+        spec - the output_specs.OutputSpec written for each column
+        trn_columns - the columns of the transmittance section of its spectra (psg_output)
+        dayname - folder of each day under the parent path, a % pattern for the day number
+        templatepath - folder holding the template
+        default_url - PSG that configs go to when no client is given, one request at a time;
+        None to only write the configs then
+        Picklable, so its methods can be sent to worker processes (parallel_batch) """
+
+    def __init__(self, spec, trn_columns, dayname, templatepath, default_url=None):
+        self.spec = spec
+        self.trn_columns = trn_columns
+        self.dayname = dayname
+        self.templatepath = templatepath
+        self.default_url = default_url
+
+    def daypath(self, parentpath, day):
+
+        """ Folder of one day, made if needed """
+
+        daypath = str(parentpath) + self.dayname %(day)
+        Path(str(daypath)).mkdir(exist_ok=True)
+
+        return daypath
+
+    @contextmanager
+    def submitting(self, client):
+
+        """ The client to put configs through PSG with: client if given, otherwise a client of default_url
+            for the duration (closed afterwards), or None if configs are only written """
+
+        if client is None and self.default_url is not None:
+            with PSGClient(self.default_url, workers=1) as client:
+                yield client
+        else:
+            yield client
+
+    def write_config(self, daypath, cubes, day, coords=(-1,45,36)):
+
+        """ Write the config of one model column, coords (day, latitude, longitude), labelled with its array
+            coordinates, and return its lines """
+
+        limb_coords, profiles = extract_limbs(cubes, day, limbs=(coords[2],))
+        # Extract only the limb the column sits on
+
+        configs = self.write_configs(daypath, [(coords[1], coords[2])], profiles[coords[1]:coords[1]+1])
+
+        return configs[0].splitlines(keepends=True)
+
+    def write_configs(self, daypath, coords, profiles, archive=None):
+
+        """ For a batch of model columns extracted by extract_limbs:
+            Renders every column's profiles into the template Planetary Spectrum Generator config file,
+            regridded first onto fewer layers if the product asks for it (see OutputSpec.regrid)
+            Outputs one text file per column labelled with its array coordinates,
+            or one member per column of archive (a day_archive.DayArchive) if given """
+
+        coords, profiles = self.spec.select(coords, profiles)
+        profiles, errors = self.spec.regrid(profiles)
+        if errors is not None:
+            log('%s %s: %s layers, relative errors %s' %(daypath, self.spec.name, profiles.shape[1],
+                ', '.join('%s %.2e' %(name, error) for name, error in errors.items())))
+        configs = self.spec.render(profiles, self.templatepath)
+        # Template is parsed once per process and all columns are formatted in one batch
+
+        for (latitude, longitude), config in zip(coords, configs):
+            if archive is not None:
+                archive.write(config_member(latitude, longitude), config)
+                continue
+            with open(str(daypath) + 'configfiles/config_%s_%s.txt' %(latitude, longitude), 'w') as file:
+                file.write(config)
+            # Write to a text file labeled with array column coordinates
+        stats.add('render', bytes_written=sum(len(config) for config in configs))
+
+        return configs
+
+    def write_day(self, daypath, cubes, day=-1, clusters=None, tolerance=None, archive=False, dtype=np.float64):
+
+        """ Write PSG config files for every column on the limb of one day
+            With clusters (number of groups) or tolerance, only one representative column per group of similar
+            columns is written (see profile_clusters), and the grouping is saved to output/clusters.json
+            With archive, the configs go into the day's archive file (day_archive) instead of configfiles/
+            dtype=np.float32 extracts the profiles in single precision, half the memory
+            (see limb_extraction.extract_limbs)
+            Returns the column coordinates, the config texts, ready to be put through the PSG,
+            and the number of columns each config stands for (None if not clustered) """
+
+        if not archive:
+            Path(str(daypath)+'configfiles/').mkdir(exist_ok=True)
+            Path(str(daypath)+'spectra/').mkdir(exist_ok=True)
+            Path(str(daypath)+'plots/').mkdir(exist_ok=True)
+        Path(str(daypath)+'output/').mkdir(exist_ok=True)
+
+        coords, profiles = extract_limbs(cubes, day, limbs=(36,108), dtype=dtype)
+        # One extraction pass for all 180 limb columns of the day
+
+        weights = None
+        if clusters is not None or tolerance is not None:
+            coords, profiles, weights, report = reduce_profiles(coords, profiles, k=clusters, tolerance=tolerance)
+            save_report(str(daypath) + 'output/clusters.json', report)
+            log('Day %s: %s columns in %s groups, largest relative profile error %.2e'
+                  %(day, report['columns'], report['groups'], max(report['profile_error'].values())), 2)
+        # Optional reduction to representative columns, each counted once per member in the mean spectra
+
+        if archive:
+            with day_archive(daypath, 'a') as day_file:
+                configs = self.write_configs(daypath, coords, profiles, day_file)
+        else:
+            configs = self.write_configs(daypath, coords, profiles)
+
+        return coords, configs, weights
+
+    def submit_day(self, daypath, coords, configs, client, weights=None, archive=False):
+
+        """ Send one day's configs to PSG concurrently, save the spectra (to the day's archive file if archive),
+            and save the day's running mean spectra """
+
+        if archive:
+            with day_archive(daypath, 'a') as day_file:
+                fingerprint = lambda source: day_file.fingerprint('spectra/' + source)
+                rad_mean, trn_mean, aggregate = limb_aggregators(coords, self.trn_columns, weights, fingerprint)
+                def save(index, spectrum):
+                    day_file.write(spectrum_member(*coords[index]), spectrum)
+                    aggregate(index, spectrum)
+                client.submit_batch(configs, callback=save)
+        else:
+            outnames = [str(daypath) + 'spectra/trn_%s_%s.txt' %(latitude, longitude) for latitude, longitude in coords]
+            fingerprint = lambda source: spectrum_fingerprint(str(daypath) + 'spectra/' + source)
+            rad_mean, trn_mean, aggregate = limb_aggregators(coords, self.trn_columns, weights, fingerprint)
+            client.submit_batch(configs, outnames, callback=aggregate)
+        rad_mean.save(str(daypath) + 'output/rad_mean.npz')
+        trn_mean.save(str(daypath) + 'output/trn_mean.npz')
+        # Day's mean spectra are ready as soon as the last column comes back
+
+    def day_generator(self, daypath, cubes, day=-1, client=None, clusters=None, tolerance=None, archive=False,
+                      dtype=np.float64):
+
+        """ Write PSG config files for every column on the limb of one day (see write_day)
+            and put them through the PSG with client (see submitting), saving the spectra and the day's means """
+
+        coords, configs, weights = self.write_day(daypath, cubes, day, clusters, tolerance, archive, dtype)
+        with self.submitting(client) as client:
+            if client is None:
+                log('Written configs for day: ' + str(day))
+                return
+            self.submit_day(daypath, coords, configs, client, weights, archive)
+        log('Finished day: ' + str(day))
+
+    def batch_job(self, parentpath, cubes, first, last, client=None, workers=1, clusters=None, tolerance=None,
+                  archive=False, dtype=np.float64):
+
+        """ Write (and put through the PSG, see submitting) configs for days first to last
+            With workers > 1 the days are spread over a pool of processes that share the cubes;
+            spectra are submitted from this process as each day's configs are finished
+            clusters, tolerance, archive and dtype are as for write_day """
+
+        with self.submitting(client) as client:
+            if workers == 1:
+                for day in range(first,last+1):
+                    self.day_generator(self.daypath(parentpath, day), cubes, day, client, clusters, tolerance,
+                                       archive, dtype)
+                return
+
+            tasks = [(self.daypath(parentpath, day), day) for day in range(first,last+1)]
+            write = partial(self.write_day, clusters=clusters, tolerance=tolerance, archive=archive, dtype=dtype)
+            # Options bound to a method of this picklable writer, so it can be sent to the worker processes
+
+            for number, (daypath, day, (coords, configs, weights)) in enumerate(run_days(write, tasks, cubes, workers)):
+                if client is not None:
+                    self.submit_day(daypath, coords, configs, client, weights, archive)
+                log('Finished day: %s (%s of %s)' %(day, number+1, len(tasks)))
+
+    def adaptive_job(self, parentpath, cubes, first, last, client=None, step=8, threshold=10.0):
+
+        """ Put days first to last through the PSG with adaptive latitude sampling (see adaptive_sampling.sample_day):
+            coarse latitudes first, more only where neighbouring transit spectra differ by more than threshold ppm
+            Days run one after another, each pass over a day's latitudes is sent to PSG concurrently by client """
+
+        with self.submitting(client) as client:
+            if client is None:
+                raise ValueError('Adaptive sampling needs a PSG client: it picks latitudes from the spectra')
+            for day in range(first,last+1):
+                run, weights = sample_day(self.daypath(parentpath, day), cubes, day, client, self.write_configs,
+                                          self.trn_columns, step, threshold)
+                log('Finished day: %s (%s columns run)' %(day, len(run)))
+
+    def pipeline_job(self, parentpath, cubes, first, last, client=None, stages=pipeline_stages, sourcefiles=None):
+
+        """ Resumable run of days first to last: extract, render, submit and aggregate as separate stages,
+            skipping anything parentpath/manifest.jsonl shows is already done (see pipeline.run_pipeline)
+            Without a client (see submitting) only the extract and render stages of stages are run """
+
+        with self.submitting(client) as client:
+            if client is None:
+                stages = [stage for stage in stages if stage in pipeline_stages[:2]]
+            return run_pipeline(parentpath, cubes, first, last, client, self.write_configs, self.trn_columns,
+                                self.dayname, stages=stages, template=str(self.templatepath) + '/' + self.spec.template,
+                                sourcefiles=sourcefiles)
+
+    def queue_job(self, parentpath, cubes, queuepath, client=None, batch=18, **options):
+
+        """ Run one worker on a shared work queue of (day, latitude, limb) units made by work_queue.enqueue_days:
+            configs (and with a client, spectra and day means) are written in place under parentpath
+            Start this on as many processes and nodes as wanted (see work_queue.run_worker) """
+
+        return run_worker(queuepath, parentpath, cubes, client, self.write_configs, self.trn_columns, self.dayname,
+                          batch, **options)
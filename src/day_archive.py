@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Keeps one day's PSG config files and spectra as members of a single uncompressed zip file instead of
+  hundreds of small files, so a day costs one inode on the shared datastore
+- Members are read straight out of the archive through its index, without extracting them
+- Written members are collected in a side file and the archive is replaced in one step when it is closed
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import os
+import shutil
+import threading
+import warnings
+import zipfile
+import numpy as np
+from psg_output import section_from_text
+
+
+archive_filename = 'day.zip'
+# Name of the archive in each day's folder
+
+
+def config_member(latitude, longitude):
+
+    """ Archive member holding the config of one column """
+
+    return 'configfiles/config_%s_%s.txt' %(latitude, longitude)
+
+
+def spectrum_member(latitude, longitude):
+
+    """ Archive member holding the spectrum of one column """
+
+    return 'spectra/trn_%s_%s.txt' %(latitude, longitude)
+# Member names match the file names used without an archive, so extracting an archive gives the usual folders
+
+
+class DayArchive:
+
+    """ Uncompressed zip file of one day's configs and spectra
+        The zip central directory is the member index: opening the archive reads only the index, and each member
+        is then read with one seek, without touching the others
+        mode 'r' to read, 'a' to add or replace members, 'w' to start the archive again
+        Members written with 'a' or 'w' go to a side file (<archive>.part) while the archive itself is left as it
+        was; closing writes the latest copy of every member to a new file that then replaces the archive in one
+        step, so a run killed part way leaves the archive as it was last closed and rewriting a member replaces it
+        One writer per archive at a time; writes are serialised so the archive can be filled from several threads """
+
+    def __init__(self, filename, mode='r'):
+        self.filename = str(filename)
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.previous = None
+        if mode == 'r':
+            self.zip = zipfile.ZipFile(self.filename, 'r')
+            return
+        if mode == 'a' and os.path.exists(self.filename):
+            self.previous = zipfile.ZipFile(self.filename, 'r')
+        self.zip = zipfile.ZipFile(self.filename + '.part', 'w', compression=zipfile.ZIP_STORED)
+        # Any side file left by a run that was killed is started again
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+
+        """ Write the index and close the file, replacing the archive with the members written """
+
+        if self.zip is None:
+            return
+        self.zip.close()
+        if self.mode != 'r':
+            self.finish()
+        self.zip = None
+
+    def finish(self):
+
+        """ Copy the latest copy of every member, from the side file or else the archive as it was, to a new file
+            and put it in place of the archive """
+
+        partname = self.filename + '.part'
+        newname = self.filename + '.new'
+        with zipfile.ZipFile(partname, 'r') as part, \
+             zipfile.ZipFile(newname, 'w', compression=zipfile.ZIP_STORED) as new:
+            sources = [(self.previous, info) for info in self.previous.infolist()
+                       if info.filename not in part.NameToInfo] if self.previous is not None else []
+            sources += [(part, info) for info in part.NameToInfo.values()]
+            # NameToInfo holds the last copy of each name written
+            for source, info in sources:
+                with source.open(info) as member, new.open(info, 'w') as copy:
+                    shutil.copyfileobj(member, copy)
+        if self.previous is not None:
+            self.previous.close()
+        os.replace(newname, self.filename)
+        os.remove(partname)
+
+    def info(self, name):
+
+        """ Index entry of a member, the one written in this session if there is one """
+
+        if name in self.zip.NameToInfo or self.previous is None:
+            return self.zip.getinfo(name)
+
+        return self.previous.getinfo(name)
+
+    def __contains__(self, name):
+        return name in self.zip.NameToInfo or (self.previous is not None and name in self.previous.NameToInfo)
+
+    def names(self, prefix=''):
+
+        """ Sorted names of the members whose names start with prefix, such as 'spectra/' """
+
+        names = set(self.zip.NameToInfo)
+        if self.previous is not None:
+            names.update(self.previous.NameToInfo)
+
+        return sorted(name for name in names if name.startswith(prefix))
+
+    def size(self, name):
+
+        """ Size of a member in bytes """
+
+        return self.info(name).file_size
+
+    def fingerprint(self, name):
+
+        """ Size and CRC of a member, to tell whether it has been written again
+            (as spectrum_aggregator.spectrum_fingerprint does for files) """
+
+        info = self.info(name)
+
+        return [info.file_size, info.CRC]
+
+    def write(self, name, text):
+
+        """ Add a member holding text, replacing any member of that name """
+
+        with self.lock:
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore', 'Duplicate name', UserWarning)
+                self.zip.writestr(name, text)
+            # A member written twice in one session is kept once when the archive is closed
+
+    def read(self, name):
+
+        """ Text of one member """
+
+        with self.lock:
+            source = self.zip if name in self.zip.NameToInfo or self.previous is None else self.previous
+            return source.read(name).decode('utf-8', errors='replace')
+
+    def section(self, name, section, fix_sign=False, dtype=np.float64):
+
+        """ Read the rad or trn section of a spectrum member into a float64 (or dtype) array of shape (rows, columns),
+            as psg_output.read_named_section does for a file """
+
+        return section_from_text(self.read(name), section, fix_sign=fix_sign, dtype=dtype)
+
+
+def day_archive(daypath, mode='r'):
+
+    """ Open the archive of the day in daypath """
+
+    return DayArchive(str(daypath) + archive_filename, mode)
+
+
+def has_archive(daypath):
+
+    """ Whether the day in daypath has been written to an archive """
+
+    return os.path.exists(str(daypath) + archive_filename)
+
+
+def extract_archive(daypath):
+
+    """ Unpack a day's archive into the usual configfiles/ and spectra/ folders, for tools that need the files """
+
+    with day_archive(daypath) as archive:
+        archive.zip.extractall(str(daypath))
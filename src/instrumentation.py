@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Records wall time, items, bytes read and written per stage, PSG request latencies and counters for a run,
+  and writes them out as a JSON summary
+- Progress messages go through log, at a verbosity that can be set
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import contextlib
+import functools
+import json
+import threading
+import time
+import numpy as np
+
+
+verbosity = 1
+# 0: nothing, 1: one line per day and the run summary (default), 2: also the table of stages, 3: also debugging output
+
+
+def set_verbosity(level):
+
+    """ Set how much progress output the pipeline prints (see verbosity) """
+
+    global verbosity
+    verbosity = level
+
+
+def log(message, level=1):
+
+    """ Print a progress message if the verbosity is at least level """
+
+    if verbosity >= level:
+        print(message)
+
+
+class RunStats:
+
+    """ Measurements of one run, safe to update from several threads:
+        stages - wall time, items, bytes read and written per stage name
+        latencies - seconds taken by each PSG request that went over the network
+        counters - named counts, such as PSG cache hits and misses """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.latencies = []
+            self.counters = {}
+            self.started = time.time()
+
+    def add(self, name, items=0, seconds=0.0, bytes_read=0, bytes_written=0):
+
+        """ Add to the totals of a stage """
+
+        with self.lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'items': 0, 'bytes_read': 0, 'bytes_written': 0})
+            stage['seconds'] += seconds
+            stage['items'] += items
+            stage['bytes_read'] += bytes_read
+            stage['bytes_written'] += bytes_written
+
+    @contextlib.contextmanager
+    def stage(self, name, items=0, bytes_read=0, bytes_written=0):
+
+        """ Time a block of code as part of a stage """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, items, time.perf_counter() - start, bytes_read, bytes_written)
+
+    def latency(self, seconds):
+
+        """ Record how long one PSG request took """
+
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def count(self, name, number=1):
+
+        """ Add to a named counter """
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + number
+
+    def snapshot(self):
+
+        """ Raw measurements, to be sent from a worker process and merged into the parent's """
+
+        with self.lock:
+            return {'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                    'latencies': list(self.latencies), 'counters': dict(self.counters)}
+
+    def merge(self, snapshot):
+
+        """ Add the measurements of a snapshot (from a worker process) to these """
+
+        for name, stage in snapshot['stages'].items():
+            self.add(name, stage['items'], stage['seconds'], stage['bytes_read'], stage['bytes_written'])
+        with self.lock:
+            self.latencies.extend(snapshot['latencies'])
+        for name, number in snapshot['counters'].items():
+            self.count(name, number)
+
+    def summary(self):
+
+        """ Totals and rates per stage, PSG latency percentiles (seconds) and cache hit rate, as a dictionary """
+
+        snapshot = self.snapshot()
+        stages = {}
+        for name, stage in snapshot['stages'].items():
+            stages[name] = dict(stage, rate=stage['items']/stage['seconds'] if stage['seconds'] else None)
+
+        latencies = np.array(snapshot['latencies'])
+        psg = {'requests': len(latencies)}
+        if len(latencies):
+            psg.update({'p%s' %(percent): float(np.percentile(latencies, percent)) for percent in (50, 90, 99)})
+            psg.update({'mean': float(latencies.mean()), 'max': float(latencies.max())})
+
+        counters = snapshot['counters']
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+        cache = {'hits': counters.get('cache_hits', 0), 'misses': counters.get('cache_misses', 0),
+                 'hit_rate': counters.get('cache_hits', 0)/lookups if lookups else None}
+
+        return {'wall_seconds': time.time() - self.started, 'stages': stages, 'psg_latency': psg, 'cache': cache,
+                'counters': counters}
+
+    def save(self, filename):
+
+        """ Write the summary to a JSON file """
+
+        with open(filename, 'w') as file:
+            json.dump(self.summary(), file, indent=1)
+
+    def report(self):
+
+        """ Log the summary: one line at verbosity 1, the table of stages at verbosity 2 """
+
+        summary = self.summary()
+        psg = summary['psg_latency']
+        line = 'Run took %.1f s' %(summary['wall_seconds'])
+        if psg['requests']:
+            line += ', %s PSG requests (median %.2f s, 90%% %.2f s, 99%% %.2f s)' %(psg['requests'], psg['p50'],
+                                                                                  psg['p90'], psg['p99'])
+        if summary['cache']['hit_rate'] is not None:
+            line += ', cache hit rate %.0f%%' %(100*summary['cache']['hit_rate'])
+        log(line, 1)
+
+        log('%-12s %10s %10s %12s %12s %12s' %('stage', 'items', 'seconds', 'items/s', 'MB read', 'MB written'), 2)
+        for name, stage in summary['stages'].items():
+            log('%-12s %10s %10.2f %12.1f %12.1f %12.1f' %(name, stage['items'], stage['seconds'], stage['rate'] or 0,
+                                                          stage['bytes_read']/2**20, stage['bytes_written']/2**20), 2)
+
+
+stats = RunStats()
+# Measurements of the run in progress, shared by every module of the pipeline
+
+
+@contextlib.contextmanager
+def instrumented_run(filename=None):
+
+    """ Measure a run: start from empty measurements, and at the end log the summary
+        and write it to filename as JSON (if given), also when the run fails part way """
+
+    stats.reset()
+    try:
+        yield stats
+    finally:
+        stats.report()
+        if filename is not None:
+            stats.save(filename)
+
+
+def instrumented_job(function):
+
+    """ Decorator for batch functions that take parentpath as their first argument:
+        each call is measured as one run and its summary written to parentpath/run_summary.json """
+
+    @functools.wraps(function)
+    def job(parentpath, *args, **kwargs):
+        with instrumented_run(str(parentpath) + 'run_summary.json'):
+            return function(parentpath, *args, **kwargs)
+
+    return job
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Regrids limb profiles onto fewer atmosphere layers, all columns at once, so PSG runs faster,
+  and measures how well the column amounts of water vapour and cloud are kept
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import numpy as np
+from limb_extraction import profile_fields
+
+
+conserved_fields = ('H2O', 'liquid_cloud', 'ice_cloud')
+# Fields whose column amounts are checked after regridding
+
+
+def layer_thickness(pressure):
+
+    """ Pressure thickness (same units as pressure) of each level of each column, shape (columns, levels):
+        from half way to the level below to half way to the level above, the bottom and top levels ending at their
+        own pressure """
+
+    edges = np.concatenate([pressure[:,:1], 0.5*(pressure[:,1:] + pressure[:,:-1]), pressure[:,-1:]], axis=1)
+
+    return np.abs(np.diff(edges, axis=1))
+
+
+def column_amounts(profiles, fields=profile_fields):
+
+    """ Column amount of each conserved field present in fields: mixing ratio times layer thickness summed over
+        levels, per column """
+
+    thickness = layer_thickness(profiles[:,:,fields.index('pressure')])
+
+    return {name: np.sum(profiles[:,:,fields.index(name)]*thickness, axis=1)
+            for name in conserved_fields if name in fields}
+
+
+def conservation_error(original, reduced, fields=profile_fields):
+
+    """ Largest relative error over columns of the column amount of each conserved field after regridding
+        (absolute error where the original column has none)
+        Both column amounts are taken on the original levels, the regridded profiles interpolated back onto them
+        (see interpolate_logp), so the measure does not depend on how a method spaces or weights its new levels """
+
+    before = column_amounts(original, fields)
+    after = column_amounts(interpolate_logp(reduced, np.log(original[:,:,fields.index('pressure')]), fields), fields)
+    errors = {}
+    for name in before:
+        difference = np.abs(after[name] - before[name])
+        scale = np.abs(before[name])
+        relative = np.divide(difference, scale, out=difference.copy(), where=scale > 0)
+        errors[name] = float(np.max(relative))
+
+    return errors
+
+
+def interpolate_logp(profiles, target, fields=profile_fields):
+
+    """ Interpolate every column linearly in log pressure onto target log pressures, shape (columns, levels),
+        holding the end values beyond the column's own levels """
+
+    pressure_index = fields.index('pressure')
+    logp = np.log(profiles[:,:,pressure_index])
+    columns, levels = logp.shape
+
+    below = np.clip(np.sum(logp[:,:,np.newaxis] >= target[:,np.newaxis,:], axis=1) - 1, 0, levels-2)
+    column = np.arange(columns)[:,np.newaxis]
+    lower = logp[column, below]
+    upper = logp[column, below+1]
+    span = upper - lower
+    weight = np.clip(np.divide(target - lower, span, out=np.zeros(target.shape), where=span != 0), 0, 1)
+    # Source levels either side of each target level and how far between them it lies, for all columns at once
+    # Pressure falls with level, so log pressure decreases along the level axis
+
+    interpolated = profiles[column, below]*(1-weight)[:,:,np.newaxis] + profiles[column, below+1]*weight[:,:,np.newaxis]
+    interpolated[:,:,pressure_index] = np.exp(target)
+
+    return interpolated
+
+
+def profile_error(original, reduced, fields=profile_fields):
+
+    """ Largest relative RMS difference over columns between the water vapour and cloud profiles and the regridded
+        ones interpolated back onto the original levels """
+
+    back = interpolate_logp(reduced, np.log(original[:,:,fields.index('pressure')]), fields)
+    index = [fields.index(name) for name in conserved_fields if name in fields]
+    difference = np.sqrt(np.mean((back[:,:,index] - original[:,:,index])**2, axis=1))
+    scale = np.sqrt(np.mean(original[:,:,index]**2, axis=1))
+    relative = np.divide(difference, scale, out=difference.copy(), where=scale > 0)
+
+    return float(np.max(relative, initial=0))
+
+
+def logp_levels(profiles, layers, fields=profile_fields):
+
+    """ Interpolate every column linearly in log pressure onto layers levels evenly spaced in log pressure
+        between the column's bottom and top level """
+
+    logp = np.log(profiles[:,:,fields.index('pressure')])
+
+    return interpolate_logp(profiles, np.linspace(logp[:,0], logp[:,-1], layers, axis=1), fields)
+
+
+def merge_levels(profiles, layers, fields=profile_fields):
+
+    """ Merge consecutive levels into at most layers groups of about equal depth in log pressure (the same groups for
+        every column, from the mean profile), each new layer the pressure-thickness weighted mean of its levels
+        with pressure averaged in log pressure
+        Each new layer times the summed thickness of its group holds the column amount of the group, and every value
+        lies within the range of the levels it was merged from """
+
+    pressure_index = fields.index('pressure')
+    logp = np.log(profiles[:,:,pressure_index])
+    mean_logp = logp.mean(axis=0)
+    edges = np.linspace(mean_logp[0], mean_logp[-1], layers+1)[1:-1]
+    groups = np.unique(np.sum(mean_logp[:,np.newaxis] < edges[np.newaxis,:], axis=1), return_inverse=True)[1]
+    membership = np.eye(groups.max()+1)[groups]
+    # One-hot (levels, groups); groups with no level are dropped
+
+    thickness = layer_thickness(profiles[:,:,pressure_index])
+    totals = np.einsum('cl,clf,lg->cgf', thickness, profiles, membership)
+    weights = thickness @ membership
+    reduced = totals/weights[:,:,np.newaxis]
+    reduced[:,:,pressure_index] = np.exp(np.einsum('cl,cl,lg->cg', thickness, logp, membership)/weights)
+
+    return reduced
+
+
+layer_methods = {'logp': logp_levels, 'merge': merge_levels}
+
+
+def regrid_profiles(profiles, layers=None, tolerance=None, method='logp', fields=profile_fields):
+
+    """ Regrid profiles, shape (columns, levels, fields), onto fewer layers with method ('logp' or 'merge'):
+        to layers layers, or with tolerance to the fewest layers for which both the column amounts and the profiles
+        of water vapour and cloud are within that relative error (the original profiles if no fewer layers are)
+        Returns the regridded profiles and their errors: the column amount error of each conserved field and
+        the profile error (see conservation_error and profile_error) """
+
+    regrid = layer_methods[method]
+    if layers is None and tolerance is None:
+        raise ValueError('Give either layers or tolerance to regrid the profiles')
+
+    counts = [layers] if layers is not None else range(2, profiles.shape[1])
+    for count in counts:
+        reduced = regrid(profiles, count, fields)
+        errors = dict(conservation_error(profiles, reduced, fields), profile=profile_error(profiles, reduced, fields))
+        if tolerance is None or max(errors.values()) <= tolerance:
+            return reduced, errors
+
+    return profiles, dict(conservation_error(profiles, profiles, fields), profile=0.0)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Extracts the atmospheric profiles of every limb column for one model day in a single pass
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import time
+import numpy as np
+from instrumentation import stats
+
+
+profile_fields = ('pressure', 'temperature', 'altitude', 'N2', 'H2O', 'CO2', 'liquid_cloud', 'ice_cloud')
+# Order of the data points in each PSG atmosphere layer
+
+cube_names = {'air_pressure': 'pressure',
+              'air_potential_temperature': 'potential_temp',
+              'specific_humidity': 'spec_humid',
+              'mass_fraction_of_cloud_liquid_water_in_air': 'liquid_cloud',
+              'mass_fraction_of_cloud_ice_in_air': 'ice_cloud'}
+# Standard names of the UM cubes used to build the profiles
+
+co2_fraction = (28.0134/44.0095)*5.94e-4
+# Model has a fixed amount of CO2. Convert kg/kg to molecules/molecules
+
+
+def find_cubes(cubes):
+
+    """ Pick out the model data cubes needed for the PSG profiles by their standard names
+        Returns a dictionary of cubes keyed by the short names in cube_names """
+
+    found = {}
+    for cube in cubes:
+        if cube.standard_name in cube_names:
+            found[cube_names[cube.standard_name]] = cube
+
+    return found
+
+
+def position(cube, name, index):
+
+    """ Position of a model day or longitude index in a cube
+        Cubes cut down by um_loader.load_limbs carry the original indices in a day_index or limb_index
+        coordinate; full cubes do not, and the index is used as it is """
+
+    coords = cube.coords(name)
+    if not coords or index < 0:
+        return index
+
+    return list(coords[0].points).index(index)
+
+
+def gas_fields(pressure, potential_temp, spec_humid, reference, dtype=np.float64):
+
+    """ Temperature, water vapour, N2 and CO2 of limb columns from the model pressure, potential temperature and
+        specific humidity, as read from the cubes; reference is the potential temperature's 100000 Pa reference
+        pressure in the pressure's units
+        Returns temperature and the mixing ratios (molecules/molecules) of H2O, N2 and CO2, CO2 as a scalar of dtype """
+
+    temperature = potential_temp*((pressure/reference)**(287.05/1005)) # R and cp in J/kgK for 300K
+    # Convert potential temperature into absolute temperature
+
+    vapour = (28.0134/18.01528)*np.abs(spec_humid) # Convert kg/kg to molecules/molecules
+    CO2 = np.asarray(co2_fraction, dtype=dtype)
+    N2 = 1 - vapour.astype(dtype) - CO2 # Any gas that isn't vapour or CO2 is N2
+
+    return temperature, vapour, N2, CO2
+
+
+def cloud_fields(found, read, shape, dtype=np.float64):
+
+    """ Liquid and ice cloud of limb columns: read(name) for the cloud cubes in found (see find_cubes),
+        zeros of shape for the ones missing """
+
+    return [read(name) if name in found else np.zeros(shape, dtype=dtype) for name in ('liquid_cloud', 'ice_cloud')]
+    # Vapour-only runs have no cloud fields
+
+
+def extract_limbs(cubes, day=-1, limbs=(36,108), dtype=np.float64):
+
+    """ For every column on the limb of one model day:
+        Extracts profiles for: pressure, temperature, water vapour, liquid cloud, ice cloud
+        Calculates/defines profiles for: N2, CO2
+        Only the limb longitudes are read from the cubes (only those are read from disk if the cubes
+        are lazy), and the temperature conversion is done on those columns only
+        Returns a list of (latitude, longitude) indices and an array of profiles with
+        shape (columns, levels, fields), fields ordered as in profile_fields and columns
+        ordered latitude by latitude, east limb then west limb
+        With dtype=np.float32 the limb slices, the conversions and the profiles are all kept in single precision,
+        half the memory of float64; the configs agree with float64 ones to the 4 significant digits written,
+        give or take one in the last digit (see precision_check)
+        cubes can also be a profile_store.ProfileStore of profiles extracted earlier """
+
+    start = time.perf_counter()
+    if hasattr(cubes, 'extract_limbs'):
+        coords, profiles = cubes.extract_limbs(day, limbs, dtype)
+        stats.add('extract', len(coords), time.perf_counter() - start, bytes_read=profiles.nbytes)
+        return coords, profiles
+    # Saved profiles, no need to touch the model data
+
+    def working(array):
+        return array if dtype == np.float64 else np.asarray(array, dtype=dtype)
+    # The float64 path works on the cube data as it comes, as it always has
+
+    found = find_cubes(cubes)
+    limbs = list(limbs)
+    cube = found['pressure']
+    day_position = position(cube, 'day_index', day)
+    limb_positions = [position(cube, 'limb_index', limb) for limb in limbs]
+    # Works with full global cubes and with lazily loaded limb-only cubes
+
+    air_pressure = found['pressure'][day_position][:,:,limb_positions]
+    read = []
+    def limb_data(name):
+        limb_cube = air_pressure if name == 'pressure' else found[name][day_position][:,:,limb_positions]
+        read.append(working(limb_cube.data))
+        return read[-1]
+    # Extract the limb columns only, shape (levels, latitudes, limbs), keeping the arrays read from the cubes
+    # for the bytes read by the extract stage
+
+    pressure = limb_data('pressure')
+    import iris # Already loaded by whatever made the cubes, only needed here for the unit conversion
+    p0 = iris.coords.AuxCoord(100000.0, long_name='reference_pressure', units='Pa')
+    p0.convert_units(air_pressure.units)
+    temperature, vapour, N2, CO2 = gas_fields(pressure, limb_data('potential_temp'), limb_data('spec_humid'),
+                                              working(p0.points[0]), dtype)
+    liquid_cloud, ice_cloud = cloud_fields(found, limb_data, vapour.shape, dtype)
+
+    altitude = working(air_pressure.coord('level_height').points*1e-3)
+    # Extract altitude of T-P points from air pressure cube (in km)
+
+    levels, latitudes = pressure.shape[0], pressure.shape[1]
+    altitude = np.broadcast_to(altitude[:,np.newaxis,np.newaxis], pressure.shape)
+    profiles = np.stack([pressure, temperature, altitude, N2, vapour, np.full(vapour.shape, CO2), liquid_cloud,
+                         ice_cloud], axis=-1)
+    profiles = profiles.transpose(1,2,0,3).reshape(latitudes*len(limbs), levels, len(profile_fields))
+    # Reorder to (latitude, limb, level, field) and merge latitude and limb into one column axis
+
+    coords = [(latitude, longitude) for latitude in range(latitudes) for longitude in limbs]
+    stats.add('extract', len(coords), time.perf_counter() - start, bytes_read=sum(array.nbytes for array in read))
+
+    return coords, profiles
+
+
+def limb_mean_profiles(cubes, first, last, limbs=(36,108), weighting=None, chunk=32, dtype=np.float64):
+
+    """ Limb-mean profiles of every day from first to last, computed from all of them at once:
+        the limb columns of chunk days at a time are read (only those are read from disk if the cubes are lazy),
+        converted as in extract_limbs (gas_fields, cloud_fields) and averaged over every latitude on both limbs
+        in whole-array operations
+        weighting - None for the plain mean over all limb columns, as output_specs.limb_mean takes,
+        or 'cos' to weight each latitude by the cosine of its latitude
+        dtype - np.float32 reads and converts the limb slices in single precision (see extract_limbs); the means
+        are added up and returned in float64 either way, as they are small and can be near the float32 limit
+        Returns the list of days and an array of float64 profiles with shape (days, levels, fields),
+        fields ordered as in profile_fields
+        cubes can also be a profile_store.ProfileStore of profiles extracted earlier """
+
+    start = time.perf_counter()
+    if hasattr(cubes, 'limb_mean_profiles'):
+        days, profiles = cubes.limb_mean_profiles(first, last, limbs, weighting, dtype)
+        latitudes = len(set(latitude for latitude, longitude in cubes.coords))
+        stats.add('extract', len(days)*latitudes*len(limbs), time.perf_counter() - start, bytes_read=profiles.nbytes)
+        return days, profiles
+    # Saved profiles, no need to touch the model data
+
+    found = find_cubes(cubes)
+    limbs = list(limbs)
+    cube = found['pressure']
+    days = list(range(first, last+1))
+    day_positions = [position(cube, 'day_index', day) for day in days]
+    limb_positions = [position(cube, 'limb_index', limb) for limb in limbs]
+    if day_positions[0] >= 0 and day_positions == list(range(day_positions[0], day_positions[0]+len(days))):
+        day_index = lambda begin, end: slice(day_positions[begin], day_positions[begin] + end - begin)
+    else:
+        day_index = lambda begin, end: day_positions[begin:end]
+    # A slice of consecutive days keeps a view of the data, so only the limb columns are copied
+
+    import iris # Already loaded by whatever made the cubes, only needed here for the unit conversion
+    p0 = iris.coords.AuxCoord(100000.0, long_name='reference_pressure', units='Pa')
+    p0.convert_units(cube.units)
+    altitude = cube.coord('level_height').points*1e-3
+
+    if weighting == 'cos':
+        weights = np.cos(np.radians(cube.coord('latitude').points))
+    elif weighting is None:
+        weights = np.ones(cube.shape[2])
+    else:
+        raise ValueError('Unknown weighting %s, expected None or cos' %(weighting))
+    weights = weights/(weights.sum()*len(limbs))
+    # Weight of each latitude in the mean over both limbs
+
+    def limb_data(name, begin, end):
+        data = np.asarray(found[name].core_data()[day_index(begin, end)][...,limb_positions])
+        return data if dtype == np.float64 else data.astype(dtype, copy=False)
+    # Limb columns of a block of days, shape (days, levels, latitudes, limbs)
+
+    def mean(values):
+        return np.einsum('dvak,a->dv', values, weights, dtype=np.float64)
+    # Added up in float64 even for float32 limb columns: weighting each value down first in float32 flushes
+    # small cloud amounts to zero
+
+    means = []
+    bytes_read = 0
+    for begin in range(0, len(days), chunk):
+        end = min(begin + chunk, len(days))
+        read = []
+        def block_data(name):
+            read.append(limb_data(name, begin, end))
+            return read[-1]
+
+        pressure = block_data('pressure')
+        temperature, vapour, N2, CO2 = gas_fields(pressure, block_data('potential_temp'), block_data('spec_humid'),
+                                                  pressure.dtype.type(p0.points[0]), dtype)
+        liquid_cloud, ice_cloud = cloud_fields(found, block_data, vapour.shape, dtype)
+        block = {'pressure': mean(pressure), 'temperature': mean(temperature), 'H2O': mean(vapour), 'N2': mean(N2),
+                 'altitude': np.broadcast_to(altitude, (end-begin, len(altitude))),
+                 'CO2': np.full((end-begin, len(altitude)), co2_fraction),
+                 'liquid_cloud': mean(liquid_cloud), 'ice_cloud': mean(ice_cloud)}
+
+        means.append(np.stack([block[field] for field in profile_fields], axis=-1))
+        bytes_read += sum(array.nbytes for array in read)
+
+    profiles = np.concatenate(means)
+    stats.add('extract', len(days)*cube.shape[2]*len(limbs), time.perf_counter() - start, bytes_read=bytes_read)
+
+    return days, profiles
@@ -12,63 +12,38 @@ Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
 import glob
+from psg_output import rad_columns, cloud_trn_columns
+from spectrum_aggregator import aggregate_files
+from day_archive import day_archive, has_archive
+
+
+def day_spectra(path, section, columns, fix_sign=False, filename=None):
+
+    """ Running mean of one section of a day's spectra, from the day's archive file if it has one
+        and otherwise from the files in spectra/ """
+
+    if has_archive(path):
+        with day_archive(path) as archive:
+            return aggregate_files(archive.names('spectra/'), section, columns, fix_sign=fix_sign, filename=filename,
+                                   archive=archive)
+
+    files = glob.glob(str(path) + 'spectra/*.txt')
+
+    return aggregate_files(sorted(files), section, columns, fix_sign=fix_sign, filename=filename)
+
 
 def plot_absorption(path):
     
-    files = glob.glob(str(path) + 'spectra/*.txt')    
+    import matplotlib.pyplot as plt
     
-    number_of_columns = []
-    for number in range(len(files)):
-        number_of_columns.append(number)
-    number_of_rows = []
-    for number in range(198):
-        number_of_rows.append(number)
-    
-    wavelengths = []
-    first_file = open(files[0], 'r')
-    transmittances = first_file.readlines()
-    transmittances = transmittances[1129:1328]
-    for item in transmittances:
-        datapoints = item.split('  ')
-        wavelength = float(datapoints[0])
-        wavelengths.append(wavelength)
-    first_file.close()
-    x_axis = np.array(wavelengths)
-        
-    total_spectrum = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    H2O = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    CO2 = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    ice_cloud = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    liquid_cloud = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    rayleigh = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    collisions = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-
-    for file_number in range(0,len(files)):
-        data = open(files[file_number], 'r')
-        lines = data.readlines()
-        lines = lines[1129:1328]
-        data.close()
-
-        for row in range(0,198):
-            list_of_datapoints = lines[row].split('  ')
-            total_spectrum.loc[row, file_number] = float(list_of_datapoints[1])
-            H2O.loc[row, file_number] = float(list_of_datapoints[3])
-            CO2.loc[row, file_number] = float(list_of_datapoints[4])
-            ice_cloud.loc[row, file_number] = float(list_of_datapoints[5])
-            liquid_cloud.loc[row, file_number] = float(list_of_datapoints[6])
-            rayleigh.loc[row, file_number] = float(list_of_datapoints[7])
-            collisions.loc[row, file_number] = float(list_of_datapoints[8])
-
-    meaned_total_spectrum = 100*(1-total_spectrum.mean(axis=1).to_numpy())
-    meaned_H2O = 100*(1-H2O.mean(axis=1).to_numpy())
-    meaned_CO2 = 100*(1-CO2.mean(axis=1).to_numpy())
-    meaned_ice_cloud = 100*(1-ice_cloud.mean(axis=1).to_numpy())
-    meaned_liquid_cloud = 100*(1-liquid_cloud.mean(axis=1).to_numpy())
-    meaned_rayleigh = 100*(1-rayleigh.mean(axis=1).to_numpy())
-    meaned_collisions = 100*(1-collisions.mean(axis=1).to_numpy())
+    aggregator = day_spectra(path, 'trn', cloud_trn_columns, filename=str(path) + 'output/trn_mean.npz')
+    x_axis, transmittances = aggregator.mean()
+    # Running mean of the transmittance section, resumed from output/trn_mean.npz so only new spectra are read
+    # Components: total, H2O, CO2, ice cloud, liquid cloud, Rayleigh scattering, collision-induced absorption
+
+    meaned = 100*(1-transmittances)
+    meaned_total_spectrum, meaned_H2O, meaned_CO2, meaned_ice_cloud, meaned_liquid_cloud, meaned_rayleigh, meaned_collisions = meaned.T
        
     # transit_depth = (7.16e06*meaned_total_spectrum)/(10*6.8e03)    
     
@@ -113,61 +88,19 @@ def plot_absorption(path):
 
 def plot_transitdepth(path, day=0):             
             
-    files = glob.glob(str(path) + 'spectra/*.txt')    
-    
-    number_of_columns = []
-    for number in range(len(files)):
-        number_of_columns.append(number)
-    number_of_rows = []
-    for number in range(198):
-        number_of_rows.append(number)
+    import matplotlib.pyplot as plt
     
-    wavelengths = []
-    first_file = open(files[0], 'r')
-    rad_spectrum = first_file.readlines()
-    rad_spectrum = rad_spectrum[658:856]
-    for item in rad_spectrum:
-        datapoints = item.split('  ')
-        wavelength = float(datapoints[0])
-        wavelengths.append(wavelength)
-    first_file.close()
-    x_axis = np.array(wavelengths)
-    
-    total_spectrum = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    noise = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    stellar = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    planet = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    transit = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    blocked = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    
-    for file_number in range(0,len(files)):
-        data = open(files[file_number], 'r')
-        lines = data.readlines()
-        lines = lines[658:856]
-        data.close()
-
-        for row in range(0,198):
-            lines[row] = lines[row].replace(' -', '  ')
-            list_of_datapoints = lines[row].split('  ')
-            total_spectrum.loc[row, file_number] = float(list_of_datapoints[1])
-            noise.loc[row, file_number] = float(list_of_datapoints[2])
-            stellar.loc[row, file_number] = float(list_of_datapoints[3])
-            planet.loc[row, file_number] = float(list_of_datapoints[4])
-            transit.loc[row, file_number] = float(list_of_datapoints[5])
-            blocked.loc[row, file_number] = float(list_of_datapoints[6])
-
-    meaned_total_spectrum = total_spectrum.mean(axis=1).to_numpy()
-    meaned_noise = noise.mean(axis=1).to_numpy()
-    meaned_stellar = stellar.mean(axis=1).to_numpy()
-    meaned_planet = planet.mean(axis=1).to_numpy()
-    meaned_transit = transit.mean(axis=1).to_numpy()
-    meaned_blocked = blocked.mean(axis=1).to_numpy()
+    aggregator = day_spectra(path, 'rad', rad_columns, fix_sign=True, filename=str(path) + 'output/rad_mean.npz')
+    x_axis, rad_spectrum = aggregator.mean()
+    # Running mean of the radiance section, resumed from output/rad_mean.npz so only new spectra are read
+    # Components: total, noise, stellar, planet, transit, blocked
+
+    meaned_total_spectrum, meaned_noise, meaned_stellar, meaned_planet, meaned_transit, meaned_blocked = rad_spectrum.T
     continuum = np.min(meaned_transit)
     
-    with open(str(path) + 'output/transit_day%s.txt' %(day), 'w') as file:
-        file.write(str(x_axis) + '\n')
-        file.write(str(meaned_transit) + '\n')                              
-    file.close()
+    np.savetxt(str(path) + 'output/transit_day%s.txt' %(day), np.column_stack([x_axis, meaned_transit]),
+               fmt='%.8e', header='Wavelength [um]  Mean transit')
+    # Full precision, two columns, read back with np.loadtxt (str() of an array truncates it)
     
     plt.plot(x_axis, (meaned_transit-continuum)*1e6)
     plt.title('Relative transit depth, day=%s' %(day+1))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Describes each config product for NASA's Planetary Spectrum Generator (template, layers, fields, per column
+  or limb mean) and writes any set of products from a single extraction of the limb profiles
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import numpy as np
+from functools import partial
+from pathlib import Path
+import psg_template
+from limb_extraction import extract_limbs, profile_fields
+from layer_reduction import regrid_profiles
+from parallel_batch import run_days
+from instrumentation import instrumented_job, log, stats
+
+
+class OutputSpec:
+
+    """ One config product:
+        template - template file name, with its layout in psg_template.template_layouts
+        fields - profile fields written into each layer, in order (names from limb_extraction.profile_fields)
+        levels - (first, last) model levels to use, last excluded, or None for all
+        reduction - 'column' for one config per limb column, 'limb_mean' for one config of the mean over all columns
+        path - where configs are written under the parent path, a % pattern with day, latitude and longitude keys
+        layers, layer_tolerance - regrid the template's levels onto this many layers, or onto the fewest layers that
+        keep the column amounts of water vapour and cloud within this relative error, to shorten PSG runs
+        layer_method - 'logp' or 'merge', see layer_reduction """
+
+    def __init__(self, name, template, fields=profile_fields, levels=None, reduction='column', path=None,
+                 layers=None, layer_tolerance=None, layer_method='logp'):
+        if reduction not in ('column', 'limb_mean'):
+            raise ValueError('Unknown reduction %s, expected column or limb_mean' %(reduction))
+        self.name = name
+        self.template = template
+        self.fields = tuple(fields)
+        self.levels = levels
+        self.reduction = reduction
+        self.path = path
+        self.layers = layers
+        self.layer_tolerance = layer_tolerance
+        self.layer_method = layer_method
+        self.field_index = [profile_fields.index(field) for field in self.fields]
+
+    def select(self, coords, profiles):
+
+        """ Reduce extracted profiles, shape (columns, levels, fields), to what this product writes
+            Returns the coords of each config (None for a limb mean) and its profiles """
+
+        if self.levels is not None:
+            profiles = profiles[:,self.levels[0]:self.levels[1]]
+        profiles = profiles[:,:,self.field_index]
+        if self.reduction == 'limb_mean':
+            return [None], np.mean(profiles, axis=0, dtype=np.float64)[np.newaxis]
+        # Mean over every latitude on both limbs, in float64 whatever the profiles are kept in
+
+        return coords, profiles
+
+    @property
+    def regridded(self):
+        """ Whether this product is written on fewer layers than its template """
+        return self.layers is not None or self.layer_tolerance is not None
+
+    def regrid(self, profiles):
+
+        """ Regrid selected profiles onto fewer layers, if this product asks for it
+            Returns the profiles and the relative error of the column amount of each conserved field
+            (None without regridding) """
+
+        if not self.regridded:
+            return profiles, None
+        profiles = profiles[:,:psg_template.template_layouts[self.template][1]]
+        # Only the levels the full template would have written
+
+        return regrid_profiles(profiles, self.layers, self.layer_tolerance, self.layer_method, self.fields)
+
+    def render(self, profiles, templatepath=None):
+
+        """ Config texts for profiles already selected (and regridded) for this product """
+
+        path = psg_template.templatepath if templatepath is None else templatepath
+        layers = profiles.shape[1] if self.regridded else None
+        return psg_template.load_template(self.template, path, layers).render_batch(profiles)
+
+    def filename(self, parentpath, day, coord=None):
+
+        """ File a config is written to """
+
+        latitude, longitude = coord if coord is not None else (None, None)
+        return str(parentpath) + self.path %{'day': day, 'latitude': latitude, 'longitude': longitude}
+
+    def write(self, parentpath, day, coords, profiles, templatepath=None):
+
+        """ Render and write this product for one day from the extracted limb profiles
+            Returns the coords (None for a limb mean) and the config texts """
+
+        coords, profiles = self.select(coords, profiles)
+        profiles, errors = self.regrid(profiles)
+        if errors is not None:
+            log('Day %s %s: %s layers, relative errors %s' %(day, self.name, profiles.shape[1],
+                ', '.join('%s %.2e' %(name, error) for name, error in errors.items())))
+        configs = self.render(profiles, templatepath)
+        for coord, config in zip(coords, configs):
+            filename = self.filename(parentpath, day, coord)
+            Path(filename).parent.mkdir(parents=True, exist_ok=True)
+            with open(filename, 'w') as file:
+                file.write(config)
+        stats.add('render', bytes_written=sum(len(config) for config in configs))
+
+        return coords, configs
+
+
+cloud_columns = OutputSpec('cloud', 'trape_template.txt',
+                           path='trap_day%(day)s/configfiles/config_%(latitude)s_%(longitude)s.txt')
+vapour_columns = OutputSpec('vapour', 'proxb_vapour.txt', fields=profile_fields[:6],
+                            path='tall_day%(day)s/configfiles/config_%(latitude)s_%(longitude)s.txt')
+limb_mean = OutputSpec('limb_mean', 'trape_template.txt', reduction='limb_mean', path='configfiles/day_%(day)s.txt')
+# The products of config_writer, vapour_only_config and rapid_config, written where those put them
+
+products = {spec.name: spec for spec in (cloud_columns, vapour_columns, limb_mean)}
+
+
+def write_products(parentpath, cubes, day, specs=(cloud_columns, vapour_columns, limb_mean), limbs=(36,108),
+                   templatepath=None, dtype=np.float64):
+
+    """ Extract the limb profiles of one day once, as dtype (see limb_extraction.extract_limbs),
+        and write every product in specs from them
+        Returns a dictionary of (coords, configs) per product name """
+
+    coords, profiles = extract_limbs(cubes, day, limbs, dtype)
+    written = {}
+    for spec in specs:
+        written[spec.name] = spec.write(parentpath, day, coords, profiles, templatepath)
+
+    return written
+
+
+@instrumented_job
+def products_job(parentpath, cubes, first, last, specs=(cloud_columns, vapour_columns, limb_mean), workers=1,
+                 templatepath=None, dtype=np.float64):
+
+    """ Write the products in specs for days first to last, one extraction per day
+        With workers > 1 the days are spread over a pool of processes that share the cubes """
+
+    if workers == 1:
+        for day in range(first,last+1):
+            write_products(parentpath, cubes, day, specs, templatepath=templatepath, dtype=dtype)
+            log('Written %s for day: %s' %(', '.join(spec.name for spec in specs), day))
+        return
+
+    tasks = [(parentpath, day) for day in range(first,last+1)]
+    write = partial(write_products, specs=specs, templatepath=templatepath, dtype=dtype)
+    for number, (daypath, day, written) in enumerate(run_days(write, tasks, cubes, workers)):
+        log('Finished day: %s (%s of %s)' %(day, number+1, len(tasks)))
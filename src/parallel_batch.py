@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Spreads independent model days over a pool of worker processes
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import multiprocessing
+from instrumentation import stats
+
+
+shared = {}
+# Cubes shared with the worker processes. Set before the pool starts so forked workers inherit them
+# and they are never pickled per task
+
+
+def init_worker(cubes):
+
+    """ Give a worker process its copy of the cubes once, where processes cannot be forked (Windows) """
+
+    shared['cubes'] = cubes
+
+
+def run_task(task):
+
+    """ Run one day in a worker process: function(daypath, cubes, day)
+        Also returns what the day's measurements were, for the parent process to add to its own """
+
+    function, daypath, day = task
+    stats.reset()
+    result = function(daypath, shared['cubes'], day)
+
+    return daypath, day, result, stats.snapshot()
+
+
+def run_days(function, tasks, cubes, workers):
+
+    """ Run function(daypath, cubes, day) for every (daypath, day) in tasks over a pool of worker processes
+        function must be defined at the top level of a module so it can be sent to the workers
+        Yields (daypath, day, result) in the order days finish, so the caller can collect progress centrally
+        The workers' stage timings and counters are merged into this process's instrumentation.stats """
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        shared['cubes'] = cubes
+        initializer, initargs = None, ()
+    else:
+        context = multiprocessing.get_context()
+        initializer, initargs = init_worker, (cubes,)
+    # Forked workers share the parent's cubes; otherwise each worker receives them once at start-up
+
+    try:
+        with context.Pool(workers, initializer, initargs) as pool:
+            for daypath, day, result, snapshot in pool.imap_unordered(run_task, [(function, daypath, day)
+                                                                                for daypath, day in tasks]):
+                stats.merge(snapshot)
+                yield daypath, day, result
+    finally:
+        shared.pop('cubes', None)
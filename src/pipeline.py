@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Runs extraction, config rendering, PSG submission and aggregation of many days as separate stages,
+  keeping a manifest of finished work so an interrupted run carries on where it stopped
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from pathlib import Path
+from limb_extraction import extract_limbs
+from profile_store import file_fingerprint
+from psg_output import rad_columns
+from spectrum_aggregator import aggregate_files
+from instrumentation import log
+
+
+pipeline_stages = ('extract', 'render', 'submit', 'aggregate')
+
+
+def content_hash(content):
+
+    """ sha256 of a text or bytes """
+
+    if isinstance(content, str):
+        content = content.encode()
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def cube_sources(cubes, sourcefiles=None):
+
+    """ Fingerprints (profile_store.file_fingerprint) of the UM output files the cubes come from: sourcefiles if
+        given, otherwise the files um_loader.load_limbs loaded them from or those a ProfileStore was saved from
+        Returns None if they are not known, for cubes made some other way """
+
+    if sourcefiles is None:
+        sourcefiles = getattr(cubes, 'sourcefiles', None)
+    if sourcefiles is not None:
+        return {str(source): file_fingerprint(source) for source in sourcefiles}
+    if hasattr(cubes, 'metadata'):
+        return cubes.metadata['sources']
+
+    return None
+
+
+class Manifest:
+
+    """ Record of finished work, one JSON line per unit appended as soon as the unit is done:
+        stage, day, latitude and limb (None for whole-day units), a hash of what the unit was made from,
+        a hash of what it produced, and the sizes of the files it wrote
+        A line cut short by a crash is ignored, and the latest line for a unit wins """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.records = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[self.key(record['stage'], record['day'], record['latitude'], record['limb'])] = record
+
+    @staticmethod
+    def key(stage, day, latitude=None, limb=None):
+        return (stage, day, latitude, limb)
+
+    def record(self, stage, day, latitude, limb, source, output, filenames):
+
+        """ Mark a unit done: source and output are the content hashes of its input and result,
+            filenames the files it wrote """
+
+        record = {'stage': stage, 'day': day, 'latitude': latitude, 'limb': limb,
+                  'source': source, 'output': output, 'sizes': [os.path.getsize(name) for name in filenames]}
+        with self.lock:
+            with open(self.filename, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            self.records[self.key(stage, day, latitude, limb)] = record
+
+    def done(self, stage, day, latitude, limb, source, filenames):
+
+        """ Whether a unit was finished from the same input and its files are still there with the sizes they were
+            written with (sizes rather than hashes, so checking a day does not mean reading all its spectra again)
+            Returns the unit's output hash if so, None if it has to be (re)done """
+
+        record = self.records.get(self.key(stage, day, latitude, limb))
+        if record is None or record['source'] != source:
+            return None
+        for name, size in zip(filenames, record['sizes']):
+            if not os.path.exists(name) or os.path.getsize(name) != size:
+                return None
+
+        return record['output']
+
+
+def extract_stage(manifest, daypath, cubes, day, limbs, sources):
+
+    """ Extract the day's limb profiles, or load them from output/profiles.npz if that is still complete and
+        was extracted from the same UM output files (sources, see cube_sources; always extracted again
+        if sources is None)
+        Returns the coords, the profiles and the content hash of every column's profile """
+
+    filename = str(daypath) + 'output/profiles.npz'
+    daysource = content_hash(json.dumps({'day': day, 'limbs': list(limbs), 'sources': sources}, sort_keys=True))
+    if sources is not None and manifest.done('extract', day, None, None, daysource, [filename]) is not None:
+        with np.load(filename) as data:
+            coords = [tuple(coord) for coord in data['coords'].tolist()]
+            profiles = data['profiles']
+    else:
+        coords, profiles = extract_limbs(cubes, day, limbs)
+        np.savez(filename, coords=np.array(coords), profiles=profiles)
+        manifest.record('extract', day, None, None, daysource, content_hash(profiles.tobytes()), [filename])
+    # Later stages can be redone without touching the model data
+
+    hashes = [content_hash(profile.tobytes()) for profile in profiles]
+
+    return coords, profiles, hashes
+
+
+def unfinished(stage, day, pending):
+
+    """ Error for units a stage left out of the run would have to redo """
+
+    return ValueError('Day %s has %s units whose %s stage is not done or out of date; include %s in stages'
+                      %(day, len(pending), stage, stage))
+
+
+def render_stage(manifest, daypath, day, coords, profiles, hashes, write_configs, template_hash, run=True):
+
+    """ Render the configs of columns whose profile or template (template_hash) changed or whose config file
+        is missing
+        With run False, nothing is rendered: the configs must all be done already (ValueError otherwise)
+        Returns the content hash of every column's config """
+
+    names = [str(daypath) + 'configfiles/config_%s_%s.txt' %(coord) for coord in coords]
+    sources = [content_hash(profile_hash + template_hash) for profile_hash in hashes]
+    config_hashes = [manifest.done('render', day, latitude, limb, sources[number], [names[number]])
+                     for number, (latitude, limb) in enumerate(coords)]
+    pending = [number for number, config_hash in enumerate(config_hashes) if config_hash is None]
+
+    if pending and not run:
+        raise unfinished('render', day, pending)
+    if pending:
+        configs = write_configs(daypath, [coords[number] for number in pending], profiles[pending])
+        for number, config in zip(pending, configs):
+            config_hashes[number] = content_hash(config)
+            manifest.record('render', day, coords[number][0], coords[number][1], sources[number], config_hashes[number],
+                            [names[number]])
+
+    return config_hashes
+
+
+def submit_stage(manifest, daypath, day, coords, config_hashes, client, params, run=True):
+
+    """ Put the configs through PSG whose spectrum is missing or was made from a different config or with different
+        request parameters (params, such as client.params: a full or a compact response)
+        Each column is recorded as its spectrum comes back, so an interrupted day only resubmits what is left
+        With run False, nothing is submitted: the spectra must all be done already (ValueError otherwise)
+        Returns the content hash of every column's spectrum """
+
+    names = [str(daypath) + 'spectra/trn_%s_%s.txt' %(coord) for coord in coords]
+    params_hash = content_hash(json.dumps([list(param) for param in params]))
+    sources = [content_hash(config_hash + params_hash) for config_hash in config_hashes]
+    spectrum_hashes = [manifest.done('submit', day, latitude, limb, sources[number], [names[number]])
+                       for number, (latitude, limb) in enumerate(coords)]
+    pending = [number for number, spectrum_hash in enumerate(spectrum_hashes) if spectrum_hash is None]
+
+    if pending and not run:
+        raise unfinished('submit', day, pending)
+    if pending:
+        configs = []
+        for number in pending:
+            with open(str(daypath) + 'configfiles/config_%s_%s.txt' %(coords[number]), 'r') as file:
+                configs.append(file.read())
+
+        def finished(index, spectrum):
+            number = pending[index]
+            spectrum_hashes[number] = content_hash(spectrum)
+            manifest.record('submit', day, coords[number][0], coords[number][1], sources[number],
+                            spectrum_hashes[number], [names[number]])
+
+        client.submit_batch(configs, [names[number] for number in pending], callback=finished)
+
+    return spectrum_hashes
+
+
+def aggregate_stage(manifest, daypath, day, coords, spectrum_hashes, trn_columns):
+
+    """ Average the day's spectra into output/rad_mean.npz and output/trn_mean.npz,
+        unless they were already made from exactly these spectra """
+
+    source = content_hash(''.join(spectrum_hashes))
+    names = [str(daypath) + 'output/rad_mean.npz', str(daypath) + 'output/trn_mean.npz']
+    if manifest.done('aggregate', day, None, None, source, names) is not None:
+        return
+
+    files = [str(daypath) + 'spectra/trn_%s_%s.txt' %(coord) for coord in coords]
+    rad_mean = aggregate_files(files, 'rad', rad_columns, fix_sign=True)
+    trn_mean = aggregate_files(files, 'trn', trn_columns)
+    rad_mean.save(names[0])
+    trn_mean.save(names[1])
+    manifest.record('aggregate', day, None, None, source,
+                    content_hash(rad_mean.total.tobytes() + trn_mean.total.tobytes()), names)
+
+
+def run_pipeline(parentpath, cubes, first, last, client, write_configs, trn_columns, dayname='trap_day%s/',
+                 limbs=(36,108), stages=pipeline_stages, template=None, sourcefiles=None):
+
+    """ Run days first to last through extract -> render -> submit -> aggregate
+        parentpath/manifest.jsonl records every finished (day, latitude, limb) unit with content hashes, and
+        a unit is skipped when it was finished from the same input and its file is intact, so a run can be
+        stopped at any point and started again with the same call
+        Changed UM output files (see cube_sources; sourcefiles names them for cubes that do not know their files)
+        re-extract the day, a changed profile or template file re-renders its config, a changed config or change of
+        request parameters resubmits it, and any changed spectrum re-averages the day
+        stages can stop the run early, e.g. ('extract', 'render') to write configs without a PSG client;
+        a stage left out before the last one asked for is not run, and its results must already be done
+        write_configs and trn_columns come from the column_writer.ColumnWriter of the run,
+        template is the template file write_configs renders into """
+
+    manifest = Manifest(str(parentpath) + 'manifest.jsonl')
+    sources = cube_sources(cubes, sourcefiles)
+    if template is not None:
+        with open(template, 'r') as file:
+            template_hash = content_hash(file.read())
+    else:
+        template_hash = ''
+    last_stage = max(pipeline_stages.index(stage) for stage in stages)
+    for day in range(first,last+1):
+        daypath = str(parentpath) + dayname %(day)
+        for folder in ('', 'configfiles/', 'spectra/', 'output/'):
+            Path(str(daypath)+folder).mkdir(exist_ok=True)
+
+        coords, profiles, hashes = extract_stage(manifest, daypath, cubes, day, limbs, sources)
+        if last_stage >= 1:
+            config_hashes = render_stage(manifest, daypath, day, coords, profiles, hashes, write_configs, template_hash,
+                                         'render' in stages)
+        if last_stage >= 2:
+            spectrum_hashes = submit_stage(manifest, daypath, day, coords, config_hashes, client,
+                                           client.params if client is not None else (), 'submit' in stages)
+        if last_stage >= 3:
+            aggregate_stage(manifest, daypath, day, coords, spectrum_hashes, trn_columns)
+        log('Finished day: ' + str(day))
+
+    return manifest
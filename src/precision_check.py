@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Checks that the single precision (float32) mode of extraction and aggregation gives the same configs
+  and mean spectra as double precision to the precision they are printed with
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import re
+import numpy as np
+from limb_extraction import extract_limbs, limb_mean_profiles
+from output_specs import cloud_columns, vapour_columns, limb_mean
+from spectrum_aggregator import aggregate_files
+from instrumentation import log
+
+
+number_pattern = re.compile(r'[-+]?\d+\.\d*(?:[Ee][-+]?\d+)?')
+# Printed values such as 1.2345E+03 in a config; integers such as layer numbers are part of the text around them
+
+
+def last_digit(number):
+
+    """ Size of one unit in the last printed digit of a number, 0.1 for 1.2345E+03 written as text """
+
+    mantissa, _, exponent = number.upper().partition('E')
+    decimals = len(mantissa.split('.')[1])
+
+    return 10.0**(int(exponent or 0) - decimals)
+
+
+def text_difference(text, reference):
+
+    """ Compare the printed numbers of two texts with the same layout, such as a config rendered from float32
+        and from float64 profiles
+        Returns the number of values, how many differ, and the largest difference in units of the reference's
+        last printed digit
+        Raises ValueError if anything other than the numbers differs """
+
+    numbers = number_pattern.findall(text)
+    reference_numbers = number_pattern.findall(reference)
+    if number_pattern.split(text) != number_pattern.split(reference) or len(numbers) != len(reference_numbers):
+        raise ValueError('Texts differ in more than their numbers')
+
+    values = np.array(numbers, dtype=np.float64)
+    reference_values = np.array(reference_numbers, dtype=np.float64)
+    units = np.array([last_digit(number) for number in reference_numbers])
+    digits = np.abs(values - reference_values)/units
+
+    return {'values': len(numbers), 'differing': sum(a != b for a, b in zip(numbers, reference_numbers)),
+            'max_digits': float(np.round(np.max(digits, initial=0), 6))}
+
+
+def combine(differences):
+
+    """ Totals over several text_difference results """
+
+    return {'values': sum(difference['values'] for difference in differences),
+            'differing': sum(difference['differing'] for difference in differences),
+            'max_digits': max((difference['max_digits'] for difference in differences), default=0.0)}
+
+
+def check_configs(cubes, day, specs=(cloud_columns, vapour_columns, limb_mean), limbs=(36,108), templatepath=None):
+
+    """ Render the configs of one day for each product in specs from float32 and from float64 profiles
+        Values are printed to 4 decimal places (%.4E), so a value lying almost exactly between two printed values
+        can round the other way in float32: differences of one in the last digit are expected, rarely, and
+        anything larger means the float32 path has lost precision
+        Returns a dictionary of (values, differing, max_digits) per product name, see text_difference """
+
+    coords, single = extract_limbs(cubes, day, limbs, dtype=np.float32)
+    coords, double = extract_limbs(cubes, day, limbs)
+    report = {}
+    for spec in specs:
+        configs = []
+        for profiles in (single, double):
+            selected = spec.regrid(spec.select(coords, profiles)[1])[0]
+            configs.append(spec.render(selected, templatepath))
+        report[spec.name] = combine([text_difference(config, reference) for config, reference in zip(*configs)])
+        log('Day %s %s: %s of %s values differ, at most %s in the last digit' %(day, spec.name,
+            report[spec.name]['differing'], report[spec.name]['values'], report[spec.name]['max_digits']), 2)
+
+    return report
+
+
+def check_limb_means(cubes, first, last, limbs=(36,108), weighting=None, templatepath=None):
+
+    """ As check_configs for the limb-mean configs of days first to last made by limb_extraction.limb_mean_profiles,
+        as rapid_config.rapid_configs writes them """
+
+    configs = []
+    for dtype in (np.float32, np.float64):
+        days, profiles = limb_mean_profiles(cubes, first, last, limbs, weighting, dtype=dtype)
+        configs.append(limb_mean.render(profiles, templatepath))
+    report = combine([text_difference(config, reference) for config, reference in zip(*configs)])
+    log('Days %s to %s limb means: %s of %s values differ, at most %s in the last digit' %(first, last,
+        report['differing'], report['values'], report['max_digits']), 2)
+
+    return report
+
+
+def check_means(files, section, columns, fix_sign=False, archive=None, digits=6):
+
+    """ Average the rad or trn section of a list of PSG output files (see spectrum_aggregator.aggregate_files)
+        parsing them as float32 and as float64, and compare the mean spectra
+        PSG prints digits significant digits; the float32 mean matches if it differs from the float64 one by less
+        than half a unit in the last of them, relative to the largest value of each component
+        Returns the largest relative difference and whether it is within that precision """
+
+    single = aggregate_files(files, section, columns, fix_sign=fix_sign, archive=archive, dtype=np.float32).mean()[1]
+    double = aggregate_files(files, section, columns, fix_sign=fix_sign, archive=archive).mean()[1]
+    scale = np.max(np.abs(double), axis=0)
+    relative = np.divide(np.abs(single - double), scale, out=np.zeros(double.shape), where=scale > 0)
+    difference = float(np.max(relative, initial=0))
+    report = {'max_relative': difference, 'within': difference < 0.5*10.0**(1-digits)}
+    log('%s mean of %s spectra: largest relative difference %.2e, %s printed precision' %(section, len(files),
+        difference, 'within' if report['within'] else 'outside'), 2)
+
+    return report
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Groups a day's limb columns with near-identical profiles, so each group is put through the PSG once
+  and its spectrum counted once per column in the limb mean
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import json
+import numpy as np
+from limb_extraction import profile_fields
+from spectrum_aggregator import SpectrumAggregator
+
+
+cluster_fields = ('pressure', 'temperature', 'H2O', 'liquid_cloud', 'ice_cloud')
+# Fields compared between columns. N2 and CO2 follow from H2O, altitude is the same everywhere
+
+
+def cluster_features(profiles):
+
+    """ One feature vector per column: the compared fields at every level, log pressure,
+        each field scaled by its standard deviation over the whole day so all fields count equally
+        Returns an array of shape (columns, levels*fields) """
+
+    fields = []
+    for name in cluster_fields:
+        field = profiles[:,:,profile_fields.index(name)]
+        if name == 'pressure':
+            field = np.log(field)
+        spread = np.std(field)
+        fields.append((field - np.mean(field))/(spread if spread > 0 else 1))
+    # Fields that are constant (no clouds in vapour-only runs) drop out as zeros
+
+    return np.concatenate(fields, axis=1)
+
+
+def kmeans_clusters(features, k, iterations=50, seed=0):
+
+    """ Group the columns into k clusters by k-means, seeded with k-means++ so results are repeatable
+        Returns the cluster number of every column """
+
+    k = min(k, len(features))
+    rng = np.random.default_rng(seed)
+    centres = features[[rng.integers(len(features))]]
+    for number in range(1, k):
+        distance = np.min(((features[:,np.newaxis,:] - centres[np.newaxis,:,:])**2).sum(axis=2), axis=1)
+        if distance.sum() == 0:
+            break
+        centres = np.vstack([centres, features[rng.choice(len(features), p=distance/distance.sum())]])
+    # k-means++: each new centre is picked far from the ones already chosen
+
+    labels = None
+    for iteration in range(iterations):
+        distance = ((features[:,np.newaxis,:] - centres[np.newaxis,:,:])**2).sum(axis=2)
+        new_labels = np.argmin(distance, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        centres = np.array([features[labels == cluster].mean(axis=0) for cluster in range(len(centres))
+                            if np.any(labels == cluster)])
+    # Empty clusters are dropped
+
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def tolerance_clusters(features, tolerance):
+
+    """ Group the columns in order: a column joins the first group whose first column is within tolerance
+        (root mean square difference of the scaled features), otherwise it starts a new group
+        Returns the cluster number of every column """
+
+    leaders = []
+    labels = np.empty(len(features), dtype=int)
+    for column, feature in enumerate(features):
+        for cluster, leader in enumerate(leaders):
+            if np.sqrt(np.mean((feature - features[leader])**2)) <= tolerance:
+                labels[column] = cluster
+                break
+        else:
+            labels[column] = len(leaders)
+            leaders.append(column)
+
+    return labels
+
+
+def profile_error(profiles, labels, representatives):
+
+    """ Reconstruction error of replacing every column by its group's representative column
+        For each field: root mean square difference over all columns and levels, relative to the field's own
+        root mean square value (0 if the field is zero everywhere) """
+
+    difference = profiles - profiles[representatives][labels]
+    error = {}
+    for number, name in enumerate(profile_fields):
+        scale = np.sqrt(np.mean(profiles[:,:,number]**2))
+        error[name] = float(np.sqrt(np.mean(difference[:,:,number]**2))/scale) if scale > 0 else 0.0
+
+    return error
+
+
+def reduce_profiles(coords, profiles, k=None, tolerance=None, seed=0):
+
+    """ Replace a day's limb columns by representative columns, by k-means into k groups or by merging
+        columns within tolerance (see tolerance_clusters)
+        Each group is represented by its member closest to the group mean, so the config is a real model column
+        Returns the representatives' coords and profiles, the number of columns each stands for,
+        and a report with the group of every column and the profile reconstruction error """
+
+    features = cluster_features(profiles)
+    if k is not None:
+        labels = kmeans_clusters(features, k, seed=seed)
+    elif tolerance is not None:
+        labels = tolerance_clusters(features, tolerance)
+    else:
+        raise ValueError('Give either k or tolerance to cluster the profiles')
+
+    representatives = []
+    for cluster in range(labels.max()+1):
+        members = np.flatnonzero(labels == cluster)
+        distance = ((features[members] - features[members].mean(axis=0))**2).sum(axis=1)
+        representatives.append(int(members[np.argmin(distance)]))
+
+    weights = [int(np.sum(labels == cluster)) for cluster in range(len(representatives))]
+    report = {'columns': len(coords),
+              'groups': len(representatives),
+              'representatives': [list(coords[column]) for column in representatives],
+              'weights': weights,
+              'labels': labels.tolist(),
+              'profile_error': profile_error(profiles, labels, representatives)}
+
+    return [coords[column] for column in representatives], profiles[representatives], weights, report
+
+
+def save_report(filename, report):
+
+    """ Write the clustering report of a day as JSON """
+
+    with open(filename, 'w') as file:
+        json.dump(report, file, indent=1)
+
+
+def spectrum_error(full_mean, reduced_mean, column=5):
+
+    """ Reconstruction error of the limb mean spectrum against a full run of the same day
+        full_mean and reduced_mean are the output/rad_mean.npz files (or SpectrumAggregators) of the two runs
+        Returns the largest absolute difference in relative transit depth (ppm) for the transit column
+        (rad column 5), relative transit depth being the transit minus its minimum as in plot_transitdepth """
+
+    depths = []
+    for mean in (full_mean, reduced_mean):
+        if not isinstance(mean, SpectrumAggregator):
+            mean = SpectrumAggregator.load(mean)
+        wavelengths, spectrum = mean.mean()
+        transit = spectrum[:,mean.columns.index(column)]
+        depths.append((transit - np.min(transit))*1e6)
+
+    return float(np.max(np.abs(depths[0] - depths[1])))
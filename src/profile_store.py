@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Extracts the limb profiles for a whole campaign once and saves them in a compact float32 file,
+  so configs can be regenerated (new template, vapour-only variant, ...) without reloading the UM output
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from limb_extraction import extract_limbs, find_cubes, profile_fields
+from um_loader import load_limbs
+
+
+store_version = 1
+
+
+def file_fingerprint(filename):
+
+    """ Cheap fingerprint of a UM output file: size, modification time, and a hash of its first and last MB
+        Hashing the whole of tens of GB of model output every time would cost as much as reloading it """
+
+    stat = os.stat(filename)
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        digest.update(file.read(2**20))
+        if stat.st_size > 2**21:
+            file.seek(-2**20, os.SEEK_END)
+            digest.update(file.read(2**20))
+
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest.hexdigest()}
+
+
+class ProfileStore:
+
+    """ Limb profiles for a range of model days, shape (days, columns, levels, fields), normally stored as float32
+        Can be passed anywhere the UM cubes are expected (day_generator, batch_job, rapid_config, ...):
+        extract_limbs and limb_mean_profiles read the profiles from here instead of from the cubes """
+
+    def __init__(self, profiles, metadata):
+        self.profiles = profiles
+        self.metadata = metadata
+        self.days = metadata['days']
+        self.coords = [tuple(coord) for coord in metadata['coords']]
+
+    def extract_limbs(self, day=-1, limbs=(36,108), dtype=np.float64):
+
+        """ Same result as limb_extraction.extract_limbs on the original cubes, for the stored limbs,
+            as float64 or the given dtype """
+
+        day_position = day if day < 0 else self.days.index(day)
+        latitudes = sorted(set(latitude for latitude, longitude in self.coords))
+        coords = [(latitude, longitude) for latitude in latitudes for longitude in limbs]
+        columns = [self.coords.index(coord) for coord in coords]
+        # Raises ValueError if a day or limb was not stored
+
+        return coords, self.profiles[day_position][columns].astype(dtype)
+
+    def limb_mean_profiles(self, first, last, limbs=(36,108), weighting=None, dtype=np.float64):
+
+        """ Same result as limb_extraction.limb_mean_profiles on the original cubes, for the stored days and limbs:
+            the mean of the stored columns over every latitude on both limbs, in float64 whatever dtype is
+            weighting 'cos' needs the latitudes saved with the profiles (stores saved before they were kept have
+            only their indices) """
+
+        days = list(range(first, last+1))
+        latitudes = sorted(set(latitude for latitude, longitude in self.coords))
+        columns = [self.coords.index((latitude, limb)) for latitude in latitudes for limb in limbs]
+        day_positions = [self.days.index(day) for day in days]
+        # Raises ValueError if a day or limb was not stored
+
+        if weighting == 'cos':
+            if 'latitudes' not in self.metadata:
+                raise ValueError('Profiles saved without their latitudes, save them again to weight by cos(latitude)')
+            weights = np.cos(np.radians(self.metadata['latitudes']))[latitudes]
+        elif weighting is None:
+            weights = np.ones(len(latitudes))
+        else:
+            raise ValueError('Unknown weighting %s, expected None or cos' %(weighting))
+        weights = np.repeat(weights/(weights.sum()*len(limbs)), len(limbs))
+        # Weight of each stored column in the mean over both limbs, columns ordered by latitude then limb
+
+        return days, np.einsum('dcvf,c->dvf', self.profiles[day_positions][:,columns], weights, dtype=np.float64)
+
+
+def save_profiles(filename, sourcefiles, first, last, limbs=(36,108), dtype=np.float32):
+
+    """ Extract the limb profiles of days first to last from UM output files and save them to filename (.npz)
+        with the level heights, units, limbs and fingerprints of the source files
+        float32 halves the file, but the configs rendered from it can differ in the last printed digit
+        of a few layer values; use dtype=np.float64 to get the same configs as from the cubes """
+
+    cubes = load_limbs(sourcefiles, first, last, limbs)
+    days = list(range(first, last+1))
+    for number, day in enumerate(days):
+        coords, day_profiles = extract_limbs(cubes, day, limbs)
+        if number == 0:
+            profiles = np.empty((len(days),) + day_profiles.shape, dtype=dtype)
+        profiles[number] = day_profiles
+    # One lazy read of each day's limb columns
+
+    found = find_cubes(cubes)
+    metadata = {'version': store_version,
+                'days': days,
+                'limbs': list(limbs),
+                'coords': coords,
+                'fields': list(profile_fields),
+                'level_heights': (found['pressure'].coord('level_height').points*1e-3).tolist(),
+                'latitudes': found['pressure'].coord('latitude').points.tolist(),
+                'units': {'pressure': str(found['pressure'].units), 'temperature': 'K', 'altitude': 'km',
+                          'N2': 'mol/mol', 'H2O': 'mol/mol', 'CO2': 'mol/mol',
+                          'liquid_cloud': str(found['spec_humid'].units), 'ice_cloud': str(found['spec_humid'].units)},
+                'sources': {str(source): file_fingerprint(source) for source in sourcefiles}}
+    np.savez(filename, profiles=profiles, metadata=json.dumps(metadata))
+
+    return ProfileStore(profiles, metadata)
+
+
+def load_profiles(filename, sourcefiles=None):
+
+    """ Load saved limb profiles, or return None if the file is missing or no longer valid:
+        a different version, or (if sourcefiles is given) source files that differ from the ones it was made from """
+
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename) as data:
+        metadata = json.loads(str(data['metadata']))
+        if metadata.get('version') != store_version:
+            return None
+        if sourcefiles is not None:
+            if sorted(metadata['sources']) != sorted(str(source) for source in sourcefiles):
+                return None
+            for source in sourcefiles:
+                if not os.path.exists(source) or file_fingerprint(source) != metadata['sources'][str(source)]:
+                    return None
+        profiles = data['profiles']
+
+    return ProfileStore(profiles, metadata)
+
+
+def open_profiles(filename, sourcefiles, first, last, limbs=(36,108), dtype=np.float32):
+
+    """ Use the saved limb profiles in filename if present and still valid for these source files and days,
+        otherwise extract them from the UM output once and save them for next time """
+
+    store = load_profiles(filename, sourcefiles)
+    if store is not None and all(day in store.days for day in range(first, last+1)) \
+        and all(limb in store.metadata['limbs'] for limb in limbs) and store.profiles.dtype == dtype:
+        return store
+
+    return save_profiles(filename, sourcefiles, first, last, limbs, dtype)
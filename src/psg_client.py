@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Sends config files to the Planetary Spectrum Generator API and collects the spectra it returns
+- Can spread the requests over a pool of PSG servers, such as several local PSG containers
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import http.client
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrumentation import log, stats
+
+
+psg_url = 'https://psg.gsfc.nasa.gov/api.php'
+local_psg_url = 'http://localhost:3000/api.php'
+
+
+def local_psg_urls(ports=(3000,)):
+
+    """ URLs of PSG containers running on this machine on the given ports """
+
+    return ['http://localhost:%s/api.php' %(port) for port in ports]
+
+
+psg_params = (('type', 'all'), ('whdr', 'y'))
+# Same request as curl -d type=all -d whdr=y
+
+psg_sections = ('rad', 'trn')
+# Output types the pipeline reads: the radiance/transit table and the transmittance breakdown
+
+
+def output_params(types=psg_sections):
+
+    """ Request parameters asking PSG for the given output types only (such as 'rad' and 'trn'), with headers,
+        instead of every type; the response is several times smaller and is read by the same section parsers """
+
+    return (('type', ','.join(types)), ('whdr', 'y'))
+
+
+class PSGError(Exception):
+
+    """ Raised when PSG cannot be reached or returns something that is not a spectrum """
+
+
+def check_spectrum(text):
+
+    """ Raise PSGError if the text returned by PSG is an error message or web page rather than a spectrum
+        A spectrum has at least one line of numbers after its header lines """
+
+    start = text.lstrip()[:200].lower()
+    if not start:
+        raise PSGError('PSG returned an empty response')
+    if start.startswith('<!doctype') or start.startswith('<html'):
+        raise PSGError('PSG returned a web page: ' + start[:80])
+    if start.startswith('error'):
+        raise PSGError('PSG returned an error: ' + text.strip().splitlines()[0])
+
+    for line in text.splitlines():
+        words = line.split()
+        if not words or line.startswith('#'):
+            continue
+        try:
+            float(words[0])
+            return
+        except ValueError:
+            continue
+    # Stop at the first data line
+
+    raise PSGError('PSG response contains no spectrum: ' + text.strip().splitlines()[0][:80])
+
+
+class PSGEndpoint:
+
+    """ One PSG server of a client's pool, with the client's counts of its requests:
+        outstanding - requests sent and not yet answered
+        requests, failures - answered and failed requests
+        seconds - total time taken by answered requests
+        A server that fails a request is marked down for the client's cooldown and only used again after that
+        if no healthy server is left """
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.down_until = 0.0
+
+    @property
+    def healthy(self):
+        """ Whether the server is not marked down """
+        return time.time() >= self.down_until
+
+    def connect(self, timeout):
+
+        """ Open a new HTTP connection to this server """
+
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+
+class PSGClient:
+
+    """ Client for the PSG api.php endpoint, or for a pool of them if url is a list of URLs
+        Keeps one HTTP connection open per worker thread and server, and runs up to workers requests at once
+        With a pool, each request goes to the healthy server with the fewest requests outstanding
+        Failed requests (connection errors, timeouts, HTTP errors) mark their server down for cooldown seconds and
+        are retried on another healthy server, or with exponential backoff when none is left
+        With types (see output_params), PSG is asked for only those output types instead of params
+        If a SpectrumCache is given, it is checked before each request and filled with each new spectrum """
+
+    def __init__(self, url=psg_url, workers=4, timeout=300, retries=3, backoff=2.0, params=psg_params, cache=None,
+                 cooldown=30.0, types=None):
+        urls = [url] if isinstance(url, str) else list(url)
+        self.endpoints = [PSGEndpoint(address) for address in urls]
+        self.url = urls[0]
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.params = tuple(params) if types is None else output_params(types)
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connections = []
+        self.pool = None
+        self.started = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+
+        """ Stop the worker threads and close their connections """
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        if len(self.endpoints) > 1:
+            self.report()
+
+    def connection(self, endpoint):
+
+        """ Return this thread's open connection to a server, opening it if needed """
+
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        if endpoint.url not in connections:
+            connections[endpoint.url] = endpoint.connect(self.timeout)
+            with self.lock:
+                self.connections.append(connections[endpoint.url])
+
+        return connections[endpoint.url]
+
+    def reset(self, endpoint):
+
+        """ Drop this thread's connection to a server after an error so the next attempt opens a fresh one """
+
+        connection = getattr(self.local, 'connections', {}).pop(endpoint.url, None)
+        if connection is not None:
+            connection.close()
+
+    def acquire(self, tried=()):
+
+        """ Pick the server for a request: the healthy one with the fewest outstanding requests, preferring servers
+            not yet tried for this request; if every server is down, the one that comes back soonest """
+
+        with self.lock:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            candidates = ([endpoint for endpoint in healthy if endpoint not in tried] or healthy
+                          or [min(self.endpoints, key=lambda endpoint: endpoint.down_until)])
+            endpoint = min(candidates, key=lambda endpoint: (endpoint.outstanding, endpoint.requests))
+            endpoint.outstanding += 1
+
+        return endpoint
+
+    def release(self, endpoint, seconds=None):
+
+        """ Record the end of a request to a server: answered in seconds, or failed if seconds is None """
+
+        with self.lock:
+            endpoint.outstanding -= 1
+            if seconds is None:
+                endpoint.failures += 1
+                endpoint.down_until = time.time() + self.cooldown
+            else:
+                endpoint.requests += 1
+                endpoint.seconds += seconds
+                endpoint.down_until = 0.0
+
+    def throughput(self):
+
+        """ Requests answered and failed per server, with mean latency (seconds) and requests per second
+            since the client was made """
+
+        elapsed = time.time() - self.started
+        with self.lock:
+            return {endpoint.url: {'healthy': endpoint.healthy, 'outstanding': endpoint.outstanding,
+                                   'requests': endpoint.requests, 'failures': endpoint.failures,
+                                   'mean_latency': endpoint.seconds/endpoint.requests if endpoint.requests else None,
+                                   'rate': endpoint.requests/elapsed if elapsed else None}
+                    for endpoint in self.endpoints}
+
+    def report(self):
+
+        """ Log the throughput of each server of the pool, at verbosity 2 """
+
+        for url, endpoint in self.throughput().items():
+            log('%s: %s requests (%.2f/s), %s failed, %s' %(url, endpoint['requests'], endpoint['rate'] or 0,
+                endpoint['failures'], 'healthy' if endpoint['healthy'] else 'down'), 2)
+
+    def post(self, endpoint, body):
+
+        """ Send one urlencoded request body to a server and return the response text """
+
+        connection = self.connection(endpoint)
+        connection.request('POST', endpoint.path, body=body,
+                           headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        response = connection.getresponse()
+        data = response.read()
+        # Read the whole response so the connection can be reused
+        if response.status != 200:
+            raise http.client.HTTPException('HTTP %s from %s' %(response.status, endpoint.url))
+
+        return data.decode('utf-8', errors='replace')
+
+    def submit(self, config):
+
+        """ Send the text of one config file to PSG and return the spectrum """
+
+        if self.cache is not None:
+            spectrum = self.cache.get(config, self.params)
+            if spectrum is not None:
+                stats.count('cache_hits')
+                return spectrum
+            stats.count('cache_misses')
+        # Byte-identical config already run with the same request parameters
+
+        body = urllib.parse.urlencode(self.params + (('file', config),))
+        tried = []
+        for attempt in range(self.retries+1):
+            endpoint = self.acquire(tried)
+            try:
+                start = time.perf_counter()
+                text = self.post(endpoint, body)
+            except (OSError, http.client.HTTPException) as error:
+                self.release(endpoint)
+                self.reset(endpoint)
+                tried.append(endpoint)
+                stats.count('psg_retries')
+                if attempt == self.retries:
+                    raise PSGError('PSG request failed after %s attempts: %s' %(attempt+1, error)) from error
+                if not any(endpoint.healthy for endpoint in self.endpoints):
+                    time.sleep(self.backoff*2**attempt)
+                # Straight on to another server if one is healthy, otherwise wait for one to recover
+                continue
+            seconds = time.perf_counter() - start
+            self.release(endpoint, seconds)
+            stats.latency(seconds)
+            if len(self.endpoints) > 1:
+                stats.count('psg_requests ' + endpoint.url)
+            break
+        check_spectrum(text)
+        # An error message from PSG is not retried: the same config would give the same error
+
+        if self.cache is not None:
+            self.cache.put(config, self.params, text)
+
+        return text
+
+    def executor(self):
+
+        """ Return the pool of worker threads, starting it on first use """
+
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def iter_submit(self, configs):
+
+        """ Send a batch of config texts to PSG concurrently
+            Yields (index, spectrum) pairs in the order the spectra come back """
+
+        futures = {self.executor().submit(self.submit, config): index for index, config in enumerate(configs)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def submit_batch(self, configs, outnames=None, callback=None):
+
+        """ Send a batch of config texts to PSG concurrently and return the spectra in the same order
+            If outnames is given, each spectrum is also written to the matching file, which appears only once complete
+            If callback is given, callback(index, spectrum) is called as each spectrum comes back
+            Every config is attempted; PSGError is raised at the end if any of them failed """
+
+        configs = list(configs)
+        spectra = [None]*len(configs)
+        failed = []
+        start = time.perf_counter()
+        futures = {self.executor().submit(self.submit, config): index for index, config in enumerate(configs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                spectra[index] = future.result()
+            except PSGError as error:
+                failed.append((index, error))
+                continue
+            if outnames is not None:
+                with open(outnames[index] + '.part', 'w') as file:
+                    file.write(spectra[index])
+                os.replace(outnames[index] + '.part', outnames[index])
+                stats.add('submit', bytes_written=len(spectra[index]))
+            # Written beside the output file and moved into place, so a spectrum file is always complete
+            if callback is not None:
+                callback(index, spectra[index])
+
+        stats.add('submit', len(configs) - len(failed), time.perf_counter() - start,
+                  bytes_read=sum(len(spectrum) for spectrum in spectra if spectrum is not None))
+        stats.count('psg_failures', len(failed))
+        if failed:
+            raise PSGError('%s of %s PSG requests failed, first: %s' %(len(failed), len(configs), failed[0][1]))
+
+        return spectra
+
+    def submit_files(self, filenames, outnames):
+
+        """ Send previously written config files to PSG and write each spectrum to the matching output file """
+
+        configs = []
+        for filename in filenames:
+            with open(filename, 'r') as file:
+                configs.append(file.read())
+
+        return self.submit_batch(configs, outnames)
+
+    def submit_archive(self, archive, names, outnames):
+
+        """ Send configs stored as members of a day_archive.DayArchive to PSG, read straight from the archive,
+            and add each spectrum to the archive as the matching member of outnames """
+
+        configs = [archive.read(name) for name in names]
+
+        return self.submit_batch(configs, callback=lambda index, spectrum: archive.write(outnames[index], spectrum))
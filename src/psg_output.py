@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Reads sections of the spectra generated by NASA's Planetary Spectrum Generator into NumPy arrays
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import atexit
+import json
+import os
+import threading
+import numpy as np
+
+
+rad_columns = (1,2,3,4,5,6)
+# Radiance section: total, noise, stellar, planet, transit, blocked
+cloud_trn_columns = (1,3,4,5,6,7,8)
+# Transmittance section, cloud template: total, H2O, CO2, ice cloud, liquid cloud, Rayleigh scattering, collision-induced absorption
+vapour_trn_columns = (1,3,4,5,6)
+# Transmittance section, vapour-only template: total, H2O, CO2, Rayleigh scattering, collision-induced absorption
+
+section_keywords = {'rad': ('Total', 'Noise', 'Stellar'),
+                    'trn': ('Total', 'Rayleigh')}
+# Words in the column header comment line just above each section of the PSG output
+# rad: radiance/transit table, trn: transmittance breakdown by absorber
+
+
+def parse_section(lines, fix_sign=False, dtype=np.float64):
+
+    """ Convert lines of PSG output data into a float64 (or dtype) array of shape (rows, columns)
+        fix_sign applies the ' -' to '  ' replacement used for the radiance section to the whole block at once """
+
+    text = ''.join(lines)
+    if fix_sign:
+        text = text.replace(' -', '  ')
+
+    return np.array(text.split(), dtype=dtype).reshape(len(lines), -1)
+
+
+def scan_blocks(lines):
+
+    """ Find every block of numeric data lines in an iterable of PSG output lines (as bytes)
+        Returns a list of [byte offset, number of rows, header, line number] for each block, where
+        the header is the last comment line before the block (PSG's column labels) """
+
+    blocks = []
+    header = ''
+    block = None
+    offset = 0
+    for line_number, line in enumerate(lines):
+        words = line.split()
+        is_data = False
+        if words and not line.startswith(b'#'):
+            try:
+                float(words[0])
+                is_data = True
+            except ValueError:
+                pass
+
+        if is_data:
+            if block is None:
+                block = [offset, 0, header, line_number]
+                blocks.append(block)
+            block[1] += 1
+        else:
+            block = None
+            if line.startswith(b'#'):
+                header = line[1:].decode('utf-8', errors='replace').strip()
+        offset += len(line)
+
+    return blocks
+
+
+def index_sections(filename):
+
+    """ One streaming pass over a PSG output file, returning the blocks found by scan_blocks """
+
+    with open(filename, 'rb') as file:
+        return scan_blocks(file)
+
+
+index_filename = 'sections.idx'
+# One section index per spectra directory, so indexing adds one file per folder rather than one per spectrum
+
+index_lock = threading.Lock()
+directory_indexes = {}
+# Indexes already read by this process, by directory
+pending_indexes = {}
+# Entries indexed by this process since the last flush_indexes, by directory
+
+
+def read_directory_index(directory):
+
+    """ Entries of a directory's section index, by spectrum file name (empty if it has none yet) """
+
+    try:
+        with open(os.path.join(directory, index_filename), 'r') as file:
+            index = json.load(file)
+        if index.get('version') == 3:
+            return index['files']
+    except (OSError, ValueError, KeyError):
+        pass
+    # Missing, unreadable or older index
+
+    return {}
+
+
+def load_index(filename):
+
+    """ Return the section index of a PSG output file
+        The indexes of every spectrum in a directory are kept together in one small file in that directory
+        (index_filename); a spectrum is only indexed again when it has changed size or modification time
+        since it was indexed
+        New entries are held in memory until flush_indexes, so reading a directory of new spectra rewrites its
+        index once rather than once per spectrum """
+
+    stat = os.stat(filename)
+    directory, name = os.path.split(os.path.abspath(filename))
+    with index_lock:
+        entries = directory_indexes.get(directory)
+        if entries is None:
+            entries = directory_indexes[directory] = read_directory_index(directory)
+        entry = entries.get(name)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['blocks']
+
+    blocks = index_sections(filename)
+    with index_lock:
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'blocks': blocks}
+        directory_indexes[directory][name] = entry
+        pending_indexes.setdefault(directory, {})[name] = entry
+
+    return blocks
+
+
+def flush_indexes():
+
+    """ Write the entries added by load_index since the last flush to each directory's index file,
+        with one write per directory; also run when the process exits """
+
+    with index_lock:
+        for directory, pending in pending_indexes.items():
+            entries = directory_indexes[directory] = read_directory_index(directory)
+            entries.update(pending)
+            # Merged into the index as it is on disk, which other processes may have added to meanwhile
+            indexname = os.path.join(directory, index_filename)
+            try:
+                with open(indexname + '.%s' %(os.getpid()), 'w') as file:
+                    json.dump({'version': 3, 'files': entries}, file)
+                os.replace(indexname + '.%s' %(os.getpid()), indexname)
+            except OSError:
+                pass
+            # Replaced whole, so readers never see half an index; a read-only directory just means
+            # the spectra are indexed again next time
+            for name in pending:
+                try:
+                    os.remove(os.path.join(directory, name + '.idx'))
+                except OSError:
+                    pass
+            # Per-spectrum indexes left by older versions
+        pending_indexes.clear()
+
+
+atexit.register(flush_indexes)
+
+
+def find_section(blocks, section):
+
+    """ Pick the block whose header contains all the keywords for section ('rad' or 'trn')
+        Raises ValueError rather than guessing if no block matches """
+
+    keywords = section_keywords[section]
+    for block in blocks:
+        if all(keyword in block[2] for keyword in keywords):
+            return block
+
+    raise ValueError('No %s section found (looking for a header with %s)' %(section, ', '.join(keywords)))
+
+
+def read_named_section(filename, section, fix_sign=False, dtype=np.float64):
+
+    """ Read the whole rad or trn section of one PSG output file into a float64 array of shape (rows, columns)
+        Uses the section index to seek straight to the section instead of reading the file from the start """
+
+    block = find_section(load_index(filename), section)
+    offset, rows = block[0], block[1]
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        lines = [file.readline().decode() for row in range(rows)]
+
+    return parse_section(lines, fix_sign=fix_sign, dtype=dtype)
+
+
+def sections_from_text(text, sections=('rad', 'trn'), fix_sign=('rad',), dtype=np.float64):
+
+    """ Read several sections out of PSG output that is already in memory, for example straight from the API,
+        with one scan of the text; works the same for a full type=all response and for a compact one holding
+        only the sections asked for (psg_client.output_params)
+        fix_sign lists the sections the radiance sign fix is applied to
+        Returns a dictionary of float64 (or dtype) arrays of shape (rows, columns) keyed by section """
+
+    lines = text.encode().splitlines(keepends=True)
+    blocks = scan_blocks(lines)
+    arrays = {}
+    for section in sections:
+        block = find_section(blocks, section)
+        rows = lines[block[3]:block[3]+block[1]]
+        arrays[section] = parse_section([line.decode() for line in rows], fix_sign=section in fix_sign, dtype=dtype)
+
+    return arrays
+
+
+def section_from_text(text, section, fix_sign=False, dtype=np.float64):
+
+    """ Read the rad or trn section out of PSG output that is already in memory, for example straight
+        from the API, into a float64 (or dtype) array of shape (rows, columns) """
+
+    return sections_from_text(text, (section,), (section,) if fix_sign else (), dtype)[section]
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Parses template Planetary Spectrum Generator config files once and renders profiles into them
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import numpy as np
+from instrumentation import stats
+
+
+templatepath = '/exports/csce/datastore/geos/users/s1144983/psg_files/templates'
+
+template_layouts = {'trape_template.txt': (54, 38, 8),
+                    'proxb_vapour.txt': (55, 60, 6)}
+# Line where the atmosphere layers begin, number of layers, and number of data points per layer
+# Cloud template: pressure, temperature, altitude, N2, H2O, CO2, liquid cloud, ice cloud
+# Vapour-only template: pressure, temperature, altitude, N2, H2O, CO2
+
+loaded_templates = {}
+# Templates already parsed by this process, keyed by (path, name, layers)
+
+
+class PSGTemplate:
+
+    """ A template PSG config file with empty atmosphere layers, parsed once
+        The whole file is compiled into a single format string with one %.4E slot per data point,
+        so a config is rendered with one formatting operation instead of one per layer """
+
+    def __init__(self, lines, start, layers, fields):
+        self.lines = lines
+        self.start = start
+        self.layers = layers
+        self.fields = fields
+
+        head = ''.join(lines[:start])
+        body = ''.join(line.rstrip().replace('%', '%%') + ','.join(['%.4E']*fields) + '\n'
+                       for line in lines[start:start+layers])
+        tail = ''.join(lines[start+layers:])
+        self.format = head.replace('%', '%%') + body + tail.replace('%', '%%')
+        # Escape any % already in the template so only the data slots are filled
+        # Format in scientific notation to 4 decimal places, capital E
+
+    def render(self, profile):
+
+        """ Render one column's profile, shape (levels, fields), to config file text """
+
+        with stats.stage('render', 1):
+            values = np.asarray(profile)[:self.layers,:self.fields]
+            return self.format % tuple(values.ravel().tolist())
+
+    def render_batch(self, profiles):
+
+        """ Render a batch of profiles, shape (columns, levels, fields), to a list of config file texts """
+
+        with stats.stage('render', len(profiles)):
+            values = np.asarray(profiles)[:,:self.layers,:self.fields]
+            values = values.reshape(values.shape[0], -1).tolist()
+            # Convert to Python floats in one step rather than element by element
+
+            return [self.format % tuple(row) for row in values]
+
+
+def reduce_layers(lines, start, layers, reduced):
+
+    """ Template lines with only the first reduced of its layers atmosphere layer lines,
+        and the <ATMOSPHERE-LAYERS> count in the header changed to match """
+
+    head = [('<ATMOSPHERE-LAYERS>%s\n' %(reduced) if line.startswith('<ATMOSPHERE-LAYERS>') else line)
+            for line in lines[:start]]
+
+    return head + lines[start:start+reduced] + lines[start+layers:]
+
+
+def load_template(name, path=templatepath, layers=None):
+
+    """ Return the parsed template called name from path, reading the file only the first time it is asked for
+        With layers, the template is cut down to that many atmosphere layers (for profiles regridded by
+        layer_reduction) """
+
+    key = (str(path), name, layers)
+    if key not in loaded_templates:
+        with open(str(path) + '/' + name, 'r') as template:
+            lines = template.readlines()
+        start, full_layers, fields = template_layouts[name]
+        if layers is not None and layers < full_layers:
+            lines = reduce_layers(lines, start, full_layers, layers)
+            full_layers = layers
+        loaded_templates[key] = PSGTemplate(lines, start, full_layers, fields)
+
+    return loaded_templates[key]
@@ -6,93 +6,85 @@ Created on Wed May 18 13:21:20 2022
 @author: Mo Cohen
 """
 
-import iris
-import subprocess
-import iris.plot as iplt
-import matplotlib.pyplot as plt
-import matplotlib.cm as mpl_cm
 import numpy as np
-import pandas as pd
-import glob
+from functools import partial
 from pathlib import Path
+from limb_extraction import extract_limbs, limb_mean_profiles
+from output_specs import limb_mean
+from parallel_batch import run_days
+from instrumentation import instrumented_job, log, stats
 
 
 templatepath = '/exports/csce/datastore/geos/users/s1144983/psg_files/templates'
 
 def rapid_config(daypath, cubes, day, east=36, west=108):
     
-    """ For one model column:
+    """ For the mean of every column on both limbs:
         Extracts profiles for: pressure, temperature, water vapour, liquid cloud, ice cloud
         Calculates/defines profiles for: N2, CO2
         Reads in a template Planetary Spectrum Generator config file with empty atmosphere layers
-        Writes UM model data atmospheric profiles into atmosphere layers
-        Outputs a text file labelled with the array coordinates of the column for which the profile has been generated"""
+        Writes the limb-mean atmospheric profiles into atmosphere layers
+        Outputs a text file labelled with the model day"""
     
-    for cube in cubes:
-        if cube.standard_name == 'air_pressure':
-            air_pressure = cube[day,:,:,:].copy()
-        if cube.standard_name == 'air_potential_temperature':
-            potential_temp = cube[day,:,:,:].copy()
-        if cube.standard_name == 'specific_humidity':
-            spec_humid = cube[day,:,:,:].copy()
-        if cube.standard_name == 'mass_fraction_of_cloud_ice_in_air':
-            ice_cloud = cube[day,:,:,:].copy()
-        if cube.standard_name == 'mass_fraction_of_cloud_liquid_water_in_air':
-            liquid_cloud = cube[day,:,:,:].copy()
-    # Extract the model data cubes needed
-        
-    p0 = iris.coords.AuxCoord(100000.0, long_name='reference_pressure', units='Pa')
-    p0.convert_units(air_pressure.units)
-    absolute_temp = potential_temp*((air_pressure/p0)**(287.05/1005)) # R and cp in J/kgK for 300K
-    # Convert potential temperature into absolute temperature
+    coords, profiles = extract_limbs(cubes, day, limbs=(east, west))
+    # Extract only the two limb columns at every latitude, not the whole global field
     
-    altitude = air_pressure.coord('level_height').points*1e-3
-    # Extract altitude of T-P points from air pressure cube (in km)
+    limb_coords, limb_profile = limb_mean.select(coords, profiles)
+    # Mean over every latitude on both limbs of pressure, temperature, altitude, N2, H2O, CO2, liquid cloud, and ice cloud
     
-    air_pressure = air_pressure.data
-    limb_pressure = (np.sum(air_pressure[:,:,east],axis=1) + np.sum(air_pressure[:,:,west],axis=1))/180
-    absolute_temp = absolute_temp.data
-    limb_temp = (np.sum(absolute_temp[:,:,east],axis=1) + np.sum(absolute_temp[:,:,west],axis=1))/180
-    vapour = (28.0134/18.01528)*np.abs(spec_humid.data) # Convert kg/kg to molecules/molecules
-    limb_vapour = (np.sum(vapour[:,:,east],axis=1) + np.sum(vapour[:,:,west],axis=1))/180
-    
-    CO2 = np.full(limb_vapour.shape,(28.0134/44.0095)*5.94e-4) # Model has a fixed amount of CO2. Convert kg/kg to molecules/molecules
-    N2 = np.ones(limb_vapour.shape) - limb_vapour - CO2 # Any gas that isn't vapour or CO2 is N2
-    liquid_cloud = liquid_cloud.data
-    limb_liq = (np.sum(liquid_cloud[:,:,east],axis=1) + np.sum(liquid_cloud[:,:,west],axis=1))/180
-    ice_cloud = ice_cloud.data
-    limb_ice = (np.sum(ice_cloud[:,:,36],axis=1) + np.sum(ice_cloud[:,:,west],axis=1))/180
+    config = limb_mean.render(limb_profile, templatepath)[0]
+    list_out = config.splitlines(keepends=True)
+    # Render the limb-mean pressure, temperature, altitude, N2, H2O, CO2, liquid cloud, and ice cloud profiles
+    # into the template PSG config file that already has ProxB planetary data in it (parsed once per process)
 
-    template = open(str(templatepath) + '/trape_template.txt','r')    
-    list_in = template.readlines()
-    list_out = list_in.copy()
-    template.close()
-    # Open template PSG config file that already has ProxB planetary data in it, read lines into a list
-    
-    for layer in range(0,38):
-        line_index = 54+layer # Atmosphere layers begin at line 54 of the template
-        list_in[line_index] = list_in[line_index].rstrip() # Strip \n from end of line
-        list_out[line_index] = list_in[line_index] + f"{limb_pressure[layer]:.4E}" + ',' + \
-        f"{limb_temp[layer]:.4E}" + ',' + f"{altitude[layer]:.4E}" + ',' + f"{N2[layer]:.4E}" + ',' + f"{limb_vapour[layer]:.4E}" + ',' + \
-        f"{CO2[layer]:.4E}" + ',' + f"{limb_liq[layer]:.4E}" + ',' + f"{limb_ice[layer]:.4E}" + '\n'
-        # For each atmosphere layer, add pressure, temperature, N2, H2O, CO2, liquid cloud, and ice cloud data point
-        # Format in scientific notation to 4 decimal places, capital E
-    print(list_out) # Print to check your list formatting matches examples
+    log(config, 3) # Check the formatting matches examples at verbosity 3
     
     with open(str(daypath) + 'day_%s.txt' %(day), 'w') as file:
-        for line in list_out:
-            file.write(line)
-            
-    file.close()
+        file.write(config)
     # Write to a text file labeled with array column coordinates
+    stats.add('render', bytes_written=len(config))
     
     return(list_out)
 
 
-def batch_job(parentpath, cubes, first, last): 
+def rapid_configs(daypath, cubes, days, east=36, west=108, weighting=None, dtype=np.float64):
+
+    """ Limb-mean config files for every day from days[0] to days[1] in one go:
+        the limb-mean profiles of all the days are computed together from the limb columns
+        (see limb_extraction.limb_mean_profiles, weighting None or 'cos' for cos(latitude) weights)
+        and rendered into the template in one batch
+        dtype=np.float32 reads and converts the limb columns in single precision, half the memory
+        Outputs one text file per model day, as rapid_config does
+        Returns the config texts """
+
+    first, last = days
+    days, profiles = limb_mean_profiles(cubes, first, last, limbs=(east, west), weighting=weighting,
+                                        dtype=dtype)
+    configs = limb_mean.render(profiles, templatepath)
+    for day, config in zip(days, configs):
+        with open(str(daypath) + 'day_%s.txt' %(day), 'w') as file:
+            file.write(config)
+    stats.add('render', bytes_written=sum(len(config) for config in configs))
+
+    return configs
+
+
+@instrumented_job
+def batch_job(parentpath, cubes, first, last, workers=1, weighting=None, days_per_task=50, dtype=np.float64): 
+    
+    """ Write limb-mean configs for days first to last, many days per pass over the data (see rapid_configs)
+        With workers > 1 the days are split into blocks of days_per_task days spread over a pool of
+        processes that share the cubes """
+    
+    daypath = str(parentpath) + 'configfiles/'
+    Path(str(daypath)).mkdir(exist_ok=True)
+    if workers == 1:
+        rapid_configs(daypath, cubes, (first, last), weighting=weighting, dtype=dtype)
+        log('Written configs for days: %s to %s' %(first, last))
+        return
     
-    for day in range(first,last+1):
-        daypath = str(parentpath) + 'configfiles/'
-        Path(str(daypath)).mkdir(exist_ok=True)
-        rapid_config(daypath, cubes, day=day)
-    
\ No newline at end of file
+    tasks = [(daypath, (start, min(start + days_per_task - 1, last))) for start in range(first, last+1, days_per_task)]
+    write = partial(rapid_configs, weighting=weighting, dtype=dtype)
+    # Each task is a block of days, passed where run_days puts the day
+    for number, (daypath, days, configs) in enumerate(run_days(write, tasks, cubes, workers)):
+        log('Finished days: %s to %s (%s of %s)' %(days[0], days[1], number+1, len(tasks)))
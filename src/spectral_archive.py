@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Stores spectra generated by NASA's Planetary Spectrum Generator for many days in one binary archive
+  with dimensions (day, latitude, limb, wavelength, component), memory-mapped for reading
+- Ingests the existing per-column text spectra into the archive
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import json
+import os
+import numpy as np
+from pathlib import Path
+from psg_output import flush_indexes, rad_columns, read_named_section
+from day_archive import day_archive, has_archive, spectrum_member
+from instrumentation import log
+
+
+class SpectralArchive:
+
+    """ A directory holding:
+        data.npy - float array (days, latitudes, limbs, wavelengths, components), one contiguous chunk per day,
+                   opened as a memory map so only the days sliced are read from disk
+        wavelengths.npy - wavelength axis in um
+        archive.json - the model days, limb longitudes, PSG output section and columns, and which days are filled
+        Columns not yet ingested are NaN """
+
+    def __init__(self, path, mode='r'):
+        self.path = Path(path)
+        with open(self.path / 'archive.json', 'r') as file:
+            self.metadata = json.load(file)
+        self.days = self.metadata['days']
+        self.limbs = self.metadata['limbs']
+        self.wavelengths = np.load(self.path / 'wavelengths.npy')
+        self.data = np.load(self.path / 'data.npy', mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, days, latitudes, limbs, wavelengths, section='rad', columns=rad_columns, dtype=np.float64):
+
+        """ Make an empty archive for the given model days, number of latitudes and limb longitudes """
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        shape = (len(days), latitudes, len(limbs), len(wavelengths), len(columns))
+        data = np.lib.format.open_memmap(path / 'data.npy', mode='w+', dtype=dtype, shape=shape)
+        data[:] = np.nan
+        data.flush()
+        del data
+        np.save(path / 'wavelengths.npy', np.asarray(wavelengths, dtype=np.float64))
+        metadata = {'days': [int(day) for day in days], 'limbs': [int(limb) for limb in limbs],
+                    'section': section, 'columns': [int(column) for column in columns], 'filled': []}
+        with open(path / 'archive.json', 'w') as file:
+            json.dump(metadata, file)
+
+        return cls(path, mode='r+')
+
+    def day_index(self, day):
+
+        """ Position of a model day along the first axis """
+
+        if day not in self.days:
+            raise ValueError('Day %s is not in the archive at %s, which holds days %s to %s (see add_days)'
+                             %(day, self.path, min(self.days), max(self.days)))
+
+        return self.days.index(day)
+
+    def save_metadata(self):
+
+        """ Write archive.json """
+
+        with open(self.path / 'archive.json', 'w') as file:
+            json.dump(self.metadata, file)
+
+    def add_days(self, days):
+
+        """ Extend the day axis with empty (NaN) entries for the model days not already in the archive,
+            so an archive can grow with a campaign
+            data.npy is rewritten one day at a time into a new file that replaces it once complete,
+            so a failure part way leaves the archive as it was """
+
+        new_days = [int(day) for day in days if day not in self.days]
+        if not new_days:
+            return
+        shape = (len(self.days) + len(new_days),) + self.data.shape[1:]
+        data = np.lib.format.open_memmap(self.path / 'data.npy.new', mode='w+', dtype=self.data.dtype, shape=shape)
+        for day_number in range(len(self.days)):
+            data[day_number] = self.data[day_number]
+        data[len(self.days):] = np.nan
+        data.flush()
+        del data
+        self.data = None
+        os.replace(self.path / 'data.npy.new', self.path / 'data.npy')
+        self.data = np.load(self.path / 'data.npy', mmap_mode='r+')
+        self.days += new_days
+        self.metadata['days'] = self.days
+        self.save_metadata()
+        log('Added days %s to the archive at %s' %(', '.join(str(day) for day in new_days), self.path), 2)
+
+    def write_day(self, day, spectra):
+
+        """ Store one day's spectra, shape (latitudes, limbs, wavelengths, components), and mark the day filled """
+
+        self.data[self.day_index(day)] = spectra
+        self.data.flush()
+        if day not in self.metadata['filled']:
+            self.metadata['filled'].append(day)
+        self.save_metadata()
+
+    def limb_mean(self, days=None):
+
+        """ Mean spectrum over all latitudes and both limbs for each of days (all days if None)
+            Returns an array of shape (days, wavelengths, components) """
+
+        if days is None:
+            block = self.data
+        else:
+            block = self.data[[self.day_index(day) for day in days]]
+
+        return np.nanmean(block, axis=(1,2), dtype=np.float64)
+        # Summed in float64 whatever the archive holds
+
+
+def ingest_day(archive, day, daypath):
+
+    """ Read the text spectra spectra/trn_<lat>_<lon>.txt written for one day into the archive,
+        from the day's archive file (day_archive) if it has one
+        Missing columns are left as NaN """
+
+    spectra = np.full(archive.data.shape[1:], np.nan, dtype=archive.data.dtype)
+    dtype = archive.data.dtype.type
+    fix_sign = archive.metadata['section'] == 'rad'
+    columns = archive.metadata['columns']
+    day_file = day_archive(daypath) if has_archive(daypath) else None
+    for latitude in range(spectra.shape[0]):
+        for limb_number, longitude in enumerate(archive.limbs):
+            if day_file is not None:
+                member = spectrum_member(latitude, longitude)
+                if member in day_file:
+                    spectra[latitude, limb_number] = day_file.section(member, archive.metadata['section'], fix_sign=fix_sign,
+                                                                      dtype=dtype)[:,columns]
+                continue
+            filename = str(daypath) + 'spectra/trn_%s_%s.txt' %(latitude, longitude)
+            if os.path.exists(filename):
+                spectra[latitude, limb_number] = read_named_section(filename, archive.metadata['section'], fix_sign=fix_sign,
+                                                                    dtype=dtype)[:,columns]
+    if day_file is not None:
+        day_file.close()
+    flush_indexes()
+    archive.write_day(day, spectra)
+
+
+def ingest_days(archivepath, parentpath, first, last, dayname='trap_day%s/', section='rad', columns=rad_columns,
+                latitudes=90, limbs=(36,108), dtype=np.float64):
+
+    """ Ingest the text spectra for days first to last under parentpath into the archive at archivepath,
+        creating the archive from the first spectrum found if it does not exist yet, holding dtype values
+        (np.float32 halves its size, and still holds the 6 significant digits PSG prints)
+        Days an existing archive does not have yet are added to it """
+
+    days = list(range(first, last+1))
+    if os.path.exists(str(archivepath) + '/archive.json'):
+        archive = SpectralArchive(archivepath, mode='r+')
+        if archive.metadata['section'] != section or archive.metadata['columns'] != [int(column) for column in columns]:
+            raise ValueError('The archive at %s holds the %s section, columns %s, not %s columns %s'
+                             %(archivepath, archive.metadata['section'], archive.metadata['columns'], section, list(columns)))
+        if archive.data.shape[1] != latitudes or archive.limbs != [int(limb) for limb in limbs]:
+            raise ValueError('The archive at %s has %s latitudes and limbs %s, not %s and %s'
+                             %(archivepath, archive.data.shape[1], archive.limbs, latitudes, list(limbs)))
+        archive.add_days(days)
+    else:
+        for day in days:
+            daypath = str(parentpath) + dayname %(day)
+            if has_archive(daypath):
+                with day_archive(daypath) as day_file:
+                    members = day_file.names('spectra/trn_')
+                    if members:
+                        wavelengths = day_file.section(members[0], section, fix_sign=(section == 'rad'))[:,0]
+                        break
+                continue
+            first_files = sorted(Path(daypath + 'spectra/').glob('trn_*.txt'))
+            if first_files:
+                wavelengths = read_named_section(first_files[0], section, fix_sign=(section == 'rad'))[:,0]
+                break
+        else:
+            raise FileNotFoundError('No spectra found for days %s to %s under %s' %(first, last, parentpath))
+        archive = SpectralArchive.create(archivepath, days, latitudes, limbs, wavelengths, section=section, columns=columns,
+                                         dtype=dtype)
+
+    for day in days:
+        ingest_day(archive, day, str(parentpath) + dayname %(day))
+        log('Ingested day: ' + str(day))
+
+    return archive
+
+
+def transit_difference(archive, day_a, day_b):
+
+    """ Difference in relative transit depth (ppm) between the limb-mean spectra of two days
+        Relative transit depth is the transit column minus its minimum, as in plot_transitdepth """
+
+    transit = archive.limb_mean([day_a, day_b])[:,:,archive.metadata['columns'].index(5)]
+    values = (transit - np.min(transit, axis=1, keepdims=True))*1e6
+
+    return archive.wavelengths, values[0] - values[1]
+
+
+def absorption_envelope(archive, days=None, column=3):
+
+    """ Maximum and minimum absorption (%) over days for one transmittance column (default 3, H2O)
+        Needs an archive of the trn section """
+
+    transmittance = archive.limb_mean(days)[:,:,archive.metadata['columns'].index(column)]
+    absorption = 100*(1-transmittance)
+
+    return archive.wavelengths, np.max(absorption, axis=0), np.min(absorption, axis=0)
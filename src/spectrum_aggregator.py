@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Averages spectra generated by NASA's Planetary Spectrum Generator one at a time as they arrive,
+  keeping only running totals in memory
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import os
+import numpy as np
+from psg_output import flush_indexes, rad_columns, read_named_section, section_from_text, sections_from_text
+from instrumentation import log, stats
+
+
+def spectrum_fingerprint(filename):
+
+    """ Size and modification time of a spectrum file, to tell whether it has been written again """
+
+    stat = os.stat(filename)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class SpectrumAggregator:
+
+    """ Running sum, sum of squares and count per wavelength and component of one section of PSG output
+        Memory stays the size of one spectrum however many columns are added
+        A spectrum can stand in for several columns (profile_clusters) by adding it with a weight
+        The names of the spectra already added are kept, with the weight each was added with and the fingerprint
+        of the spectrum it was read from (see spectrum_fingerprint, None if unknown), so a saved aggregate can be
+        resumed and rebuilt when any of its spectra has changed
+        expected, if given, names every spectrum the aggregate is to be made of, as for a clustered or adaptively
+        sampled day whose weights only add up over the columns that were run; aggregate_files then leaves out
+        any other spectra it is given, such as ones left in spectra/ by an earlier run of the same day """
+
+    def __init__(self, columns, expected=None):
+        self.columns = list(columns)
+        self.expected = None if expected is None else sorted(expected)
+        self.count = 0
+        self.wavelengths = None
+        self.total = None
+        self.squares = None
+        self.sources = {}
+
+    def add(self, section, source=None, weight=1, fingerprint=None):
+
+        """ Add one parsed section, shape (wavelengths, columns) as returned by the psg_output readers,
+            counted weight times """
+
+        section = np.asarray(section, dtype=np.float64)
+        components = section[:,self.columns]
+        if self.total is None:
+            self.wavelengths = section[:,0].copy()
+            self.total = np.zeros(components.shape)
+            self.squares = np.zeros(components.shape)
+        elif components.shape != self.total.shape:
+            raise ValueError('Spectrum %s has shape %s, expected %s' %(source, components.shape, self.total.shape))
+
+        self.total += weight*components
+        self.squares += weight*components**2
+        self.count += weight
+        if source is not None:
+            self.sources[source] = {'weight': weight, 'fingerprint': fingerprint}
+
+    def add_text(self, text, section, fix_sign=False, source=None, weight=1):
+
+        """ Add the rad or trn section of PSG output already in memory, such as a response from PSGClient """
+
+        with stats.stage('aggregate', 1):
+            self.add(section_from_text(text, section, fix_sign=fix_sign), source=source, weight=weight)
+
+    def mean(self):
+
+        """ Wavelengths and mean spectrum, shape (wavelengths, components) """
+
+        return self.wavelengths, self.total/self.count
+
+    def std(self):
+
+        """ Wavelengths and standard deviation across the spectra added, shape (wavelengths, components) """
+
+        mean = self.total/self.count
+        variance = np.maximum(self.squares/self.count - mean**2, 0)
+        # Clip tiny negative values from rounding
+
+        return self.wavelengths, np.sqrt(variance)
+
+    def save(self, filename):
+
+        """ Save the running totals so aggregation can be resumed later """
+
+        sources = sorted(self.sources)
+        arrays = {}
+        if self.expected is not None:
+            arrays['expected'] = np.array(self.expected, dtype=str)
+        np.savez(filename, columns=np.array(self.columns), count=self.count, wavelengths=self.wavelengths,
+                 total=self.total, squares=self.squares, sources=np.array(sources, dtype=str),
+                 weights=np.array([self.sources[source]['weight'] for source in sources], dtype=np.float64),
+                 fingerprints=np.array([self.sources[source]['fingerprint'] or [-1, -1] for source in sources],
+                                       dtype=np.int64).reshape(-1, 2), **arrays)
+        # -1 for spectra whose fingerprint is unknown
+
+    @classmethod
+    def load(cls, filename):
+
+        """ Resume from running totals written by save """
+
+        with np.load(filename) as data:
+            aggregator = cls(data['columns'].tolist(), data['expected'].tolist() if 'expected' in data else None)
+            aggregator.count = data['count'].item()
+            if aggregator.count:
+                aggregator.wavelengths = data['wavelengths']
+                aggregator.total = data['total']
+                aggregator.squares = data['squares']
+            sources = data['sources'].tolist()
+            weights = data['weights'].tolist() if 'weights' in data else [1]*len(sources)
+            fingerprints = data['fingerprints'].tolist() if 'fingerprints' in data else [[-1, -1]]*len(sources)
+            # Saved before weights and fingerprints were kept
+            for source, weight, fingerprint in zip(sources, weights, fingerprints):
+                aggregator.sources[source] = {'weight': weight,
+                                              'fingerprint': None if fingerprint[0] < 0 else fingerprint}
+
+        return aggregator
+
+
+def aggregate_files(files, section, columns, fix_sign=False, filename=None, archive=None, dtype=np.float64):
+
+    """ Stream the rad or trn section of a list of PSG output files into a SpectrumAggregator, one file at a time
+        If filename is given, a saved aggregate there is resumed (only files not already in it are read)
+        and the updated totals are saved back; if any spectrum in it has been written again since (or cannot be
+        checked), the aggregate is rebuilt from all the files, each counted with the weight it was saved with
+        If the saved aggregate lists the spectra it is made of (see SpectrumAggregator), files not in that list
+        are left out
+        If archive (a day_archive.DayArchive) is given, files are names of its members and are read from it
+        Each file is parsed as dtype; the running totals stay float64 whatever dtype is, since they are only
+        the size of one spectrum and summing hundreds of float32 spectra would lose digits PSG printed """
+
+    def fingerprint(name):
+        return archive.fingerprint(name) if archive is not None else spectrum_fingerprint(name)
+
+    aggregator = None
+    weights = {}
+    expected = None
+    paths = {os.path.basename(name): name for name in files}
+    if filename is not None and os.path.exists(filename):
+        aggregator = SpectrumAggregator.load(filename)
+        expected = aggregator.expected
+        if aggregator.columns != list(columns) or not set(aggregator.sources) <= set(paths):
+            aggregator = None
+        # Start again if the saved aggregate used other columns or includes spectra that have since gone
+        elif any(record['fingerprint'] != fingerprint(paths[source]) for source, record in aggregator.sources.items()):
+            weights = {source: record['weight'] for source, record in aggregator.sources.items()}
+            aggregator = None
+            log('Rebuilding %s: spectra have changed since it was saved' %(filename), 2)
+        # Spectra written again (resubmitted, say) since the save; their old values cannot be taken out of the totals
+    if aggregator is None:
+        aggregator = SpectrumAggregator(columns, expected)
+
+    added = 0
+    ignored = 0
+    for name in files:
+        source = os.path.basename(name)
+        if source in aggregator.sources:
+            continue
+        if expected is not None and source not in expected:
+            ignored += 1
+            continue
+        record = fingerprint(name)
+        # Taken before reading, so a spectrum written again while it is read is caught next time
+        if archive is not None:
+            with stats.stage('aggregate', 1, bytes_read=archive.size(name)):
+                data = archive.section(name, section, fix_sign=fix_sign, dtype=dtype)
+        else:
+            with stats.stage('aggregate', 1, bytes_read=os.path.getsize(name)):
+                data = read_named_section(name, section, fix_sign=fix_sign, dtype=dtype)
+        aggregator.add(data, source=source, weight=weights.get(source, 1), fingerprint=record)
+        added += 1
+    flush_indexes()
+    if ignored:
+        log('%s: left out %s spectra that are not part of the saved aggregate' %(filename, ignored), 2)
+
+    if filename is not None and added:
+        aggregator.save(filename)
+
+    return aggregator
+
+
+def limb_aggregators(coords, trn_columns, weights=None, fingerprint=None):
+
+    """ Running means of the rad and trn sections for one day's limb columns
+        Returns the two aggregators and a PSGClient.submit_batch callback that feeds each spectrum into both
+        weights gives the number of columns each spectrum stands for when the columns have been clustered
+        fingerprint(source), if given, fingerprints the saved copy of each spectrum (see spectrum_fingerprint),
+        which is written before the callback is called, so aggregate_files can tell if it is written again """
+
+    sources = ['trn_%s_%s.txt' %(coord) for coord in coords]
+    rad_mean = SpectrumAggregator(rad_columns, sources)
+    trn_mean = SpectrumAggregator(trn_columns, sources)
+    # Only the columns run count towards the day's means, whatever else is in spectra/
+
+    def aggregate(index, spectrum):
+        source = sources[index]
+        weight = 1 if weights is None else weights[index]
+        record = None if fingerprint is None else fingerprint(source)
+        with stats.stage('aggregate', 1):
+            sections = sections_from_text(spectrum)
+            rad_mean.add(sections['rad'], source=source, weight=weight, fingerprint=record)
+            trn_mean.add(sections['trn'], source=source, weight=weight, fingerprint=record)
+    # Both sections from one scan of the response
+    # Sources are named like the spectra files so aggregate_files can resume from the saved totals
+
+    return rad_mean, trn_mean, aggregate
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Keeps a local on-disk cache of spectra returned by the Planetary Spectrum Generator,
+  so configs that have not changed since the last run are not sent to PSG again
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import hashlib
+import os
+import socket
+import threading
+from pathlib import Path
+from instrumentation import log
+
+
+cachepath = '/exports/csce/datastore/geos/users/s1144983/psg_files/cache/'
+
+
+class SpectrumCache:
+
+    """ Spectra stored one file per config, named by the SHA-256 hash of the request parameters
+        and the rendered config text, so any change to the config or request gives a new entry
+        When the cache grows past max_bytes the least recently used spectra are deleted """
+
+    def __init__(self, path=cachepath, max_bytes=20e9):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.size = sum(entry.stat().st_size for entry in self.path.glob('*/*.txt'))
+        # Size is counted once here and then tracked as entries are added and removed
+
+    def key(self, config, params):
+
+        """ Hash of the request parameters (in sorted order) and the config text """
+
+        digest = hashlib.sha256()
+        for name, value in sorted(params):
+            digest.update(('%s=%s\n' %(name, value)).encode())
+        digest.update(b'\0')
+        digest.update(config.encode())
+
+        return digest.hexdigest()
+
+    def filename(self, key):
+
+        """ Cache file for a key, spread over subdirectories by the first two hex digits """
+
+        return self.path / key[:2] / (key + '.txt')
+
+    def get(self, config, params):
+
+        """ Return the cached spectrum for this config and request, or None if it has not been run """
+
+        filename = self.filename(self.key(config, params))
+        try:
+            with open(filename, 'r') as file:
+                spectrum = file.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+        # Mark as recently used for eviction (another process may have just evicted it)
+
+        with self.lock:
+            self.hits += 1
+
+        return spectrum
+
+    def put(self, config, params, spectrum):
+
+        """ Store the spectrum PSG returned for this config and request """
+
+        filename = self.filename(self.key(config, params))
+        filename.parent.mkdir(exist_ok=True)
+        temporary = filename.with_suffix('.tmp.%s.%s.%s' %(socket.gethostname(), os.getpid(), threading.get_ident()))
+        # Unique to this thread on this machine, since the cache may be shared by jobs on several nodes
+        try:
+            with open(temporary, 'w') as file:
+                file.write(spectrum)
+            try:
+                replaced = filename.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temporary, filename)
+            added = filename.stat().st_size - replaced
+        except FileNotFoundError:
+            log('Could not add a spectrum to the cache at %s' %(self.path), 2)
+            return
+        # Write to a temporary file first so a crash never leaves a half-written spectrum in the cache
+        # If the file or its directory is removed meanwhile (another job clearing or evicting the cache),
+        # the spectrum is just not cached; the request it came from has still succeeded
+
+        with self.lock:
+            self.size += added
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+
+        """ Delete least recently used spectra until the cache is back under 90% of max_bytes """
+
+        entries = []
+        for entry in self.path.glob('*/*.txt'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort()
+
+        self.size = sum(size for mtime, size, entry in entries)
+        for mtime, size, entry in entries:
+            if self.size <= 0.9*self.max_bytes:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+
+        """ Hit and miss counters for this process, and the current size of the cache """
+
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes': self.size}
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Loads only the limb columns of the model days needed from UM output files, keeping the data lazy
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import numpy as np
+from limb_extraction import cube_names
+
+
+def load_limbs(filenames, first, last, limbs=(36,108)):
+
+    """ Load the cubes needed for PSG configs from UM output files (pp or netCDF)
+        Only days first to last and the limb longitudes are kept, and the data stays lazy (dask),
+        so extracting a day reads just its (level, latitude, limb) hyperslab from disk instead of whole global fields
+        Negative days count back from the last day in the files, so -1, -1 loads just the last day
+        The cubes get a day_index coordinate on the time axis and a limb_index coordinate on the longitude axis
+        holding the original array indices, so they can be passed to day_generator, batch_job, rapid_config etc.
+        with the usual day numbers and limb longitudes """
+
+    import iris
+    # Imported here so modules that use this one load quickly when no UM files are read
+
+    constraint = iris.Constraint(cube_func=lambda cube: cube.standard_name in cube_names)
+    cubes = iris.load(filenames, constraint)
+
+    limb_cubes = iris.cube.CubeList()
+    for cube in cubes:
+        start, stop = [day + cube.shape[0] if day < 0 else day for day in (first, last)]
+        # Negative days count back from the last one, as in indexing; otherwise last = -1 would slice to [first:0]
+        days = np.arange(cube.shape[0])[start:stop+1]
+        limb_cube = cube[start:stop+1][:,:,:,list(limbs)]
+        # Slicing a lazy cube stays lazy, nothing is read yet
+        limb_cube.add_aux_coord(iris.coords.AuxCoord(days, long_name='day_index', units='1'), 0)
+        limb_cube.add_aux_coord(iris.coords.AuxCoord(np.array(limbs), long_name='limb_index', units='1'), 3)
+        limb_cubes.append(limb_cube)
+    limb_cubes.sourcefiles = [filenames] if isinstance(filenames, str) else list(filenames)
+    # So runs that check whether the model data has changed (pipeline.cube_sources) know where it came from
+
+    return limb_cubes
@@ -11,114 +11,90 @@ Pipeline for post-processing UM output data.
 Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
 """
 
-import iris
-import subprocess
-import iris.plot as iplt
-import matplotlib.pyplot as plt
-import matplotlib.cm as mpl_cm
 import numpy as np
-import pandas as pd
-import glob
-from pathlib import Path
+from output_specs import vapour_columns
+from psg_output import vapour_trn_columns
+from column_writer import ColumnWriter
+from pipeline import pipeline_stages
+from instrumentation import instrumented_job
+from psg_client import psg_url
 
 
 templatepath = '/exports/csce/datastore/geos/users/s1144983/psg_files/templates'
 
 
+def writer():
+
+    """ Writer of the vapour-only template configs for every limb column, in tall_day<N>/ folders
+        Configs go one request at a time to the public PSG when no client is given
+        Made when used, so a templatepath set after import is picked up """
+
+    return ColumnWriter(vapour_columns, vapour_trn_columns, 'tall_day%s/', templatepath, default_url=psg_url)
+
+
 def write_config(daypath, cubes, day, coords=(-1,45,36)):
-    
-    """ For one model column:
-        Extracts profiles for: pressure, temperature, water vapour, liquid cloud, ice cloud
-        Calculates/defines profiles for: N2, CO2
-        Reads in a template Planetary Spectrum Generator config file with empty atmosphere layers
-        Writes UM model data atmospheric profiles into atmosphere layers
-        Outputs a text file labelled with the array coordinates of the column for which the profile has been generated"""
-    
-    for cube in cubes:
-        if cube.standard_name == 'air_pressure':
-            air_pressure = cube.copy()
-        if cube.standard_name == 'air_potential_temperature':
-            potential_temp = cube.copy()
-        if cube.standard_name == 'specific_humidity':
-            spec_humid = cube.copy()
-
-    # Extract the model data cubes needed
-        
-    p0 = iris.coords.AuxCoord(100000.0, long_name='reference_pressure', units='Pa')
-    p0.convert_units(air_pressure.units)
-    absolute_temp = potential_temp*((air_pressure/p0)**(287.05/1005)) # R and cp in J/kgK for 300K
-    # Convert potential temperature into absolute temperature
-    
-    altitude = air_pressure.coord('level_height').points*1e-3
-    # Extract altitude of T-P points from air pressure cube (in km)
-    
-    converted_pressure = air_pressure[day,:,coords[1],coords[2]].data
-    absolute_temp = absolute_temp[day,:,coords[1],coords[2]].data
-    vapour = (28.0134/18.01528)*np.abs(spec_humid[day,:,coords[1],coords[2]].data) # Convert kg/kg to molecules/molecules
-    # Extract the numpy array for only the column we are looking at (much faster than extracting the full array!)
-    
-    CO2 = np.full(vapour.shape,(28.0134/44.0095)*5.94e-4) # Model has a fixed amount of CO2. Convert kg/kg to molecules/molecules
-    N2 = np.ones(vapour.shape) - vapour - CO2 # Any gas that isn't vapour or CO2 is N2
-
-    template = open(str(templatepath) + '/proxb_vapour.txt','r')    
-    list_in = template.readlines()
-    list_out = list_in.copy()
-    template.close()
-    # Open template PSG config file that already has ProxB planetary data in it, read lines into a list
-    
-    for layer in range(0,60):
-        line_index = 55+layer # Atmosphere layers begin at line 55 of the template
-        list_in[line_index] = list_in[line_index].rstrip() # Strip \n from end of line
-        list_out[line_index] = list_in[line_index] + f"{converted_pressure[layer]:.4E}" + ',' + \
-        f"{absolute_temp[layer]:.4E}" + ',' + f"{altitude[layer]:.4E}" + ',' + f"{N2[layer]:.4E}" + ',' + f"{vapour[layer]:.4E}" + ',' + \
-        f"{CO2[layer]:.4E}" + '\n'
-        # For each atmosphere layer, add pressure, temperature, N2, H2O, CO2 data point
-        # Format in scientific notation to 4 decimal places, capital E
-    print(list_out) # Print to check your list formatting matches examples
-    
-    with open(str(daypath) + 'configfiles/config_%s_%s.txt' %(coords[1], coords[2]), 'w') as file:
-        for line in list_out:
-            file.write(line)
-            
-    file.close()
-    # Write to a text file labeled with array column coordinates
-    
-    return(list_out)
-    
-
-def day_generator(daypath, cubes, day=-1):
-
-    """ Write PSG config files for every column on the limb
-        These can be put through the PSG and the output averaged to get the final spectrum """
-
-    Path(str(daypath)+'configfiles/').mkdir(exist_ok=True)
-    Path(str(daypath)+'spectra/').mkdir(exist_ok=True)
-    Path(str(daypath)+'plots/').mkdir(exist_ok=True)
-    Path(str(daypath)+'output/').mkdir(exist_ok=True)
-        
-    for latitude in range(0,90):
-        east_config = write_config(daypath, cubes, day, coords=(-1, latitude, 36))
-        east_filename = str(daypath) + 'configfiles/config_%s_36.txt' %(latitude)
-        east_cmd = 'curl -d type=all -d whdr=y --data-urlencode file@%s https://psg.gsfc.nasa.gov/api.php' %(east_filename)
-        with open(str(daypath) + 'spectra/trn_%s_36.txt' %(latitude), 'w') as file:
-            subprocess.run(east_cmd, shell=True, stdout=file)
-        file.close()
-        
-        west_config = write_config(daypath, cubes, day, coords=(-1, latitude, 108))
-        west_filename = str(daypath) + 'configfiles/config_%s_108.txt' %(latitude)
-        west_cmd = 'curl -d type=all -d whdr=y --data-urlencode file@%s https://psg.gsfc.nasa.gov/api.php' %(west_filename)
-        with open(str(daypath) + 'spectra/trn_%s_108.txt' %(latitude), 'w') as file:
-            subprocess.run(west_cmd, shell=True, stdout=file)
-        file.close()
-        print('Up to latitude: ' + str(latitude))
-            
-
-def batch_job(parentpath, cubes, first, last): 
-    
-    for day in range(first,last+1):
-        daypath = str(parentpath) + 'tall_day%s/' %(day)
-        Path(str(daypath)).mkdir(exist_ok=True)
-        day_generator(daypath, cubes, day=day)
-#        plot_transitdepth(daypath, day=day)
-        
-                                                  
\ No newline at end of file
+
+    """ Write the config of one model column, see ColumnWriter.write_config """
+
+    return writer().write_config(daypath, cubes, day, coords)
+
+
+def write_configs(daypath, coords, profiles, archive=None):
+
+    """ Write the configs of a batch of model columns, see ColumnWriter.write_configs """
+
+    return writer().write_configs(daypath, coords, profiles, archive)
+
+
+def write_day(daypath, cubes, day=-1, clusters=None, tolerance=None, archive=False, dtype=np.float64):
+
+    """ Write the configs of every column on the limb of one day, see ColumnWriter.write_day """
+
+    return writer().write_day(daypath, cubes, day, clusters, tolerance, archive, dtype)
+
+
+def submit_day(daypath, coords, configs, client, weights=None, archive=False):
+
+    """ Put one day's configs through the PSG and save the spectra and means, see ColumnWriter.submit_day """
+
+    return writer().submit_day(daypath, coords, configs, client, weights, archive)
+
+
+def day_generator(daypath, cubes, day=-1, client=None, clusters=None, tolerance=None, archive=False, dtype=np.float64):
+
+    """ Write (and put through the PSG) the configs of one day, see ColumnWriter.day_generator """
+
+    return writer().day_generator(daypath, cubes, day, client, clusters, tolerance, archive, dtype)
+
+
+@instrumented_job
+def batch_job(parentpath, cubes, first, last, client=None, workers=1, clusters=None, tolerance=None, archive=False,
+              dtype=np.float64):
+
+    """ Write (and put through the PSG) the configs of days first to last, see ColumnWriter.batch_job """
+
+    return writer().batch_job(parentpath, cubes, first, last, client, workers, clusters, tolerance, archive, dtype)
+
+
+@instrumented_job
+def adaptive_job(parentpath, cubes, first, last, client=None, step=8, threshold=10.0):
+
+    """ Put days first to last through the PSG with adaptive latitude sampling, see ColumnWriter.adaptive_job """
+
+    return writer().adaptive_job(parentpath, cubes, first, last, client, step, threshold)
+
+
+@instrumented_job
+def pipeline_job(parentpath, cubes, first, last, client=None, stages=pipeline_stages, sourcefiles=None):
+
+    """ Resumable staged run of days first to last, see ColumnWriter.pipeline_job """
+
+    return writer().pipeline_job(parentpath, cubes, first, last, client, stages, sourcefiles)
+
+
+@instrumented_job
+def queue_job(parentpath, cubes, queuepath, client=None, batch=18, **options):
+
+    """ Run one worker on a shared work queue, see ColumnWriter.queue_job """
+
+    return writer().queue_job(parentpath, cubes, queuepath, client, batch, **options)
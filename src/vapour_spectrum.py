@@ -12,57 +12,26 @@ Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import glob
+from psg_output import rad_columns, vapour_trn_columns
+from mean_spectrum import day_spectra
+
+
+figurepath = '/exports/csce/datastore/geos/users/s1144983/papers/laso/epsfigs/'
+# Where the figures for the paper are saved
+
 
 def plot_absorption(path):
     
-    files = glob.glob(str(path) + 'spectra/*.txt')    
+    import matplotlib.pyplot as plt
     
-    number_of_columns = []
-    for number in range(len(files)):
-        number_of_columns.append(number)
-    number_of_rows = []
-    for number in range(198):
-        number_of_rows.append(number)
-    
-    wavelengths = []
-    first_file = open(files[0], 'r')
-    transmittances = first_file.readlines()
-    transmittances = transmittances[861:1060]
-    for item in transmittances:
-        datapoints = item.split('  ')
-        wavelength = float(datapoints[0])
-        wavelengths.append(wavelength)
-    first_file.close()
-    x_axis = np.array(wavelengths)
-        
-    total_spectrum = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    H2O = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    CO2 = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    rayleigh = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    collisions = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-
-    for file_number in range(0,len(files)):
-        data = open(files[file_number], 'r')
-        lines = data.readlines()
-        lines = lines[861:1060]
-        data.close()
-
-        for row in range(0,198):
-            list_of_datapoints = lines[row].split('  ')
-            total_spectrum.loc[row, file_number] = float(list_of_datapoints[1])
-            H2O.loc[row, file_number] = float(list_of_datapoints[3])
-            CO2.loc[row, file_number] = float(list_of_datapoints[4])
-            rayleigh.loc[row, file_number] = float(list_of_datapoints[5])
-            collisions.loc[row, file_number] = float(list_of_datapoints[6])
-
-    meaned_total_spectrum = 100*(1-total_spectrum.mean(axis=1).to_numpy())
-    meaned_H2O = 100*(1-H2O.mean(axis=1).to_numpy())
-    meaned_CO2 = 100*(1-CO2.mean(axis=1).to_numpy())
-    meaned_rayleigh = 100*(1-rayleigh.mean(axis=1).to_numpy())
-    meaned_collisions = 100*(1-collisions.mean(axis=1).to_numpy())
+    aggregator = day_spectra(path, 'trn', vapour_trn_columns, filename=str(path) + 'output/trn_mean.npz')
+    x_axis, transmittances = aggregator.mean()
+    # Running mean of the transmittance section, resumed from output/trn_mean.npz so only new spectra are read,
+    # from the day's archive file if it was written with one
+    # Components: total, H2O, CO2, Rayleigh scattering, collision-induced absorption
+
+    meaned = 100*(1-transmittances)
+    meaned_total_spectrum, meaned_H2O, meaned_CO2, meaned_rayleigh, meaned_collisions = meaned.T
        
     # transit_depth = (7.16e06*meaned_total_spectrum)/(10*6.8e03)    
     
@@ -105,62 +74,20 @@ def plot_absorption(path):
 
 def plot_transitdepth(path, day=0):             
             
-    files = glob.glob(str(path) + 'spectra/*.txt')  
-    
-    number_of_columns = []
-    for number in range(len(files)):
-        number_of_columns.append(number)
-    number_of_rows = []
-    for number in range(198):
-        number_of_rows.append(number)
-    
-    wavelengths = []
-    first_file = open(files[0], 'r')
-    rad_spectrum = first_file.readlines()
-    rad_spectrum = rad_spectrum[646:844]
-    for item in rad_spectrum:
-        datapoints = item.split('  ')
-        wavelength = float(datapoints[0])
-        wavelengths.append(wavelength)
-    first_file.close()
-    x_axis = np.array(wavelengths)
+    import matplotlib.pyplot as plt
     
-    total_spectrum = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    noise = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    stellar = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    planet = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    transit = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    blocked = pd.DataFrame(index=number_of_rows, columns=number_of_columns)
-    
-    for file_number in range(0,len(files)):
-        data = open(files[file_number], 'r')
-        lines = data.readlines()
-        lines = lines[646:844]
-        data.close()
-
-        for row in range(0,198):
-            lines[row] = lines[row].replace(' -', '  ')
-            list_of_datapoints = lines[row].split('  ')
-            total_spectrum.loc[row, file_number] = float(list_of_datapoints[1])
-            noise.loc[row, file_number] = float(list_of_datapoints[2])
-            stellar.loc[row, file_number] = float(list_of_datapoints[3])
-            planet.loc[row, file_number] = float(list_of_datapoints[4])
-            transit.loc[row, file_number] = float(list_of_datapoints[5])
-            blocked.loc[row, file_number] = float(list_of_datapoints[6])
-
-    meaned_total_spectrum = total_spectrum.mean(axis=1).to_numpy()
-    meaned_noise = noise.mean(axis=1).to_numpy()
-    meaned_stellar = stellar.mean(axis=1).to_numpy()
-    meaned_planet = planet.mean(axis=1).to_numpy()
-    meaned_transit = transit.mean(axis=1).to_numpy()
-    meaned_blocked = blocked.mean(axis=1).to_numpy()
+    aggregator = day_spectra(path, 'rad', rad_columns, fix_sign=True, filename=str(path) + 'output/rad_mean.npz')
+    x_axis, rad_spectrum = aggregator.mean()
+    # Running mean of the radiance section, resumed from output/rad_mean.npz so only new spectra are read
+    # Components: total, noise, stellar, planet, transit, blocked
+
+    meaned_total_spectrum, meaned_noise, meaned_stellar, meaned_planet, meaned_transit, meaned_blocked = rad_spectrum.T
     continuum = np.min(meaned_transit)
     values = (meaned_transit-continuum)*1e6
     
-    with open(str(path) + 'output/transit_day%s.txt' %(day), 'w') as file:
-        file.write(str(x_axis) + '\n')
-        file.write(str(meaned_transit) + '\n')                              
-    file.close()
+    np.savetxt(str(path) + 'output/transit_day%s.txt' %(day), np.column_stack([x_axis, meaned_transit]),
+               fmt='%.8e', header='Wavelength [um]  Mean transit')
+    # Full precision, two columns, read back with np.loadtxt (str() of an array truncates it)
     
     plt.plot(x_axis, values)
     plt.title('Relative Transit Depth, day %s' %(day+5000))
@@ -175,34 +102,47 @@ def plot_transitdepth(path, day=0):
 #    plt.xlim(1,5)
 #    plt.ylabel('$(R_p/R_{star})^2$')
 #    plt.ylim([0,1])    
-    plt.savefig('/exports/csce/datastore/geos/users/s1144983/papers/laso/epsfigs/transit_day%s.eps' %day, format='eps')   
+    plt.savefig(figurepath + 'transit_day%s.eps' %day, format='eps')   
 
     plt.show()
     
     return x_axis, values
 
 
-plt.figure(figsize=(10,5))   
-plt.plot(axis, (day667-day164), color='r')    
-plt.title('Difference in Transit Depths')
-plt.xlabel('Wavelength [um]')
-plt.ylabel('Relative transit depth difference [ppm]')
+def plot_transit_difference(axis, later, earlier, filename=figurepath + 'transitdiff.eps'):
 
-plt.annotate('1.4', xy=(1.404734358,0.0172132838278245), xytext=(1.5,50), textcoords='offset points', arrowprops=dict(arrowstyle='->', connectionstyle='arc'))
-plt.annotate('1.9', xy=(1.931426411, 0.0763371493399001), xytext=(2.0, 50), textcoords='offset points', arrowprops=dict(arrowstyle='->', connectionstyle='arc3'))
-plt.annotate('2.8', xy=(2.818969452,0.13410272277358892), xytext=(3.5, 0), textcoords='offset points')
+    """ Plot the difference between two relative transit depth spectra returned by plot_transitdepth
+        (day 667 minus day 164 in the paper) and save it to filename """
 
-# xt = (1, 1.4, 1.9, 2.8, 4, 5)
-# ax.set_xticks(xt)
-# ax.set_xlim(left=1, right=5)
-plt.savefig('/exports/csce/datastore/geos/users/s1144983/papers/laso/epsfigs/transitdiff.eps', format='eps')   
-plt.show()
+    import matplotlib.pyplot as plt
 
-plt.plot(xaxis, (maxabsorption-minabsorption), color='r')
-plt.title('Difference in Absorption by Water Vapour')
-plt.xlabel('Wavelength [um]')
-plt.ylabel('Absorption [%]')
-plt.ylim([0,100])
-# plt.legend()
-plt.show()
+    plt.figure(figsize=(10,5))   
+    plt.plot(axis, (later-earlier), color='r')    
+    plt.title('Difference in Transit Depths')
+    plt.xlabel('Wavelength [um]')
+    plt.ylabel('Relative transit depth difference [ppm]')
+    
+    plt.annotate('1.4', xy=(1.404734358,0.0172132838278245), xytext=(1.5,50), textcoords='offset points', arrowprops=dict(arrowstyle='->', connectionstyle='arc'))
+    plt.annotate('1.9', xy=(1.931426411, 0.0763371493399001), xytext=(2.0, 50), textcoords='offset points', arrowprops=dict(arrowstyle='->', connectionstyle='arc3'))
+    plt.annotate('2.8', xy=(2.818969452,0.13410272277358892), xytext=(3.5, 0), textcoords='offset points')
+    
+    # xt = (1, 1.4, 1.9, 2.8, 4, 5)
+    # ax.set_xticks(xt)
+    # ax.set_xlim(left=1, right=5)
+    plt.savefig(filename, format='eps')   
+    plt.show()
+
+
+def plot_absorption_difference(xaxis, maxabsorption, minabsorption):
+
+    """ Plot the range of water vapour absorption between two spectra from plot_absorption """
+
+    import matplotlib.pyplot as plt
 
+    plt.plot(xaxis, (maxabsorption-minabsorption), color='r')
+    plt.title('Difference in Absorption by Water Vapour')
+    plt.xlabel('Wavelength [um]')
+    plt.ylabel('Absorption [%]')
+    plt.ylim([0,100])
+    # plt.legend()
+    plt.show()
@@ -5,28 +5,50 @@ Created on Tue May 17 21:17:40 2022
 
 @author: Mo Cohen
 """
-import subprocess
-import glob
 from pathlib import Path
+from psg_client import PSGClient, local_psg_url, local_psg_urls
+from spectrum_cache import SpectrumCache
+from instrumentation import instrumented_job, log
 
 first=300
 last=301
 parentpath = r'R:/psg_files/trapcontrol/'
+ports = [3000]
+# One local PSG container per port; list more (e.g. 3000 to 3003) to spread the requests over them
+workers=4*len(ports)
+cachepath = str(parentpath) + r'cache/'
 
 
-def psg(parentpath, day=-1):
+def psg(parentpath, day=-1, client=None):
 
     """ Send previously made configuration files to local version of PSG """
                 
-	filename = str(parentpath) + 'configfiles/day_%s.txt' %(day)
-	psg_cmd = 'curl -d type=all -d whdr=y --data-urlencode file@%s http://localhost:3000/api.php' %(filename)
-	with open(str(parentpath) + 'spectra/trn_day_%s.txt' %(day), 'w') as file:
-		subprocess.run(psg_cmd, shell=True, stdout=file)
-	file.close()
-	print('Up to day: ' + str(day))
-
-    
-for day in range(first,last+1):
+    filename = str(parentpath) + 'configfiles/day_%s.txt' %(day)
+    outname = str(parentpath) + 'spectra/trn_day_%s.txt' %(day)
+    if client is None:
+        with PSGClient(local_psg_url, workers=1) as client:
+            client.submit_files([filename], [outname])
+    else:
+        client.submit_files([filename], [outname])
+    log('Up to day: ' + str(day))
+
+
+@instrumented_job
+def psg_batch(parentpath, first, last, client):
+
+    """ Send the configuration files for days first to last to PSG concurrently """
+
+    days = range(first,last+1)
+    filenames = [str(parentpath) + 'configfiles/day_%s.txt' %(day) for day in days]
+    outnames = [str(parentpath) + 'spectra/trn_day_%s.txt' %(day) for day in days]
+    client.submit_files(filenames, outnames)
+    log('Finished days: ' + str(first) + ' to ' + str(last))
+
+
+if __name__ == '__main__':
     specpath = str(parentpath) + r'spectra/'
     Path(str(specpath)).mkdir(exist_ok=True)
-    psg(parentpath, day=day)
\ No newline at end of file
+    cache = SpectrumCache(cachepath)
+    with PSGClient(local_psg_urls(ports), workers=workers, cache=cache) as client:
+        psg_batch(parentpath, first, last, client)
+    log(cache.stats())
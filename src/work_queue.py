@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline for post-processing UM output data.
+- Shares (day, latitude, limb) units of work between any number of worker processes on any number of nodes
+  through files on a shared filesystem, with no scheduler or message broker
+- Workers claim units by renaming their files, so each unit goes to exactly one worker, and units held by
+  workers that died are handed out again
+
+Model: University of Exeter Stand Alone model of Proxima Centauri b, UM vn11.8
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from limb_extraction import extract_limbs
+from psg_client import PSGError
+from psg_output import rad_columns
+from spectrum_aggregator import aggregate_files
+from instrumentation import log, stats
+
+
+queue_states = ('todo', 'claimed', 'done', 'failed')
+# One folder per state; a unit is a file that moves between them
+
+
+def unit_name(day, latitude, limb):
+
+    """ File name of the unit for one column of one day """
+
+    return 'day%s_lat%s_lon%s' %(day, latitude, limb)
+
+
+def parse_unit(name):
+
+    """ (day, latitude, limb) of a unit file name """
+
+    day, latitude, limb = name.split('_')
+
+    return int(day[3:]), int(latitude[3:]), int(limb[3:])
+
+
+class WorkQueue:
+
+    """ A queue of units kept as files in todo/, claimed/, done/ and failed/ under path
+        Moving a file with os.rename is atomic on the same filesystem (also over NFS), so when several workers
+        try to claim the same unit only one rename succeeds
+        A claimed unit's file holds the worker that claimed it and how many times the unit has been tried,
+        and its modification time is the worker's last heartbeat: a claim not renewed for timeout seconds
+        is taken to belong to a dead worker and is put back in todo/ by recover; a live worker renews its claims
+        from a background thread while it works on them (see renewing)
+        Units that fail attempts times go to failed/ """
+
+    def __init__(self, path, timeout=3600, attempts=3, worker=None):
+        self.path = Path(path)
+        self.timeout = timeout
+        self.attempts = attempts
+        self.worker = worker if worker is not None else '%s:%s' %(socket.gethostname(), os.getpid())
+        for state in queue_states:
+            (self.path / state).mkdir(parents=True, exist_ok=True)
+
+    def file(self, state, name):
+
+        """ Path of a unit's file in one state """
+
+        return self.path / state / name
+
+    def add(self, names):
+
+        """ Put units in todo/, skipping any the queue already has in some state
+            Returns the number added """
+
+        known = set()
+        for state in queue_states:
+            known.update(os.listdir(self.path / state))
+        added = 0
+        for name in names:
+            if name not in known:
+                with open(self.path / (name + '.new'), 'w') as file:
+                    json.dump({'attempts': 0}, file)
+                os.rename(self.path / (name + '.new'), self.file('todo', name))
+                added += 1
+        # Written beside the folders and moved in, so workers never see half a file
+
+        return added
+
+    def read(self, state, name):
+
+        """ Contents of a unit's file, or empty if it cannot be read (being written, or moved meanwhile) """
+
+        try:
+            with open(self.file(state, name), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def claim(self, count=1, prefix=''):
+
+        """ Claim up to count units from todo/, taking the first in name order, whose names start with prefix
+            Returns the names claimed (fewer than count, or none, when todo/ runs out) """
+
+        claimed = []
+        for name in sorted(os.listdir(self.path / 'todo')):
+            if len(claimed) == count:
+                break
+            if not name.startswith(prefix):
+                continue
+            try:
+                os.utime(self.file('todo', name))
+                os.rename(self.file('todo', name), self.file('claimed', name))
+            except FileNotFoundError:
+                continue
+            # Another worker got there first
+            # The file is touched first so the claim is never mistaken for a stale one
+            record = self.read('claimed', name)
+            record.update({'worker': self.worker, 'claimed': time.time()})
+            with open(self.file('claimed', name), 'w') as file:
+                json.dump(record, file)
+            claimed.append(name)
+
+        stats.count('queue_claims', len(claimed))
+
+        return claimed
+
+    def heartbeat(self, names):
+
+        """ Renew this worker's claim on units it is still working on """
+
+        for name in names:
+            try:
+                os.utime(self.file('claimed', name))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def renewing(self, names, interval=None):
+
+        """ Renew the claims on names every interval seconds (a quarter of timeout by default) from a background
+            thread for as long as the block runs, however long one extraction or PSG request takes """
+
+        stop = threading.Event()
+        interval = interval if interval is not None else self.timeout/4
+
+        def beat():
+            while not stop.wait(interval):
+                self.heartbeat(names)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, name):
+
+        """ Move a finished unit to done/ """
+
+        try:
+            os.rename(self.file('claimed', name), self.file('done', name))
+        except FileNotFoundError:
+            pass
+        # Recovered from this worker while it was slow; the unit is done anyway and the results are the same
+
+    def fail(self, name, error):
+
+        """ Put a unit that failed back in todo/, or in failed/ once it has been tried attempts times """
+
+        record = self.read('claimed', name)
+        record.update({'attempts': record.get('attempts', 0) + 1, 'error': str(error)})
+        try:
+            with open(self.file('claimed', name), 'w') as file:
+                json.dump(record, file)
+            state = 'failed' if record['attempts'] >= self.attempts else 'todo'
+            os.rename(self.file('claimed', name), self.file(state, name))
+        except FileNotFoundError:
+            pass
+
+    def recover(self):
+
+        """ Put claims not renewed for timeout seconds back in todo/
+            Returns the number recovered """
+
+        recovered = 0
+        now = time.time()
+        for name in os.listdir(self.path / 'claimed'):
+            try:
+                if now - os.stat(self.file('claimed', name)).st_mtime < self.timeout:
+                    continue
+                os.rename(self.file('claimed', name), self.file('todo', name))
+                recovered += 1
+            except FileNotFoundError:
+                continue
+        # The unit was completed or recovered by someone else meanwhile
+        if recovered:
+            log('Recovered %s stale claims' %(recovered), 2)
+            stats.count('queue_recovered', recovered)
+
+        return recovered
+
+    def counts(self, prefix=''):
+
+        """ Number of units in each state, optionally only those whose names start with prefix """
+
+        return {state: sum(name.startswith(prefix) for name in os.listdir(self.path / state))
+                for state in queue_states}
+
+    def lock(self, name):
+
+        """ Take a lock file, for work that only one worker should do (such as averaging a finished day)
+            A lock older than timeout was left by a worker that died holding it and is taken over
+            Returns True for the one worker that creates it """
+
+        try:
+            if time.time() - os.stat(self.path / name).st_mtime >= self.timeout:
+                os.rename(self.path / name, self.path / (name + '.stale'))
+                os.remove(self.path / (name + '.stale'))
+        except FileNotFoundError:
+            pass
+        # Only one worker's rename of a stale lock succeeds; the others then find the new lock
+        try:
+            os.close(os.open(self.path / name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def unlock(self, name):
+
+        """ Remove a lock file taken by lock """
+
+        try:
+            os.remove(self.path / name)
+        except FileNotFoundError:
+            pass
+
+    def mark(self, name):
+
+        """ Leave a marker file for work that is finished, see marked """
+
+        with open(self.path / (name + '.new'), 'w') as file:
+            file.write(self.worker)
+        os.rename(self.path / (name + '.new'), self.path / name)
+
+    def marked(self, name):
+
+        """ Whether mark has been called for name """
+
+        return os.path.exists(self.path / name)
+
+
+def enqueue_days(queuepath, first, last, latitudes=90, limbs=(36,108), **options):
+
+    """ Add a unit for every limb column of days first to last to the queue at queuepath
+        Returns the queue """
+
+    queue = WorkQueue(queuepath, **options)
+    added = queue.add(unit_name(day, latitude, limb) for day in range(first, last+1)
+                      for latitude in range(latitudes) for limb in limbs)
+    log('Queued %s units for days %s to %s' %(added, first, last))
+
+    return queue
+
+
+def work_units(queue, names, parentpath, cubes, client, write_configs, dayname, profiles):
+
+    """ Render (and with a client, submit) the configs of a batch of claimed units, day by day
+        profiles keeps the last day extracted, so a worker claiming a day's units in turn extracts it once """
+
+    units = {}
+    for name in names:
+        day, latitude, limb = parse_unit(name)
+        units.setdefault(day, []).append((name, (latitude, limb)))
+
+    for day, day_units in units.items():
+        daypath = str(parentpath) + dayname %(day)
+        for folder in ('', 'configfiles/', 'spectra/', 'output/'):
+            Path(str(daypath)+folder).mkdir(exist_ok=True)
+        if profiles.get('day') != day:
+            coords, day_profiles = extract_limbs(cubes, day)
+            profiles.update({'day': day, 'coords': coords, 'profiles': day_profiles})
+        coords = [coord for name, coord in day_units]
+        index = [profiles['coords'].index(coord) for coord in coords]
+        configs = write_configs(daypath, coords, profiles['profiles'][index])
+
+        if client is None:
+            for name, coord in day_units:
+                queue.complete(name)
+            continue
+
+        outnames = [str(daypath) + 'spectra/trn_%s_%s.txt' %(coord) for coord in coords]
+        finished = set()
+        error = None
+        try:
+            client.submit_batch(configs, outnames, callback=lambda number, spectrum: finished.add(number))
+        except PSGError as failure:
+            error = failure
+        # Every config is attempted; those whose spectrum did not come back this time go back to the queue,
+        # even if a spectrum file from an earlier attempt is there
+        for number, (name, coord) in enumerate(day_units):
+            if number in finished:
+                queue.complete(name)
+            else:
+                queue.fail(name, error)
+
+
+def aggregate_finished(queue, parentpath, trn_columns, dayname, latitudes=90, limbs=(36,108)):
+
+    """ Average the spectra of every day whose units are all done into output/rad_mean.npz and trn_mean.npz,
+        once per day across all workers: a day is marked aggregated_day<N> in the queue only once both are saved,
+        and the aggregating_day<N> lock held meanwhile is given up if averaging fails (or taken over once stale,
+        see WorkQueue.lock), so the next worker averages the day again """
+
+    days = set(parse_unit(name)[0] for name in os.listdir(queue.path / 'done'))
+    for day in sorted(days):
+        counts = queue.counts('day%s_' %(day))
+        if counts['done'] < latitudes*len(limbs) or queue.marked('aggregated_day%s' %(day)) \
+            or not queue.lock('aggregating_day%s' %(day)):
+            continue
+        daypath = str(parentpath) + dayname %(day)
+        files = [str(daypath) + 'spectra/trn_%s_%s.txt' %(latitude, limb)
+                 for latitude in range(latitudes) for limb in limbs]
+        try:
+            aggregate_files(files, 'rad', rad_columns, fix_sign=True).save(str(daypath) + 'output/rad_mean.npz')
+            aggregate_files(files, 'trn', trn_columns).save(str(daypath) + 'output/trn_mean.npz')
+            queue.mark('aggregated_day%s' %(day))
+        finally:
+            queue.unlock('aggregating_day%s' %(day))
+        log('Averaged day: ' + str(day))
+
+
+def run_worker(queuepath, parentpath, cubes, client, write_configs, trn_columns, dayname='trap_day%s/',
+               batch=18, wait=False, poll=60, latitudes=90, limbs=(36,108), **options):
+
+    """ Work through the queue at queuepath until it is empty: claim batch units at a time, write their configs
+        in place under parentpath (dayname folders, as batch_job does), and with a client put them through PSG
+        and average each day once all its units are done
+        Start as many workers as wanted, on any nodes that see the shared queue and output folders; each one
+        also puts back stale claims of dead workers before claiming more
+        With wait, a worker that finds todo/ empty keeps polling every poll seconds while other workers still
+        hold claims, to take over any that go stale; otherwise it stops, and a later run picks them up
+        write_configs and trn_columns come from the column_writer.ColumnWriter of the run
+        Returns the number of units this worker finished or failed """
+
+    queue = WorkQueue(queuepath, **options)
+    profiles = {}
+    worked = 0
+    while True:
+        queue.recover()
+        names = queue.claim(batch)
+        if not names and wait and queue.counts()['claimed']:
+            time.sleep(poll)
+            continue
+        if not names:
+            break
+        with queue.renewing(names):
+            work_units(queue, names, parentpath, cubes, client, write_configs, dayname, profiles)
+        worked += len(names)
+        log('%s: %s units done, %s left' %(queue.worker, worked, queue.counts()['todo']))
+
+    if client is not None:
+        aggregate_finished(queue, parentpath, trn_columns, dayname, latitudes, limbs)
+
+    return worked
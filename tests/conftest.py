@@ -0,0 +1,29 @@
+"""
+Shared fixtures: synthetic UM cubes and templates from benchmark, and the flat modules in src/ on the path
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import pytest
+import benchmark
+import instrumentation
+
+
+@pytest.fixture(scope='session')
+def cubes():
+    return benchmark.synthetic_cubes(2)
+
+
+@pytest.fixture(scope='session')
+def templatepath(tmp_path_factory):
+    path = tmp_path_factory.mktemp('templates')
+    benchmark.synthetic_templates(path)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    instrumentation.set_verbosity(0)
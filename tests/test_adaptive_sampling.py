@@ -0,0 +1,29 @@
+"""
+Adaptive latitude sampling: interpolation weights and refinement
+"""
+
+import numpy as np
+import pytest
+from adaptive_sampling import interpolation_weights, refine
+
+
+def test_interpolation_weights():
+    assert interpolation_weights([0, 2, 3], 4) == [1.5, 1.5, 1.0]
+    assert interpolation_weights(range(5), 5) == [1.0]*5
+    weights = interpolation_weights([0, 8, 16, 24, 32, 40, 48, 56, 64, 72, 80, 88, 89], 90)
+    assert sum(weights) == pytest.approx(90)
+
+    values = np.random.default_rng(0).normal(size=4)
+    interpolated = np.interp(np.arange(10), [0, 3, 7, 9], values)
+    assert np.dot(interpolation_weights([0, 3, 7, 9], 10), values)/10 == pytest.approx(interpolated.mean())
+    # The weighted mean of the sampled latitudes is the mean over all latitudes interpolated linearly
+
+    with pytest.raises(ValueError):
+        interpolation_weights([1, 9], 10)
+
+
+def test_refine():
+    transits = {0: np.zeros(3), 4: np.array([0, 5e-6, 0]), 8: np.array([0, 5e-5, 0]), 9: np.array([0, 1e-4, 0])}
+    assert refine([0, 4, 8, 9], transits, threshold=10.0) == [6]
+    # 0 and 4 differ by 5 ppm, 4 and 8 by 45 ppm; 8 and 9 have no latitude in between
+    assert refine([0, 4, 8, 9], transits, threshold=50.0) == []
@@ -0,0 +1,28 @@
+"""
+Day archive files: members replaced in place, and sessions that never finish
+"""
+
+import day_archive
+
+
+def test_day_archive_round_trip(tmp_path):
+    daypath = str(tmp_path) + '/'
+    with day_archive.day_archive(daypath, 'a') as archive:
+        archive.write(day_archive.config_member(3, 36), 'config')
+        archive.write(day_archive.spectrum_member(3, 36), 'spectrum')
+    with day_archive.day_archive(daypath, 'a') as archive:
+        archive.write(day_archive.spectrum_member(3, 36), 'spectrum again')
+        assert archive.read(day_archive.config_member(3, 36)) == 'config'
+
+    with day_archive.day_archive(daypath) as archive:
+        assert archive.names() == [day_archive.config_member(3, 36), day_archive.spectrum_member(3, 36)]
+        assert len(archive.zip.infolist()) == 2
+        assert archive.read(day_archive.spectrum_member(3, 36)) == 'spectrum again'
+
+    archive = day_archive.day_archive(daypath, 'a')
+    archive.write(day_archive.spectrum_member(4, 36), 'never finished')
+    archive.zip.close()
+    # A session that stops before close leaves the archive as it was
+    with day_archive.day_archive(daypath) as archive:
+        assert day_archive.spectrum_member(4, 36) not in archive
+        assert archive.read(day_archive.spectrum_member(3, 36)) == 'spectrum again'
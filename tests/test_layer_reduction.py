@@ -0,0 +1,61 @@
+"""
+Regridding profiles onto fewer layers, and keeping the column amounts of water and cloud
+"""
+
+import numpy as np
+from column_writer import ColumnWriter
+from layer_reduction import layer_thickness, merge_levels, regrid_profiles
+from limb_extraction import extract_limbs, profile_fields
+from output_specs import OutputSpec
+from psg_output import cloud_trn_columns
+
+
+def test_merge_keeps_column_amounts(cubes):
+    coords, profiles = extract_limbs(cubes, 1)
+    reduced = merge_levels(profiles, 10)
+    assert reduced.shape == (180, 10, len(profile_fields))
+    pressure = profile_fields.index('pressure')
+    water = profile_fields.index('H2O')
+    thickness = layer_thickness(profiles[:,:,pressure])
+    levels = np.log(profiles[:,:,pressure]).mean(axis=0)
+    edges = np.linspace(levels[0], levels[-1], 11)[1:-1]
+    groups = np.sum(levels[:,np.newaxis] < edges[np.newaxis,:], axis=1)
+    merged = np.stack([thickness[:,groups == group].sum(axis=1) for group in range(10)], axis=1)
+    assert np.allclose(np.sum(reduced[:,:,water]*merged, axis=1), np.sum(profiles[:,:,water]*thickness, axis=1))
+    # Each merged layer times its thickness holds the water of the levels merged into it
+
+
+def smooth_profiles(columns=4, levels=60):
+    profiles = np.zeros((columns, levels, len(profile_fields)))
+    height = np.linspace(0, 1, levels)
+    for column in range(columns):
+        profiles[column,:,profile_fields.index('pressure')] = 1e5*np.exp(-8*height)
+        profiles[column,:,profile_fields.index('H2O')] = (1 + column)*1e-3*np.exp(-5*height)
+        profiles[column,:,profile_fields.index('liquid_cloud')] = 1e-5*np.exp(-((height - 0.2)/0.1)**2)
+        profiles[column,:,profile_fields.index('ice_cloud')] = 1e-6*np.exp(-((height - 0.5)/0.1)**2)
+    return profiles
+
+
+def test_regrid_within_tolerance(cubes):
+    profiles = smooth_profiles()
+    for method in ('logp', 'merge'):
+        reduced, errors = regrid_profiles(profiles, tolerance=0.05, method=method)
+        assert reduced.shape[1] < profiles.shape[1]
+        assert set(errors) == {'H2O', 'liquid_cloud', 'ice_cloud', 'profile'}
+        assert max(errors.values()) <= 0.05
+
+    coords, noisy = extract_limbs(cubes, 1)
+    reduced, errors = regrid_profiles(noisy, tolerance=1e-6)
+    assert reduced is noisy and max(errors.values()) < 1e-12
+    # No fewer layers keep the noisy synthetic columns that closely: they are left as they are
+
+
+def test_column_writer_regrids(tmp_path, cubes, templatepath):
+    spec = OutputSpec('cloud', 'trape_template.txt', layers=10)
+    writer = ColumnWriter(spec, cloud_trn_columns, 'trap_day%s/', templatepath)
+    daypath = str(tmp_path) + '/'
+    (tmp_path / 'configfiles').mkdir()
+    coords, profiles = extract_limbs(cubes, 1)
+    configs = writer.write_configs(daypath, coords[:2], profiles[:2])
+    lines = configs[0].splitlines()
+    assert len([line for line in lines if line.startswith('<ATMOSPHERE-LAYER-')]) == 10
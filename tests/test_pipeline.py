@@ -0,0 +1,27 @@
+"""
+Staged pipeline runs resumed from the manifest
+"""
+
+import os
+import config_writer
+from benchmark import FakePSG
+from psg_client import PSGClient
+
+
+def test_manifest_resume(tmp_path, cubes, templatepath, monkeypatch):
+    monkeypatch.setattr(config_writer, 'templatepath', templatepath)
+    parentpath = str(tmp_path) + '/'
+    with FakePSG(points=50) as psg, PSGClient(psg.url, workers=8) as client:
+        config_writer.pipeline_job(parentpath, cubes, 1, 1, client=client)
+        assert psg.requests == 180
+        means = os.path.getmtime(parentpath + 'trap_day1/output/trn_mean.npz')
+
+        config_writer.pipeline_job(parentpath, cubes, 1, 1, client=client)
+        assert psg.requests == 180
+        assert os.path.getmtime(parentpath + 'trap_day1/output/trn_mean.npz') == means
+        # Nothing changed: nothing is sent again and the means are not rewritten
+
+        os.remove(parentpath + 'trap_day1/spectra/trn_3_36.txt')
+        config_writer.pipeline_job(parentpath, cubes, 1, 1, client=client)
+        assert psg.requests == 181
+        assert os.path.exists(parentpath + 'trap_day1/spectra/trn_3_36.txt')
@@ -0,0 +1,21 @@
+"""
+Float32 working precision checked against float64
+"""
+
+import pytest
+from precision_check import check_configs, check_limb_means, last_digit, text_difference
+
+
+def test_text_difference():
+    assert last_digit('1.2345E+03') == pytest.approx(0.1)
+    difference = text_difference('<A>1.2346E+03,2.0000E-01\n', '<A>1.2345E+03,2.0000E-01\n')
+    assert difference == {'values': 2, 'differing': 1, 'max_digits': 1.0}
+    with pytest.raises(ValueError):
+        text_difference('<A>1.2345E+03\n', '<B>1.2345E+03\n')
+
+
+def test_float32_configs(cubes, templatepath):
+    for name, report in check_configs(cubes, 1, templatepath=templatepath).items():
+        assert report['values'] > 0 and report['max_digits'] <= 1, name
+    assert check_limb_means(cubes, 0, 1, templatepath=templatepath)['max_digits'] <= 1
+    # At most one in the last of the 4 decimal places written
@@ -0,0 +1,55 @@
+"""
+Clustered limb columns and their weighted means
+"""
+
+import numpy as np
+import pytest
+from benchmark import fake_spectrum
+from limb_extraction import extract_limbs
+from profile_clusters import reduce_profiles
+from psg_output import cloud_trn_columns, section_from_text
+from spectrum_aggregator import SpectrumAggregator, aggregate_files, spectrum_fingerprint
+
+
+def test_reduce_profiles(cubes):
+    coords, profiles = extract_limbs(cubes, 1)
+    reduced, reduced_profiles, weights, report = reduce_profiles(coords, profiles, k=10)
+    assert len(reduced) == len(weights) == report['groups'] <= 10
+    assert sum(weights) == len(coords) == len(report['labels'])
+    for coord, profile in zip(reduced, reduced_profiles):
+        assert np.array_equal(profile, profiles[coords.index(coord)])
+    # Each group is represented by one of its own columns
+    for cluster, weight in enumerate(weights):
+        assert report['labels'].count(cluster) == weight
+
+    reduced, reduced_profiles, weights, report = reduce_profiles(coords, profiles, tolerance=0.0)
+    assert set(report['profile_error'].values()) == {0.0}
+    with pytest.raises(ValueError):
+        reduce_profiles(coords, profiles)
+
+
+def test_weighted_mean_leaves_out_other_spectra(tmp_path):
+    names = []
+    for number, water in enumerate([0.01, 0.02, 0.5]):
+        names.append(str(tmp_path) + '/trn_%s_36.txt' %(number))
+        with open(names[-1], 'w') as file:
+            file.write(fake_spectrum('<ATMOSPHERE-LAYER-1>1,2,3,4,%s,6\n' %(water), points=10))
+    sections = [section_from_text(open(name).read(), 'trn') for name in names]
+    expected = (3*sections[0] + sections[1])[:,list(cloud_trn_columns)]/4
+
+    filename = str(tmp_path) + '/trn_mean.npz'
+    saved = SpectrumAggregator(cloud_trn_columns, ['trn_0_36.txt', 'trn_1_36.txt'])
+    for name, section, weight in zip(names, sections, [3, 1]):
+        saved.add(section, source=name.split('/')[-1], weight=weight, fingerprint=spectrum_fingerprint(name))
+    saved.save(filename)
+    # A clustered run of two representatives; trn_2_36.txt is left over from an earlier full run
+
+    aggregator = aggregate_files(names, 'trn', cloud_trn_columns, filename=filename)
+    assert aggregator.count == 4 and np.allclose(aggregator.mean()[1], expected)
+
+    with open(names[1], 'w') as file:
+        file.write(fake_spectrum('<ATMOSPHERE-LAYER-1>1,2,3,4,0.02,6\n', points=10) + '\n')
+    aggregator = aggregate_files(names, 'trn', cloud_trn_columns, filename=filename)
+    assert aggregator.count == 4 and np.allclose(aggregator.mean()[1], expected)
+    # Rebuilt after a spectrum was written again, still from the two representatives only
+    assert SpectrumAggregator.load(filename).expected == ['trn_0_36.txt', 'trn_1_36.txt']
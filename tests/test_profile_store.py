@@ -0,0 +1,49 @@
+"""
+Saved limb profiles: reuse, and refusing stale ones
+"""
+
+import json
+import numpy as np
+from limb_extraction import extract_limbs
+from profile_store import ProfileStore, file_fingerprint, load_profiles, store_version
+
+
+def save_store(filename, cubes, sources, version=store_version):
+    coords, profiles = extract_limbs(cubes, 1)
+    metadata = {'version': version, 'days': [1], 'limbs': [36, 108], 'coords': coords,
+                'sources': {str(source): file_fingerprint(source) for source in sources}}
+    np.savez(filename, profiles=profiles[None], metadata=json.dumps(metadata))
+
+
+def test_store_matches_cubes(tmp_path, cubes):
+    filename = str(tmp_path) + '/profiles.npz'
+    save_store(filename, cubes, [])
+    store = load_profiles(filename)
+    assert isinstance(store, ProfileStore)
+    coords, profiles = store.extract_limbs(1)
+    assert coords == extract_limbs(cubes, 1)[0]
+    assert np.array_equal(profiles, extract_limbs(cubes, 1)[1])
+
+
+def test_stale_profiles(tmp_path, cubes):
+    filename = str(tmp_path) + '/profiles.npz'
+    source = str(tmp_path) + '/um.pp'
+    with open(source, 'wb') as file:
+        file.write(b'model output')
+    assert load_profiles(filename, [source]) is None
+    # Not saved yet
+
+    save_store(filename, cubes, [source])
+    assert load_profiles(filename, [source]) is not None
+    assert load_profiles(filename, [source, str(tmp_path) + '/other.pp']) is None
+    # Made from other files
+
+    with open(source, 'wb') as file:
+        file.write(b'model output, run again')
+    assert load_profiles(filename, [source]) is None
+    assert load_profiles(filename) is not None
+    # Source changed since; without sourcefiles it is not checked
+
+    save_store(filename, cubes, [source], version=store_version - 1)
+    assert load_profiles(filename, [source]) is None
+    # Saved by another version
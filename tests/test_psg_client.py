@@ -0,0 +1,72 @@
+"""
+PSG client: response checks, retries, backoff and failover between servers
+"""
+
+import socket
+import pytest
+import psg_client
+from benchmark import FakePSG
+from psg_client import PSGClient, PSGError, check_spectrum
+
+
+def dead_url():
+
+    """ URL of a local port nothing is listening on """
+
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+
+    return 'http://localhost:%s/api.php' %(port)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr(psg_client.time, 'sleep', waits.append)
+    return waits
+
+
+def test_check_spectrum():
+    check_spectrum('# header\n# Wave/freq [um] Total\n1.00000e+00  2.00000e-01\n')
+    for text in ('', '  \n', '<!DOCTYPE html><html></html>', 'ERROR: bad config', '# header only\n'):
+        with pytest.raises(PSGError):
+            check_spectrum(text)
+
+
+def test_retry_then_succeed(sleeps, monkeypatch):
+    client = PSGClient('http://localhost:1/api.php', retries=3, backoff=0.5, cooldown=0.0)
+    answers = [OSError('refused'), OSError('refused'), '# header\n1.0  2.0\n']
+
+    def post(endpoint, body):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(client, 'post', post)
+    assert client.submit('config') == '# header\n1.0  2.0\n'
+    assert client.endpoints[0].failures == 2 and client.endpoints[0].requests == 1
+    assert sleeps == []
+    # A cooldown of 0 leaves the server healthy, so each retry goes straight back to it
+
+
+def test_backoff_then_fail(sleeps):
+    with PSGClient(dead_url(), timeout=5, retries=2, backoff=0.5, cooldown=60.0) as client:
+        with pytest.raises(PSGError, match='after 3 attempts'):
+            client.submit('config')
+        assert sleeps == [0.5, 1.0]
+        assert client.endpoints[0].failures == 3 and not client.endpoints[0].healthy
+
+
+def test_failover_to_healthy_endpoint(sleeps):
+    dead = dead_url()
+    with FakePSG(points=10) as psg, PSGClient([dead, psg.url], workers=2, timeout=5, cooldown=60.0) as client:
+        spectra = client.submit_batch(['<ATMOSPHERE-LAYER-1>1,2,3,4,%s,6\n' %(water) for water in range(6)])
+        assert len(spectra) == 6 and psg.requests == 6
+        throughput = client.throughput()
+        assert throughput[dead]['failures'] >= 1 and not throughput[dead]['healthy']
+        assert throughput[dead]['requests'] == 0
+        assert throughput[psg.url]['requests'] == 6 and throughput[psg.url]['healthy']
+    assert sleeps == []
+    # Another server was healthy each time, so no request waited
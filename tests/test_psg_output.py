@@ -0,0 +1,87 @@
+"""
+Finding and reading the sections of PSG output, and the per-directory section index
+"""
+
+import json
+import os
+import numpy as np
+import pytest
+import psg_output
+from benchmark import FakePSG, fake_spectrum
+from psg_client import PSGClient
+from psg_output import find_section, flush_indexes, read_named_section, scan_blocks, section_from_text, sections_from_text
+
+
+text = ('# Header\n'
+        '# Wave/freq [um] Total Noise Stellar Planet Transit Blocked\n'
+        '1.00000e+00  2.00000e+00 -3.00000e+00\n'
+        '1.10000e+00  2.10000e+00 -3.10000e+00\n'
+        '# Transmittance\n'
+        '# Wave/freq [um] Total N2 H2O CO2 Rayleigh\n'
+        '1.00000e+00  5.00000e-01\n')
+
+
+def test_scan_blocks():
+    lines = text.encode().splitlines(keepends=True)
+    blocks = scan_blocks(lines)
+    assert [block[1:] for block in blocks] == [[2, 'Wave/freq [um] Total Noise Stellar Planet Transit Blocked', 2],
+                                               [1, 'Wave/freq [um] Total N2 H2O CO2 Rayleigh', 6]]
+    assert text.encode()[blocks[1][0]:].startswith(lines[6])
+
+
+def test_find_section():
+    blocks = scan_blocks(text.encode().splitlines(keepends=True))
+    assert find_section(blocks, 'rad') is blocks[0]
+    assert find_section(blocks, 'trn') is blocks[1]
+    with pytest.raises(ValueError, match='No rad section'):
+        find_section(blocks[1:], 'rad')
+
+
+def test_section_from_text():
+    rad = section_from_text(text, 'rad', fix_sign=True)
+    assert np.array_equal(rad, [[1.0, 2.0, 3.0], [1.1, 2.1, 3.1]])
+    spectrum = fake_spectrum('<ATMOSPHERE-LAYER-1>1,2,3,4,0.01,6\n', points=20)
+    assert section_from_text(spectrum, 'trn').shape == (20, 9)
+    assert section_from_text(spectrum, 'rad').shape == (20, 7)
+
+
+@pytest.fixture
+def indexes(monkeypatch):
+    monkeypatch.setattr(psg_output, 'directory_indexes', {})
+    monkeypatch.setattr(psg_output, 'pending_indexes', {})
+
+
+def test_index_written_once_and_invalidated(tmp_path, indexes):
+    names = [str(tmp_path) + '/trn_%s_36.txt' %(latitude) for latitude in range(3)]
+    for name in names:
+        with open(name, 'w') as file:
+            file.write(text)
+    for name in names:
+        assert read_named_section(name, 'trn').shape == (1, 2)
+    assert not os.path.exists(str(tmp_path) + '/' + psg_output.index_filename)
+    flush_indexes()
+    with open(str(tmp_path) + '/' + psg_output.index_filename) as file:
+        assert sorted(json.load(file)['files']) == ['trn_0_36.txt', 'trn_1_36.txt', 'trn_2_36.txt']
+    # Three spectra indexed, one index write
+
+    with open(names[0], 'w') as file:
+        file.write(text.replace('5.00000e-01', '2.50000e-01\n1.10000e+00  7.50000e-01'))
+    psg_output.directory_indexes.clear()
+    assert np.array_equal(read_named_section(names[0], 'trn'), [[1.0, 0.25], [1.1, 0.75]])
+    # Written again since it was indexed: the saved entry no longer matches and the file is scanned again
+    assert list(psg_output.pending_indexes[str(tmp_path)]) == ['trn_0_36.txt']
+
+
+def test_compact_response():
+    config = '<ATMOSPHERE-LAYER-1>1,2,3,4,0.01,6\n'
+    with FakePSG(points=20) as psg:
+        with PSGClient(psg.url, workers=1) as client:
+            full = client.submit(config)
+        with PSGClient(psg.url, workers=1, types=('rad', 'trn')) as client:
+            assert client.params == (('type', 'rad,trn'), ('whdr', 'y'))
+            compact = client.submit(config)
+    assert len(compact) < len(full)
+    assert '# Noise' in full and '# Noise' not in compact
+    # Only the output types asked for come back
+    for section, expected in sections_from_text(full).items():
+        assert np.array_equal(sections_from_text(compact)[section], expected)
@@ -0,0 +1,40 @@
+"""
+Template parsing and rendering
+"""
+
+import numpy as np
+import psg_template
+from psg_template import PSGTemplate, load_template, reduce_layers
+
+
+lines = ['<OBJECT>100% lit\n', '<ATMOSPHERE-LAYERS>3\n', '<ATMOSPHERE-LAYER-1>\n', '<ATMOSPHERE-LAYER-2>\n',
+         '<ATMOSPHERE-LAYER-3>\n', '<GENERATOR>end\n']
+
+
+def test_render_fills_only_the_layers():
+    template = PSGTemplate(lines, 2, 3, 2)
+    profile = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0], [7.0, 8.0]])
+    config = template.render(profile)
+    assert config.splitlines() == ['<OBJECT>100% lit', '<ATMOSPHERE-LAYERS>3',
+                                   '<ATMOSPHERE-LAYER-1>1.0000E+00,2.0000E+00',
+                                   '<ATMOSPHERE-LAYER-2>3.0000E+00,4.0000E+00',
+                                   '<ATMOSPHERE-LAYER-3>5.0000E+00,6.0000E+00', '<GENERATOR>end']
+    assert template.render_batch(np.stack([profile, 2*profile])) == [config, template.render(2*profile)]
+
+
+def test_reduce_layers():
+    reduced = reduce_layers(lines, 2, 3, 2)
+    assert reduced == ['<OBJECT>100% lit\n', '<ATMOSPHERE-LAYERS>2\n', '<ATMOSPHERE-LAYER-1>\n',
+                       '<ATMOSPHERE-LAYER-2>\n', '<GENERATOR>end\n']
+
+
+def test_template_read_once(tmp_path, monkeypatch):
+    monkeypatch.setitem(psg_template.template_layouts, 'test.txt', (2, 3, 2))
+    with open(str(tmp_path) + '/test.txt', 'w') as file:
+        file.writelines(lines)
+    template = load_template('test.txt', tmp_path)
+    reduced = load_template('test.txt', tmp_path, layers=2)
+    assert reduced.layers == 2 and '<ATMOSPHERE-LAYERS>2' in reduced.format
+    with open(str(tmp_path) + '/test.txt', 'w') as file:
+        file.write('changed')
+    assert load_template('test.txt', tmp_path) is template
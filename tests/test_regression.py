@@ -0,0 +1,103 @@
+"""
+Configs written from benchmark.synthetic_cubes(2), day 1, pinned to those of the original per-column scripts
+(config_writer, vapour_only_config and rapid_config as first committed), so that faster ways of writing them
+keep writing the same bytes
+"""
+
+import contextlib
+import hashlib
+import io
+import numpy as np
+import pytest
+import config_writer
+import output_specs
+import rapid_config
+import vapour_only_config
+from limb_extraction import extract_limbs, limb_mean_profiles, profile_fields
+from precision_check import number_pattern
+
+
+day = 1
+
+cloud_hash = '85c04387ea5f21da8d58b12fadc9e465e3c801676a21d26ef661b0ee4887d046'
+vapour_hash = 'd613373cefd269c7addcfbd617ac544d1ae0bc74bbdf03b8f9268d2720a75991'
+# sha256 of the configs of every limb column, latitude by latitude, east limb then west limb
+
+rapid_hash = '7e1764b0948ed44753ebbb30d9f2f8380bdc6073c3d376a2fe78cee3e987d29d'
+# sha256 of the limb-mean config with subnormal float32 values masked: the original script averaged the float32
+# cube data in float32, which rounds cloud amounts below float32's normal range (~1e-44) differently
+
+
+def digest(texts):
+    sha = hashlib.sha256()
+    for text in texts:
+        sha.update(text.encode())
+    return sha.hexdigest()
+
+
+def normal_values(text):
+    tiny = np.finfo(np.float32).tiny
+    return number_pattern.sub(lambda match: 'subnormal' if 0 < abs(float(match.group())) < tiny else match.group(),
+                              text)
+
+
+@pytest.fixture(autouse=True)
+def templates(templatepath, monkeypatch):
+    for module in (config_writer, vapour_only_config, rapid_config):
+        monkeypatch.setattr(module, 'templatepath', templatepath)
+
+
+def column_configs(daypath):
+    return [open(str(daypath) + 'configfiles/config_%s_%s.txt' %(latitude, limb)).read()
+            for latitude in range(90) for limb in (36, 108)]
+
+
+def test_extract_limbs(cubes):
+    coords, profiles = extract_limbs(cubes, day)
+    assert coords[:3] == [(0, 36), (0, 108), (1, 36)]
+    assert profiles.shape == (180, 62, len(profile_fields))
+    pressure = cubes.extract_cube('air_pressure').data[day, :, 1, 108]
+    assert np.array_equal(profiles[3,:,profile_fields.index('pressure')], pressure)
+
+
+def test_cloud_configs(tmp_path, cubes):
+    daypath = str(tmp_path) + '/'
+    coords, configs, weights = config_writer.write_day(daypath, cubes, day)
+    assert digest(configs) == cloud_hash
+    assert digest(column_configs(daypath)) == cloud_hash
+
+
+def test_vapour_configs(tmp_path, cubes):
+    daypath = str(tmp_path) + '/'
+    coords, configs, weights = vapour_only_config.write_day(daypath, cubes, day)
+    assert digest(configs) == vapour_hash
+    assert digest(column_configs(daypath)) == vapour_hash
+
+
+def test_output_products(tmp_path, cubes, templatepath):
+    parentpath = str(tmp_path) + '/'
+    output_specs.write_products(parentpath, cubes, day, templatepath=templatepath)
+    assert digest(column_configs(parentpath + 'trap_day%s/' %(day))) == cloud_hash
+    assert digest(column_configs(parentpath + 'tall_day%s/' %(day))) == vapour_hash
+    with contextlib.redirect_stdout(io.StringIO()):
+        rapid_config.rapid_config(parentpath, cubes, day)
+    with open(parentpath + 'configfiles/day_%s.txt' %(day)) as product, open(parentpath + 'day_%s.txt' %(day)) as rapid:
+        assert product.read() == rapid.read()
+
+
+def test_rapid_config(tmp_path, cubes):
+    daypath = str(tmp_path) + '/'
+    with contextlib.redirect_stdout(io.StringIO()):
+        rapid_config.rapid_config(daypath, cubes, day)
+    with open(daypath + 'day_%s.txt' %(day)) as file:
+        assert digest([normal_values(file.read())]) == rapid_hash
+    configs = rapid_config.rapid_configs(daypath, cubes, (day, day))
+    assert digest([normal_values(configs[0])]) == rapid_hash
+
+
+def test_limb_means_dtype(cubes):
+    days, means = limb_mean_profiles(cubes, 0, 1)
+    days, single = limb_mean_profiles(cubes, 0, 1, dtype=np.dtype('float32'))
+    assert days == [0, 1] and single.dtype == np.float64
+    assert np.allclose(single, means, rtol=1e-5, atol=0)
+    # Converted in float32 whether dtype is given as a type or a numpy dtype, added up in float64
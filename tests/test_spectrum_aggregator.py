@@ -0,0 +1,56 @@
+"""
+Running means of spectra, resumed and rebuilt from saved totals
+"""
+
+import numpy as np
+import spectrum_aggregator
+from benchmark import fake_spectrum
+from psg_output import cloud_trn_columns, section_from_text
+from spectrum_aggregator import SpectrumAggregator, aggregate_files, spectrum_fingerprint
+
+
+def write_spectra(tmp_path, waters):
+    names = []
+    for number, water in enumerate(waters):
+        names.append(str(tmp_path) + '/trn_%s_36.txt' %(number))
+        with open(names[-1], 'w') as file:
+            file.write(fake_spectrum('<ATMOSPHERE-LAYER-1>1,2,3,4,%s,6\n' %(water), points=10))
+    return names
+
+
+def expected_mean(names, weights):
+    sections = [section_from_text(open(name).read(), 'trn')[:,list(cloud_trn_columns)] for name in names]
+    return sum(weight*section for weight, section in zip(weights, sections))/sum(weights)
+
+
+def test_resume_reads_only_new_spectra(tmp_path, monkeypatch):
+    names = write_spectra(tmp_path, [0.01, 0.02, 0.03])
+    filename = str(tmp_path) + '/trn_mean.npz'
+    aggregate_files(names[:2], 'trn', cloud_trn_columns, filename=filename)
+
+    read = []
+    reader = spectrum_aggregator.read_named_section
+    monkeypatch.setattr(spectrum_aggregator, 'read_named_section',
+                        lambda name, *args, **kwargs: read.append(name) or reader(name, *args, **kwargs))
+    aggregator = aggregate_files(names, 'trn', cloud_trn_columns, filename=filename)
+    assert read == names[2:]
+    assert aggregator.count == 3
+    assert np.allclose(aggregator.mean()[1], expected_mean(names, [1, 1, 1]))
+
+
+def test_rebuild_keeps_saved_weights(tmp_path):
+    names = write_spectra(tmp_path, [0.01, 0.02])
+    filename = str(tmp_path) + '/trn_mean.npz'
+    saved = SpectrumAggregator(cloud_trn_columns)
+    for name, weight in zip(names, [3, 1]):
+        saved.add(section_from_text(open(name).read(), 'trn'), source=name.split('/')[-1], weight=weight,
+                  fingerprint=spectrum_fingerprint(name))
+    saved.save(filename)
+
+    with open(names[0], 'w') as file:
+        file.write(fake_spectrum('<ATMOSPHERE-LAYER-1>1,2,3,4,0.5,6\n', points=10) + '\n')
+    # Written again after the save
+    aggregator = aggregate_files(names, 'trn', cloud_trn_columns, filename=filename)
+    assert aggregator.count == 4
+    assert np.allclose(aggregator.mean()[1], expected_mean(names, [3, 1]))
+    assert np.allclose(SpectrumAggregator.load(filename).mean()[1], aggregator.mean()[1])
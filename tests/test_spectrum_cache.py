@@ -0,0 +1,42 @@
+"""
+Spectrum cache eviction and concurrent writes
+"""
+
+import os
+import socket
+import spectrum_cache
+from spectrum_cache import SpectrumCache
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = SpectrumCache(tmp_path, max_bytes=2500)
+    cache.put('first', (), 'a'*1000)
+    cache.put('second', (), 'b'*1000)
+    os.utime(cache.filename(cache.key('first', ())), (1000, 1000))
+    os.utime(cache.filename(cache.key('second', ())), (2000, 2000))
+    assert cache.get('first', ()) == 'a'*1000
+    # Reading marks first as used now, so second is the least recently used
+
+    cache.put('third', (), 'c'*1000)
+    assert cache.get('second', ()) is None
+    assert cache.get('first', ()) == 'a'*1000
+    assert cache.get('third', ()) == 'c'*1000
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] <= 0.9*2500
+
+
+def test_temporary_names_and_vanished_files(tmp_path, monkeypatch):
+    cache = SpectrumCache(tmp_path)
+    temporaries = []
+
+    def replace(source, destination):
+        temporaries.append(str(source))
+        os.remove(source)
+        raise FileNotFoundError(source)
+
+    monkeypatch.setattr(spectrum_cache.os, 'replace', replace)
+    cache.put('config', (), 'spectrum')
+    # Another job clearing the cache mid-write: the spectrum is not cached, and nothing is raised
+    assert '.%s.%s.' %(socket.gethostname(), os.getpid()) in temporaries[0]
+    assert cache.get('config', ()) is None
+    assert cache.stats()['bytes'] == 0
@@ -0,0 +1,46 @@
+"""
+Lazy loading of the limb columns from UM output files
+"""
+
+import hashlib
+import pytest
+import config_writer
+
+
+file_hash = '806f3aaa417508bd50441de959397b1f1578eb2bf2d75e4b62deefe2b7d15b33'
+# sha256 of the day 1 configs written from benchmark.synthetic_cubes(2) saved to netCDF and loaded back;
+# not test_regression.cloud_hash, since masked netCDF data promotes the water vapour to float64
+
+
+@pytest.fixture
+def umfile(tmp_path, cubes, templatepath, monkeypatch):
+    iris = pytest.importorskip('iris')
+    pytest.importorskip('netCDF4')
+    monkeypatch.setattr(config_writer, 'templatepath', templatepath)
+    filename = str(tmp_path) + '/um.nc'
+    iris.save(cubes, filename)
+    return filename
+
+
+def day_hash(tmp_path, cubes, day):
+    coords, configs, weights = config_writer.write_day(str(tmp_path) + '/', cubes, day)
+    sha = hashlib.sha256()
+    for config in configs:
+        sha.update(config.encode())
+    return sha.hexdigest()
+
+
+def test_lazy_loading(tmp_path, umfile):
+    import um_loader
+    lazy = um_loader.load_limbs([umfile], 1, 1)
+    assert lazy.extract_cube('air_pressure').has_lazy_data()
+    assert day_hash(tmp_path, lazy, 1) == file_hash
+
+
+def test_negative_days(tmp_path, umfile):
+    import um_loader
+    lazy = um_loader.load_limbs([umfile], -1, -1)
+    assert lazy.extract_cube('air_pressure').coord('day_index').points.tolist() == [1]
+    assert day_hash(tmp_path, lazy, 1) == file_hash
+    both = um_loader.load_limbs([umfile], -2, -1)
+    assert both.extract_cube('air_pressure').coord('day_index').points.tolist() == [0, 1]
@@ -0,0 +1,67 @@
+"""
+Shared-filesystem work queue: claims, recovery, attempts, and what counts as done
+"""
+
+import os
+import time
+from psg_client import PSGError
+from work_queue import WorkQueue, unit_name, work_units
+
+
+def test_queue_claims_once_and_recovers_stale_claims(tmp_path):
+    names = ['day0_lat%s_lon36' %(latitude) for latitude in range(4)]
+    first = WorkQueue(tmp_path, timeout=60, worker='first')
+    second = WorkQueue(tmp_path, timeout=60, worker='second')
+    assert first.add(names) == 4
+    assert first.add(names) == 0
+
+    claimed = first.claim(3)
+    assert claimed == names[:3]
+    assert second.claim(3) == names[3:]
+    assert second.claim(3) == []
+
+    stale = time.time() - 120
+    for name in claimed:
+        os.utime(first.file('claimed', name), (stale, stale))
+    with second.renewing(names[3:], interval=0.01):
+        time.sleep(0.05)
+        assert second.recover() == 3
+    # Only the dead worker's claims go back; the live one renews its own
+    assert first.counts() == {'todo': 3, 'claimed': 1, 'done': 0, 'failed': 0}
+
+    limited = WorkQueue(tmp_path, timeout=60, attempts=2)
+    for name in limited.claim(3):
+        limited.fail(name, 'PSG down')
+    assert limited.counts()['todo'] == 3
+    for name in limited.claim(3):
+        limited.fail(name, 'PSG down')
+    assert limited.counts() == {'todo': 0, 'claimed': 1, 'done': 0, 'failed': 3}
+    assert limited.read('failed', names[0])['error'] == 'PSG down'
+
+
+class HalfPSG:
+
+    """ Client whose requests for the second half of a batch fail """
+
+    def submit_batch(self, configs, outnames=None, callback=None):
+        for index, config in enumerate(configs[:len(configs)//2]):
+            with open(outnames[index], 'w') as file:
+                file.write('spectrum')
+            callback(index, 'spectrum')
+        raise PSGError('%s of %s PSG requests failed' %(len(configs) - len(configs)//2, len(configs)))
+
+
+def test_failed_request_is_not_done(tmp_path, cubes):
+    queue = WorkQueue(str(tmp_path) + '/queue')
+    names = [unit_name(1, latitude, 36) for latitude in range(4)]
+    queue.add(names)
+    parentpath = str(tmp_path) + '/'
+    os.makedirs(parentpath + 'trap_day1/spectra')
+    with open(parentpath + 'trap_day1/spectra/trn_3_36.txt', 'w') as file:
+        file.write('spectrum from an earlier run')
+    # Left by an earlier run; this run's request for it fails
+
+    work_units(queue, queue.claim(4), parentpath, cubes, HalfPSG(),
+               lambda daypath, coords, profiles: ['config']*len(coords), 'trap_day%s/', {})
+    assert queue.counts() == {'todo': 2, 'claimed': 0, 'done': 2, 'failed': 0}
+    assert sorted(os.listdir(queue.path / 'todo')) == names[2:]